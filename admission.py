@@ -0,0 +1,393 @@
+"""
+호출자(테넌트)별 속도 제한과 가중 공정 큐 (generate_with_vllm 앞단)
+- 속도 제한: 테넌트별 토큰 버킷 두 개
+  - 요청/초: 생성 엔드포인트 HTTP 요청마다 1 (미들웨어, 초과 시 429)
+  - 토큰/초: 생성마다 추정 토큰(프롬프트 + 이미지 + max_tokens)을 선차감, 생성 후 실제 사용량과의 차이를 환급
+- 가중 공정 큐 (start-time fair queuing): 엔진 동시 실행 수나 KV 캐시 용량을 넘는 생성은 대기하고,
+  비어 있는 자리는 테넌트 가중치에 비례해 배분 (한 테넌트가 몰아 보내도 다른 테넌트 지연은 일정)
+- 비용 기반 승인: 생성마다 KV 캐시 사용량(프롬프트 + 이미지 + max_tokens 토큰 → block_size 단위 블록)을 추정해
+  엔진이 gpu_memory_utilization으로 확보한 블록 수 안에서만 동시에 실행 (엔진 내부 선점/스왑 방지)
+- 테넌트 식별자는 사용량 원장과 같은 호출자 ID (key-…, anonymous, 내부 작업은 internal)
+"""
+
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from .logger_config import app_logger as logger
+from .usage_ledger import INTERNAL, current_caller
+
+
+# 0이면 해당 제한 끔
+RATE_LIMIT_REQUESTS_PER_SECOND = float(os.getenv("RATE_LIMIT_REQUESTS_PER_SECOND", "0"))
+RATE_LIMIT_REQUEST_BURST = float(os.getenv("RATE_LIMIT_REQUEST_BURST", "10"))
+RATE_LIMIT_TOKENS_PER_SECOND = float(os.getenv("RATE_LIMIT_TOKENS_PER_SECOND", "0"))
+RATE_LIMIT_TOKEN_BURST = float(os.getenv("RATE_LIMIT_TOKEN_BURST", "16384"))
+# 토큰 버킷이 이 시간 안에 채워지면 기다렸다가 진행, 아니면 429
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "2"))
+# 엔진에 동시에 넣는 생성 수 (0이면 engine_config의 max_num_seqs)
+FAIR_QUEUE_MAX_CONCURRENCY = int(os.getenv("FAIR_QUEUE_MAX_CONCURRENCY", "0"))
+# 동시에 예약할 KV 캐시 블록 수 (0이면 엔진이 할당한 num_gpu_blocks × ADMISSION_KV_HEADROOM)
+ADMISSION_KV_BLOCKS = int(os.getenv("ADMISSION_KV_BLOCKS", "0"))
+# prefix cache와 추정 오차를 위한 여유분을 뺀 비율
+ADMISSION_KV_HEADROOM = float(os.getenv("ADMISSION_KV_HEADROOM", "0.9"))
+# "key-1a2b3c4d5e6f:4,anonymous:1" (호출자 ID는 /usage 응답 참고)
+FAIR_QUEUE_WEIGHTS = os.getenv("FAIR_QUEUE_WEIGHTS", "")
+FAIR_QUEUE_DEFAULT_WEIGHT = float(os.getenv("FAIR_QUEUE_DEFAULT_WEIGHT", "1"))
+FAIR_QUEUE_TIMEOUT_SECONDS = float(os.getenv("FAIR_QUEUE_TIMEOUT_SECONDS", "300"))
+# 테넌트 상태 보관 상한 (넘으면 유휴 테넌트부터 정리)
+ADMISSION_MAX_TENANTS = int(os.getenv("ADMISSION_MAX_TENANTS", "10000"))
+
+# 요청/초 제한을 적용할 생성 엔드포인트
+RATE_LIMITED_PATHS = ("/generate", "/vision", "/vision/multi", "/multimodal", "/upload")
+
+
+class RateLimited(HTTPException):
+    def __init__(self, retry_after: float, detail: str):
+        super().__init__(
+            status_code=429,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+class QueueTimeout(HTTPException):
+    def __init__(self, waited: float):
+        super().__init__(status_code=503, detail=f"생성 대기열에서 {waited:.0f}초 동안 처리되지 못했습니다")
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    weights: Dict[str, float] = {}
+    for item in spec.split(","):
+        name, sep, value = item.strip().rpartition(":")
+        if not sep or not name:
+            continue
+        try:
+            weight = float(value)
+        except ValueError:
+            logger.warning(f"⚠️ FAIR_QUEUE_WEIGHTS 항목 무시: {item.strip()}")
+            continue
+        if weight > 0:
+            weights[name] = weight
+    return weights
+
+
+class TokenBucket:
+    """초당 rate만큼 채워지고 burst까지 쌓이는 버킷 (잔량은 예약으로 음수가 될 수 있음)"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, max_wait: float) -> Optional[float]:
+        """amount를 예약하고 기다려야 할 초 반환. max_wait를 넘으면 예약하지 않고 None"""
+        self._refill()
+        amount = min(amount, self.burst)
+        wait = max(0.0, (amount - self.tokens) / self.rate)
+        if wait > max_wait:
+            return None
+        self.tokens -= amount
+        return wait
+
+    def retry_after(self, amount: float) -> float:
+        self._refill()
+        return max(0.0, (min(amount, self.burst) - self.tokens) / self.rate)
+
+    def refund(self, amount: float) -> None:
+        if amount > 0:
+            self._refill()
+            self.tokens = min(self.burst, self.tokens + amount)
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class _Tenant:
+    __slots__ = ("weight", "requests", "tokens", "last_finish", "queued", "running", "last_seen", "stats")
+
+    def __init__(self, weight: float, rps: float, tps: float):
+        self.weight = weight
+        self.requests = TokenBucket(rps, RATE_LIMIT_REQUEST_BURST) if rps > 0 else None
+        self.tokens = TokenBucket(tps, RATE_LIMIT_TOKEN_BURST) if tps > 0 else None
+        self.last_finish = 0.0
+        self.queued = 0
+        self.running = 0
+        self.last_seen = time.monotonic()
+        self.stats: Dict[str, int] = {"admitted": 0, "queued_total": 0, "rate_limited": 0, "timeouts": 0}
+
+    @property
+    def idle(self) -> bool:
+        return (
+            self.queued == 0
+            and self.running == 0
+            and (self.requests is None or self.requests.full)
+            and (self.tokens is None or self.tokens.full)
+        )
+
+
+class _Waiter:
+    __slots__ = ("finish", "seq", "start", "tenant", "cost", "future")
+
+    def __init__(self, finish: float, seq: int, start: float, tenant: _Tenant, cost: int, future: "asyncio.Future[None]"):
+        self.finish = finish
+        self.seq = seq
+        self.start = start
+        self.tenant = tenant
+        self.cost = cost
+        self.future = future
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.finish, self.seq) < (other.finish, other.seq)
+
+
+class Ticket:
+    """승인된 생성 하나 (예약한 KV 블록, 대기 시간, 환급용 추정 토큰)"""
+
+    __slots__ = ("tenant", "cost", "estimated_tokens", "wait_ms")
+
+    def __init__(self, tenant: _Tenant, cost: int, estimated_tokens: float, wait_ms: float):
+        self.tenant = tenant
+        self.cost = cost
+        self.estimated_tokens = estimated_tokens
+        self.wait_ms = wait_ms
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        capacity: int = FAIR_QUEUE_MAX_CONCURRENCY,
+        weights: Optional[Dict[str, float]] = None,
+        requests_per_second: float = RATE_LIMIT_REQUESTS_PER_SECOND,
+        tokens_per_second: float = RATE_LIMIT_TOKENS_PER_SECOND,
+        max_wait: float = RATE_LIMIT_MAX_WAIT_SECONDS,
+        queue_timeout: float = FAIR_QUEUE_TIMEOUT_SECONDS,
+        kv_blocks: int = ADMISSION_KV_BLOCKS,
+    ):
+        # 0이면 엔진 초기화 후 configure()에서 max_num_seqs / num_gpu_blocks로 설정
+        self.capacity = max(0, capacity)
+        self.kv_capacity_blocks = max(0, kv_blocks)
+        self.block_size = 0
+        self.max_model_len = 0
+        self.weights = weights if weights is not None else parse_weights(FAIR_QUEUE_WEIGHTS)
+        self.requests_per_second = requests_per_second
+        self.tokens_per_second = tokens_per_second
+        self.max_wait = max_wait
+        self.queue_timeout = queue_timeout
+        self._tenants: Dict[str, _Tenant] = {}
+        self._heap: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._vtime = 0.0
+        self._running = 0
+        self._blocks_in_use = 0
+        self.stats: Dict[str, Any] = {"admitted": 0, "queued_total": 0, "rate_limited": 0, "timeouts": 0, "queue_wait_ms": 0.0}
+
+    def configure(self, engine_config: Dict[str, Any]) -> None:
+        """엔진 설정으로 동시 실행/KV 블록 한도 결정 (환경변수로 지정한 값이 우선)"""
+        if self.capacity <= 0:
+            self.capacity = int(engine_config.get("max_num_seqs") or 0)
+        self.block_size = int(engine_config.get("block_size") or 0)
+        self.max_model_len = int(engine_config.get("max_model_len") or 0)
+        num_gpu_blocks = engine_config.get("num_gpu_blocks")
+        if self.kv_capacity_blocks <= 0 and num_gpu_blocks:
+            self.kv_capacity_blocks = int(num_gpu_blocks * ADMISSION_KV_HEADROOM)
+        if self.kv_capacity_blocks > 0 and self.block_size > 0:
+            kv_info = f"KV 블록 {self.kv_capacity_blocks}개 × {self.block_size}토큰"
+        else:
+            # 블록 수를 알 수 없으면 동시 실행 수만 제한
+            self.kv_capacity_blocks = 0
+            kv_info = "KV 블록 수 확인 불가 (ADMISSION_KV_BLOCKS로 지정 가능)"
+        logger.info(f"🚦 생성 승인 한도: 동시 {self.capacity}개, {kv_info} (가중치 {self.weights or '기본'})")
+
+    def kv_blocks(self, tokens: float) -> int:
+        """토큰 수 → KV 캐시 블록 수 (max_model_len에서 자름)"""
+        if self.block_size <= 0:
+            return 1
+        if self.max_model_len > 0:
+            tokens = min(tokens, self.max_model_len)
+        return max(1, math.ceil(tokens / self.block_size))
+
+    # ===== 속도 제한 =====
+    def check_request_rate(self) -> Optional[RateLimited]:
+        """생성 엔드포인트 요청 1건 차감. 초과면 예외 객체 반환 (미들웨어에서 응답으로 변환)"""
+        tenant = self._tenant()
+        if tenant is None or tenant.requests is None:
+            return None
+        if tenant.requests.reserve(1, 0.0) is None:
+            tenant.stats["rate_limited"] += 1
+            self.stats["rate_limited"] += 1
+            return RateLimited(tenant.requests.retry_after(1), "요청 속도 제한을 초과했습니다")
+        return None
+
+    # ===== 생성 승인 =====
+    @asynccontextmanager
+    async def admit(self, estimated_tokens: float) -> AsyncIterator[Ticket]:
+        """토큰/초 제한 → 공정 큐 대기 → 실행 슬롯과 KV 블록 확보"""
+        t0 = time.monotonic()
+        tenant = self._tenant() or self._internal
+        if tenant.tokens is not None:
+            wait = tenant.tokens.reserve(estimated_tokens, self.max_wait)
+            if wait is None:
+                tenant.stats["rate_limited"] += 1
+                self.stats["rate_limited"] += 1
+                raise RateLimited(tenant.tokens.retry_after(estimated_tokens), "토큰 속도 제한을 초과했습니다")
+            if wait > 0:
+                await asyncio.sleep(wait)
+        # 공정 큐 비용도 KV 블록 기준 (큰 멀티 이미지 요청은 그만큼 테넌트 몫을 더 씀)
+        cost = self.kv_blocks(estimated_tokens)
+        await self._acquire(tenant, cost)
+        ticket = Ticket(tenant, cost, estimated_tokens, round((time.monotonic() - t0) * 1000, 1))
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    def settle(self, ticket: Ticket, used_tokens: float) -> None:
+        """실제 사용 토큰이 추정보다 적으면 차액을 버킷에 환급"""
+        if ticket.tenant.tokens is not None:
+            ticket.tenant.tokens.refund(ticket.estimated_tokens - used_tokens)
+
+    def get_stats(self) -> Dict[str, Any]:
+        busiest = sorted(self._tenants.items(), key=lambda kv: kv[1].queued + kv[1].running, reverse=True)[:20]
+        return {
+            "capacity": self.capacity,
+            "running": self._running,
+            "kv_capacity_blocks": self.kv_capacity_blocks or None,
+            "kv_blocks_in_use": self._blocks_in_use,
+            "kv_utilization": round(self._blocks_in_use / self.kv_capacity_blocks, 3) if self.kv_capacity_blocks else None,
+            "block_size": self.block_size or None,
+            "queued": sum(1 for w in self._heap if not w.future.done()),
+            "requests_per_second": self.requests_per_second or None,
+            "tokens_per_second": self.tokens_per_second or None,
+            "weights": self.weights,
+            "tenants": len(self._tenants),
+            "top_tenants": {
+                name: {"weight": t.weight, "queued": t.queued, "running": t.running, **t.stats} for name, t in busiest
+            },
+            **{k: (round(v, 1) if isinstance(v, float) else v) for k, v in self.stats.items()},
+        }
+
+    # ===== 내부 구현 =====
+    @property
+    def _internal(self) -> _Tenant:
+        tenant = self._tenants.get(INTERNAL)
+        if tenant is None:
+            tenant = self._tenants[INTERNAL] = _Tenant(self.weights.get(INTERNAL, FAIR_QUEUE_DEFAULT_WEIGHT), 0, 0)
+        return tenant
+
+    def _tenant(self) -> Optional[_Tenant]:
+        """현재 호출자의 테넌트 상태 (내부 작업은 속도 제한 없음 → None)"""
+        name = current_caller()
+        if name == INTERNAL:
+            return None
+        tenant = self._tenants.get(name)
+        if tenant is None:
+            if len(self._tenants) >= ADMISSION_MAX_TENANTS:
+                self._prune()
+            tenant = self._tenants[name] = _Tenant(
+                self.weights.get(name, FAIR_QUEUE_DEFAULT_WEIGHT), self.requests_per_second, self.tokens_per_second
+            )
+        tenant.last_seen = time.monotonic()
+        return tenant
+
+    def _prune(self) -> None:
+        idle = sorted((t.last_seen, name) for name, t in self._tenants.items() if t.idle)
+        for _, name in idle[: max(1, len(self._tenants) // 10)]:
+            del self._tenants[name]
+
+    async def _acquire(self, tenant: _Tenant, cost: int) -> None:
+        # start-time fair queuing: 테넌트의 직전 종료 태그 이후부터 cost/weight만큼 진행
+        start = max(self._vtime, tenant.last_finish)
+        finish = start + cost / tenant.weight
+        previous_finish, tenant.last_finish = tenant.last_finish, finish
+        if not self._heap and self._fits(cost):
+            self._vtime = start
+            self._grant(tenant, cost)
+            return
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(finish, next(self._seq), start, tenant, cost, loop.create_future())
+        heapq.heappush(self._heap, waiter)
+        tenant.queued += 1
+        tenant.stats["queued_total"] += 1
+        self.stats["queued_total"] += 1
+        t0 = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.queue_timeout)
+        except BaseException as e:
+            tenant.queued -= 1
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 슬롯을 받은 직후 취소/타임아웃 → 반납
+                self._release_slot(tenant, cost)
+            else:
+                waiter.future.cancel()
+                # 자리를 받지 못했으므로 이 요청 몫만큼 앞당긴 종료 태그를 되돌림
+                # (뒤에 같은 테넌트 요청이 이미 이어 붙었으면 그 태그는 유지)
+                if tenant.last_finish == finish:
+                    tenant.last_finish = previous_finish
+                self._dispatch()
+            if isinstance(e, asyncio.TimeoutError):
+                tenant.stats["timeouts"] += 1
+                self.stats["timeouts"] += 1
+                raise QueueTimeout(time.monotonic() - t0)
+            raise
+        tenant.queued -= 1
+        self.stats["queue_wait_ms"] += (time.monotonic() - t0) * 1000
+
+    def _fits(self, cost: int) -> bool:
+        # 한도 미설정(0)이면 제한 없음, 비어 있으면 한도보다 큰 요청도 단독 실행
+        if self._running == 0:
+            return True
+        if self.capacity > 0 and self._running >= self.capacity:
+            return False
+        return self.kv_capacity_blocks <= 0 or self._blocks_in_use + cost <= self.kv_capacity_blocks
+
+    def _grant(self, tenant: _Tenant, cost: int) -> None:
+        self._running += 1
+        self._blocks_in_use += cost
+        tenant.running += 1
+        tenant.stats["admitted"] += 1
+        self.stats["admitted"] += 1
+
+    def _release(self, ticket: Ticket) -> None:
+        self._release_slot(ticket.tenant, ticket.cost)
+
+    def _release_slot(self, tenant: _Tenant, cost: int) -> None:
+        self._running -= 1
+        self._blocks_in_use -= cost
+        tenant.running -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """종료 태그가 가장 작은 대기자부터 한도 안에서 승인 (맨 앞이 안 들어가면 자리가 날 때까지 대기)"""
+        while self._heap:
+            head = self._heap[0]
+            if head.future.done():
+                heapq.heappop(self._heap)
+                continue
+            if not self._fits(head.cost):
+                break
+            heapq.heappop(self._heap)
+            self._vtime = head.start
+            self._grant(head.tenant, head.cost)
+            head.future.set_result(None)
+
+
+# 전역 승인 제어 인스턴스
+admission_controller = AdmissionController()
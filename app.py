@@ -1,13 +1,15 @@
 import os
 import time
+import asyncio
 import base64
 from contextlib import asynccontextmanager
 from typing import Any, Dict, List, Optional
 
 import uvicorn
 import torch
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
 from vllm.utils import random_uuid
 
@@ -17,31 +19,77 @@ from .models import (
     VisionRequest,
     MultimodalRequest,
     GenerationResponse,
-    active_conversations,
     get_or_create_conversation,
-    get_conversation_messages,
     add_to_conversation,
     format_chat_prompt,
     format_vision_prompt,
     format_multi_vision_prompt,
     MultiVisionRequest,
+    ImageUploadRequest,
+    get_conversation_image_ids,
+)
+from .utils import try_parse_json, estimate_tokens, estimate_image_tokens, process_image_file
+from .asset_store import image_asset_store
+from .conversation_store import (
+    CONVERSATION_LIST_DEFAULT_LIMIT,
+    CONVERSATION_LIST_MAX_LIMIT,
+    conversation_store,
+)
+from .summarizer import conversation_summarizer
+from .prompt_cache import prompt_prefix_cache
+from .image_fetch import image_fetcher, resolve_image_sources
+from .metrics import CONTENT_TYPE_LATEST, server_metrics
+from .tracing import tracer
+from .profiling import profiler
+from .gpu_telemetry import gpu_telemetry
+from .usage_ledger import USAGE_API_KEY_HEADER, usage_ledger
+from .admission import RATE_LIMITED_PATHS, admission_controller
+from .file_io import (
+    shutdown_extract_pool,
+    to_prompt_text,
+    trim_to_tokens,
+    render_pdf_pages_async,
+    PDF_RENDER_AVAILABLE,
+    FileSource,
+    UploadTooLargeError,
+    open_file_source,
+    spool_upload,
+)
+from .doc_cache import document_cache
+from .long_document import (
+    map_reduce_document,
+    LONG_DOC_MAP_MAX_TOKENS,
+    LONG_DOC_CHUNK_TOKENS,
+    INSTRUCTION_TOKENS,
 )
-from .utils import process_image_data, process_image_list, try_parse_json
-from .file_io import process_uploaded_file
 from .logger_config import (
     app_logger as logger,
     RequestLogger,
     log_multimodal_content,
     log_conversation_context,
+    get_logging_stats,
 )
 
 
 server_start_time = time.time()
 MAX_TOKENS_CAP = int(os.getenv("MAX_TOKENS_CAP", "512"))
 MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# multipart 경계/폼 필드 여유분 (Content-Length 사전 검사용)
+UPLOAD_FORM_OVERHEAD_BYTES = int(os.getenv("UPLOAD_FORM_OVERHEAD_BYTES", str(64 * 1024)))
 MAX_IMAGES_PER_REQUEST = int(
     os.getenv("MAX_IMAGES_PER_REQUEST", os.getenv("VLLM_MAX_IMAGES_PER_PROMPT", "4"))
 )
+# 채팅 템플릿 태그 등 프롬프트 부가 토큰 여유분
+PROMPT_TOKEN_MARGIN = int(os.getenv("PROMPT_TOKEN_MARGIN", "64"))
+
+
+def _prompt_token_budget(max_tokens: Optional[int], reserved_text: str = "", images: Optional[list] = None) -> int:
+    """max_model_len에서 출력 토큰/고정 텍스트/이미지/여유분을 뺀 문서용 토큰 예산"""
+    max_model_len = int(engine.engine_config.get("max_model_len") or os.getenv("VLLM_MAX_MODEL_LEN", "8192"))
+    eff_tokens = min(max_tokens or 512, MAX_TOKENS_CAP)
+    image_tokens = sum(estimate_image_tokens(img) for img in images) if images else 0
+    budget = max_model_len - eff_tokens - estimate_tokens(reserved_text) - image_tokens - PROMPT_TOKEN_MARGIN
+    return max(0, budget)
 
 
 @asynccontextmanager
@@ -56,10 +104,23 @@ async def lifespan(app: FastAPI):
     if not success:
         print("❌ vLLM 엔진 초기화 실패로 서버를 종료합니다.")
         raise RuntimeError("vLLM 엔진 초기화 실패")
+    admission_controller.configure(engine.engine_config)
+    await conversation_store.start()
+    await conversation_summarizer.start()
+    await gpu_telemetry.start()
+    await usage_ledger.start()
     print("✅ vLLM 서버 시작 완료!")
     yield
     print("🔄 vLLM 서버 종료 중...")
-    active_conversations.clear()
+    await gpu_telemetry.aclose()
+    await conversation_summarizer.aclose()
+    await usage_ledger.aclose()
+    await conversation_store.aclose()
+    image_asset_store.clear()
+    document_cache.clear()
+    await image_fetcher.aclose()
+    shutdown_extract_pool()
+    tracer.shutdown()
     print("✅ vLLM 서버 종료 완료!")
 
 
@@ -79,6 +140,80 @@ app.add_middleware(
 )
 
 
+# 미들웨어는 나중에 등록한 것이 바깥쪽에서 실행됨: 거절(429/413) 응답도 메트릭/트레이스에 잡히도록
+# 요청 거절 미들웨어를 먼저(안쪽에) 등록
+@app.middleware("http")
+async def usage_middleware(request: Request, call_next):
+    """사용량 원장/속도 제한의 호출자 식별 (API 키 헤더), 생성 엔드포인트 요청/초 제한"""
+    usage_ledger.identify(request.headers.get(USAGE_API_KEY_HEADER))
+    if request.method == "POST" and request.url.path in RATE_LIMITED_PATHS:
+        limited = admission_controller.check_request_rate()
+        if limited is not None:
+            return JSONResponse({"detail": limited.detail}, status_code=limited.status_code, headers=limited.headers)
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def upload_size_middleware(request: Request, call_next):
+    """/upload 본문을 받기 전에 Content-Length로 크기 초과 요청을 거절 (chunked 요청은 핸들러에서 검사)"""
+    if request.method == "POST" and request.url.path == "/upload":
+        try:
+            declared = int(request.headers.get("content-length") or 0)
+        except ValueError:
+            declared = 0
+        if declared > MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD_BYTES:
+            return JSONResponse({"detail": f"파일 크기가 제한({MAX_UPLOAD_BYTES} bytes)를 초과했습니다"}, status_code=413)
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """요청 수/지연/오류/진행 중 요청 메트릭 (/metrics 자체는 제외)"""
+    if request.url.path == "/metrics":
+        return await call_next(request)
+    labels = server_metrics.begin(request.scope)
+    t0 = time.perf_counter()
+    error = True
+    try:
+        response = await call_next(request)
+        error = response.status_code >= 500
+        return response
+    finally:
+        server_metrics.end(labels, time.perf_counter() - t0, error)
+
+
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    """요청별 트레이스 시작, 단계별 소요 시간을 Server-Timing 헤더로 반환"""
+    trace = tracer.start_trace(f"{request.method} {request.url.path}")
+    if trace is None:
+        return await call_next(request)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        trace.root.end_ns = time.time_ns()
+        response.headers["Server-Timing"] = trace.server_timing()
+        return response
+    finally:
+        route = request.scope.get("route")
+        tracer.finish_trace(
+            trace,
+            **{"http.method": request.method, "http.route": getattr(route, "path", request.url.path), "http.status_code": status},
+        )
+
+
+server_metrics.track_conversations(lambda: len(conversation_store))
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 텍스트 형식 메트릭"""
+    if not server_metrics.enabled:
+        raise HTTPException(status_code=503, detail="메트릭이 비활성화되어 있습니다 (prometheus_client 필요)")
+    return Response(content=server_metrics.render(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/")
 async def root():
     return {
@@ -98,9 +233,11 @@ async def health_check():
         vllm_stats = await engine.get_vllm_stats() if loaded else {}
     except Exception:
         vllm_stats = {}
+    # 장치 정보도 텔레메트리 스냅샷에서 읽음 (프로브마다 torch.cuda 호출하지 않음)
+    gpu_devices = gpu_telemetry.devices()
     device_info = "N/A"
-    if torch.cuda.is_available() and loaded:
-        device_info = f"cuda:{torch.cuda.current_device()}"
+    if gpu_devices and loaded:
+        device_info = f"cuda:{gpu_devices[0]['index']}"
     elif loaded:
         device_info = "cpu"
     return {
@@ -113,7 +250,7 @@ async def health_check():
         "gpu_memory_total": gpu_status["memory_total"],
         "vllm_stats": vllm_stats,
     "engine_config": engine.engine_config,
-        "active_conversations": len(active_conversations),
+        "active_conversations": len(conversation_store),
         "uptime": round(time.time() - server_start_time, 2),
     }
 
@@ -125,8 +262,12 @@ async def generate_text_endpoint(request: ChatRequest):
     
     # 요청 ID 생성 및 로거 초기화
     request_id = random_uuid()[:8]
+    tracer.annotate(request_id=request_id)
     req_logger = RequestLogger(logger, request_id)
     
+    # 메트릭 라벨
+    server_metrics.label(lora_adapter=request.lora_adapter)
+    
     # 요청 시작 로깅
     req_logger.log_request_start(
         endpoint="/generate",
@@ -136,16 +277,19 @@ async def generate_text_endpoint(request: ChatRequest):
     )
     
     start_time = time.time()
-    conversation_id = get_or_create_conversation(request.conversation_id)
+    conversation_id = await conversation_store.offload(get_or_create_conversation, request.conversation_id)
     
     # 대화 컨텍스트 로깅
-    messages = get_conversation_messages(conversation_id)
-    log_conversation_context(logger, request_id, conversation_id, len(messages))
-    
-    messages.append({"role": "user", "content": request.message})
+    history_count = await conversation_store.offload(conversation_store.message_count, conversation_id)
+    log_conversation_context(logger, request_id, conversation_id, history_count)
     
     try:
-        prompt = format_chat_prompt(messages)
+        # 렌더링된 히스토리 프리픽스에 새 메시지만 이어 붙임 (예산 초과 시 오래된 턴 제외, 첫 턴은 유지)
+        t_prompt0 = time.time()
+        prompt, history_used, history_dropped = await conversation_store.offload(
+            prompt_prefix_cache.build, conversation_id, request.message, _prompt_token_budget(request.max_tokens)
+        )
+        prompt_build_ms = round((time.time() - t_prompt0) * 1000, 2)
         
         # 프롬프트 로깅
         req_logger.log_prompt(prompt)
@@ -185,6 +329,8 @@ async def generate_text_endpoint(request: ChatRequest):
         
         add_to_conversation(conversation_id, "user", request.message)
         add_to_conversation(conversation_id, "assistant", response_text)
+        # 대화가 길어졌으면 오래된 턴 요약을 백그라운드로 예약
+        await conversation_summarizer.maybe_schedule(conversation_id)
         
         generation_time = time.time() - start_time
         t_json0 = time.time()
@@ -194,6 +340,9 @@ async def generate_text_endpoint(request: ChatRequest):
         timings_api = {
             "endpoint_total_ms": round(generation_time * 1000, 1),
             "json_parse_ms": json_parse_ms,
+            "prompt_build_ms": prompt_build_ms,
+            "history_messages_used": history_used,
+            "history_messages_dropped": history_dropped,
             **gen_timings,
         }
         
@@ -218,6 +367,10 @@ async def generate_text_endpoint(request: ChatRequest):
             response_json=parsed,
             response_is_json=parsed is not None,
         )
+    except HTTPException as e:
+        req_logger.log_error(e, context="텍스트 생성")
+        req_logger.log_request_end(success=False)
+        raise
     except Exception as e:
         req_logger.log_error(e, context="텍스트 생성")
         req_logger.log_request_end(success=False)
@@ -233,8 +386,12 @@ async def analyze_vision(request: VisionRequest):
     
     # 요청 ID 생성 및 로거 초기화
     request_id = random_uuid()[:8]
+    tracer.annotate(request_id=request_id)
     req_logger = RequestLogger(logger, request_id)
     
+    # 메트릭 라벨
+    server_metrics.label(lora_adapter=request.lora_adapter, json_only=request.json_only)
+    
     # 요청 시작 로깅
     req_logger.log_request_start(
         endpoint="/vision",
@@ -244,13 +401,31 @@ async def analyze_vision(request: VisionRequest):
     )
     
     start_time = time.time()
-    conversation_id = get_or_create_conversation(request.conversation_id)
+    conversation_id = await conversation_store.offload(get_or_create_conversation, request.conversation_id)
     
     # 대화 컨텍스트 로깅
-    log_conversation_context(logger, request_id, conversation_id, len(active_conversations.get(conversation_id, [])))
+    history_count = await conversation_store.offload(conversation_store.message_count, conversation_id)
+    log_conversation_context(logger, request_id, conversation_id, history_count)
     
+    image_fetch_ms = 0.0
     try:
-        image = process_image_data(request.image_data)
+        if request.image_data:
+            fetched_images, image_fetch_ms = await resolve_image_sources([request.image_data])
+            image = fetched_images[0]
+            image_id = await image_asset_store.put_async(image)
+        else:
+            # image_id 지정 또는 같은 대화에서 마지막으로 사용한 이미지 재사용
+            if request.image_id:
+                candidate_ids = [request.image_id]
+            else:
+                candidate_ids = (await conversation_store.offload(get_conversation_image_ids, conversation_id))[:1]
+            if not candidate_ids:
+                raise HTTPException(status_code=400, detail="image_data 또는 image_id가 필요합니다")
+            try:
+                image = (await image_asset_store.load_images_async(candidate_ids))[0]
+            except ValueError as exc:
+                raise HTTPException(status_code=404, detail=str(exc))
+            image_id = candidate_ids[0]
         
         # 이미지 로깅
         req_logger.log_image(image, request.image_data)
@@ -295,16 +470,19 @@ async def analyze_vision(request: VisionRequest):
             stage="생성 후"
         )
         
-        add_to_conversation(conversation_id, "user", request.message, "이미지 포함")
+        add_to_conversation(conversation_id, "user", request.message, "이미지 포함", image_ids=[image_id])
         add_to_conversation(conversation_id, "assistant", response_text)
         
         generation_time = time.time() - start_time
         t_json0 = time.time()
         parsed = try_parse_json(response_text) if request.json_only else None
+        if request.json_only and parsed is None:
+            server_metrics.count_json_parse_failure()
         json_parse_ms = round((time.time() - t_json0) * 1000, 1)
         
         timings_api = {
             "endpoint_total_ms": round(generation_time * 1000, 1),
+            "image_fetch_ms": image_fetch_ms,
             "json_parse_ms": json_parse_ms,
             **gen_timings,
         }
@@ -326,11 +504,16 @@ async def analyze_vision(request: VisionRequest):
                 "temperature": 0.7,
                 "lora_adapter": request.lora_adapter or os.getenv("DEFAULT_LORA_ADAPTER", "base"),
                 "multimodal": True,
+                "image_ids": [image_id],
                 "timings": timings_api,
             },
             response_json=parsed,
             response_is_json=parsed is not None,
         )
+    except HTTPException as e:
+        req_logger.log_error(e, context="이미지 분석")
+        req_logger.log_request_end(success=False)
+        raise
     except Exception as e:
         req_logger.log_error(e, context="이미지 분석")
         req_logger.log_request_end(success=False)
@@ -339,18 +522,33 @@ async def analyze_vision(request: VisionRequest):
 
 @app.post("/multimodal", response_model=GenerationResponse)
 async def multimodal_analysis(request: MultimodalRequest):
+    return await _run_multimodal(request)
+
+
+async def _run_multimodal(request: MultimodalRequest, file_source: Optional[FileSource] = None):
+    """/multimodal 본체. file_source가 있으면 file_data(base64) 대신 스풀된 업로드를 직접 파싱"""
     if engine.vllm_engine is None:
         raise HTTPException(status_code=503, detail="vLLM 엔진이 초기화되지 않았습니다")
+    server_metrics.label(lora_adapter=request.lora_adapter, json_only=request.json_only)
     start_time = time.time()
-    conversation_id = get_or_create_conversation(request.conversation_id)
+    conversation_id = await conversation_store.offload(get_or_create_conversation, request.conversation_id)
     try:
         enhanced_message = request.message
         images = None
+        image_ids: List[str] = []
+        image_fetch_ms = 0.0
+        file_stats: Dict[str, Any] = {}
 
-        if request.image_data:
+        if request.image_data or request.image_id:
             if engine.MULTIMODAL_AVAILABLE:
                 try:
-                    image = process_image_data(request.image_data)
+                    if request.image_data:
+                        fetched_images, image_fetch_ms = await resolve_image_sources([request.image_data])
+                        image = fetched_images[0]
+                        image_ids = [await image_asset_store.put_async(image)]
+                    else:
+                        image = (await image_asset_store.load_images_async([request.image_id]))[0]
+                        image_ids = [request.image_id]
                     images = [image]
                     enhanced_message += "\n\n[이미지가 제공되었습니다. 이미지를 분석해 주세요.]"
                 except Exception as e:
@@ -359,36 +557,114 @@ async def multimodal_analysis(request: MultimodalRequest):
                 # 멀티모달 미지원 시 이미지는 무시
                 pass
 
-        if request.file_data and request.file_type:
+        file_type = request.file_type
+        document_id: Optional[str] = None
+        file_text = ""
+        file_content: Optional[FileSource] = None
+        # 프롬프트가 max_model_len을 넘지 않도록 예산까지만 사용 (긴 문서 모드는 전체 추출)
+        token_budget = _prompt_token_budget(request.max_tokens, enhanced_message, images)
+        extract_budget = None if request.long_document else token_budget
+        if request.document_id and not request.file_data:
+            cached_doc = await document_cache.get_text(request.document_id, extract_budget)
+            if cached_doc is None:
+                raise HTTPException(status_code=404, detail="문서를 찾을 수 없거나 만료되었습니다")
+            doc_entry, file_text, file_stats = cached_doc
+            document_id = doc_entry.document_id
+            file_type = doc_entry.file_type
+        elif (file_source is not None or request.file_data) and request.file_type:
             try:
-                file_content = base64.b64decode(request.file_data)
-                file_text = process_uploaded_file(file_content, request.file_type)
-                if file_text:
-                    enhanced_message += f"\n\n=== {request.file_type.upper()} 파일 내용 ===\n{file_text}"
-                else:
+                file_content = file_source if file_source is not None else base64.b64decode(request.file_data)
+                file_text, document_id, file_stats = await document_cache.get_or_extract(
+                    file_content, request.file_type, token_budget=extract_budget
+                )
+                if not file_text:
                     enhanced_message += f"\n\n[{request.file_type} 파일 처리 실패]"
             except Exception as e:
                 enhanced_message += f"\n\n[파일 처리 실패: {str(e)}]"
 
-        messages = [{"role": "user", "content": enhanced_message}]
-        prompt = format_chat_prompt(messages)
-        response_text, gen_timings = await engine.generate_with_vllm(
-            prompt=prompt, max_tokens=request.max_tokens, temperature=0.7, images=images
-        )
+        # 스캔 PDF: 텍스트가 거의 없는 페이지(또는 요청한 페이지)만 이미지로 렌더링해 비전 경로로 전달
+        scanned_pages = file_stats.pop("pdf_scanned_page_numbers", [])
+        # 예산 때문에 문서 일부만 프롬프트에 들어갔는지
+        document_truncated = bool(file_stats.pop("document_truncated", False))
+        rendered_pages: List[int] = []
+        if file_content is not None and file_type and file_type.lower() == "pdf" and engine.MULTIMODAL_AVAILABLE:
+            if request.pdf_pages:
+                page_selection = [p for p in request.pdf_pages if p >= 1]
+            else:
+                page_selection = scanned_pages if request.render_scanned_pages else []
+            page_selection = page_selection[: max(0, MAX_IMAGES_PER_REQUEST - len(images or []))]
+            if page_selection and PDF_RENDER_AVAILABLE:
+                try:
+                    page_images, rendered_pages, render_stats = await render_pdf_pages_async(
+                        file_content, page_selection
+                    )
+                    file_stats.update(render_stats)
+                    if page_images:
+                        images = (images or []) + page_images
+                        pages_label = ", ".join(str(p) for p in rendered_pages)
+                        enhanced_message += f"\n\n[PDF {pages_label} 페이지가 이미지로 제공되었습니다. 이미지 내용을 함께 분석해 주세요.]"
+                        # 이미지 토큰만큼 문서 텍스트 예산을 다시 계산
+                        token_budget = _prompt_token_budget(request.max_tokens, enhanced_message, images)
+                        if not request.long_document:
+                            trimmed_text = trim_to_tokens(file_text, token_budget)
+                            document_truncated = document_truncated or len(trimmed_text) < len(file_text)
+                            file_text = trimmed_text
+                except Exception as e:
+                    enhanced_message += f"\n\n[PDF 페이지 렌더링 실패: {str(e)}]"
+
+        long_doc_text: Optional[str] = None
+        long_doc_coverage: Optional[float] = None
+        if file_text:
+            if request.long_document and estimate_tokens(file_text) > token_budget:
+                long_doc_text = file_text
+            else:
+                # 문서 본문을 질문보다 앞에 두어 같은 문서에 대한 후속 질문이 prefix cache를 재사용
+                enhanced_message = f"=== {file_type.upper()} 파일 내용 ===\n{to_prompt_text(file_text)}\n\n=== 질문 ===\n{enhanced_message}"
+
+        if long_doc_text is not None:
+            response_text, gen_timings = await map_reduce_document(
+                message=request.message,
+                document_text=long_doc_text,
+                chunk_tokens=min(
+                    LONG_DOC_CHUNK_TOKENS,
+                    _prompt_token_budget(LONG_DOC_MAP_MAX_TOKENS, request.message) - INSTRUCTION_TOKENS,
+                ),
+                reduce_budget=_prompt_token_budget(request.max_tokens, request.message, images) - INSTRUCTION_TOKENS,
+                max_tokens=request.max_tokens,
+                temperature=0.7,
+                images=images,
+                lora_adapter=request.lora_adapter,
+                request_id=random_uuid()[:8],
+            )
+            long_doc_coverage = gen_timings.pop("long_doc_coverage", 1.0)
+            document_truncated = document_truncated or gen_timings.pop("long_doc_truncated", False)
+        else:
+            if rendered_pages:
+                prompt = format_multi_vision_prompt(enhanced_message, len(images), request.json_only)
+            else:
+                messages = [{"role": "user", "content": enhanced_message}]
+                prompt = format_chat_prompt(messages)
+            response_text, gen_timings = await engine.generate_with_vllm(
+                prompt=prompt, max_tokens=request.max_tokens, temperature=0.7, images=images
+            )
         context_info: List[str] = []
-        if request.image_data:
+        if images:
             context_info.append("이미지")
-        if request.file_data and request.file_type:
-            context_info.append(f"{request.file_type} 파일")
+        if document_id and file_type:
+            context_info.append(f"{file_type} 파일")
         context_str = " + ".join(context_info) if context_info else "텍스트만"
-        add_to_conversation(conversation_id, "user", request.message, context_str)
+        add_to_conversation(conversation_id, "user", request.message, context_str, image_ids=image_ids)
         add_to_conversation(conversation_id, "assistant", response_text)
         generation_time = time.time() - start_time
         t_json0 = time.time()
         parsed = try_parse_json(response_text) if request.json_only else None
+        if request.json_only and parsed is None:
+            server_metrics.count_json_parse_failure()
         json_parse_ms = round((time.time() - t_json0) * 1000, 1)
         timings_api = {
             "endpoint_total_ms": round(generation_time * 1000, 1),
+            "image_fetch_ms": image_fetch_ms,
+            **file_stats,
             "json_parse_ms": json_parse_ms,
             **gen_timings,
         }
@@ -402,14 +678,22 @@ async def multimodal_analysis(request: MultimodalRequest):
                 "max_tokens": min(request.max_tokens or 512, MAX_TOKENS_CAP),
                 "temperature": 0.7,
                 "multimodal": True,
-                "has_image": request.image_data is not None,
-                "has_file": request.file_data is not None,
-                "file_type": request.file_type,
+                "has_image": images is not None,
+                "image_ids": image_ids,
+                "has_file": document_id is not None,
+                "file_type": file_type,
+                "document_id": document_id,
+                "document_truncated": document_truncated,
+                "long_document": long_doc_text is not None,
+                "long_document_coverage": long_doc_coverage,
+                "rendered_pdf_pages": rendered_pages,
                 "timings": timings_api,
             },
             response_json=parsed,
             response_is_json=parsed is not None,
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"멀티모달 분석 오류: {str(e)}")
 
@@ -421,44 +705,56 @@ async def analyze_multi_vision(request: MultiVisionRequest):
     if not engine.MULTIMODAL_AVAILABLE:
         raise HTTPException(status_code=503, detail="멀티모달 기능이 사용할 수 없습니다")
 
-    if not request.image_list:
-        raise HTTPException(status_code=400, detail="image_list가 비어 있습니다")
-    if len(request.image_list) > MAX_IMAGES_PER_REQUEST:
+    image_list = request.image_list or []
+    requested_ids = request.image_ids or []
+    if not image_list and not requested_ids:
+        raise HTTPException(status_code=400, detail="image_list 또는 image_ids가 비어 있습니다")
+    if len(image_list) + len(requested_ids) > MAX_IMAGES_PER_REQUEST:
         raise HTTPException(
             status_code=400,
             detail=f"이미지 개수가 제한({MAX_IMAGES_PER_REQUEST}장)를 초과했습니다",
         )
 
     request_id = random_uuid()[:8]
+    tracer.annotate(request_id=request_id)
     req_logger = RequestLogger(logger, request_id)
 
+    server_metrics.label(lora_adapter=request.lora_adapter, json_only=request.json_only)
     req_logger.log_request_start(
         endpoint="/vision/multi",
         max_tokens=request.max_tokens,
         json_only=request.json_only,
-        image_count=len(request.image_list),
+        image_count=len(image_list) + len(requested_ids),
         lora_adapter=request.lora_adapter,
     )
 
     start_time = time.time()
-    conversation_id = get_or_create_conversation(request.conversation_id)
-    log_conversation_context(
-        logger, request_id, conversation_id, len(active_conversations.get(conversation_id, []))
-    )
+    conversation_id = await conversation_store.offload(get_or_create_conversation, request.conversation_id)
+    history_count = await conversation_store.offload(conversation_store.message_count, conversation_id)
+    log_conversation_context(logger, request_id, conversation_id, history_count)
 
     try:
-        images = process_image_list(request.image_list)
+        images, image_fetch_ms = await resolve_image_sources(image_list)
+        image_ids = [await image_asset_store.put_async(img) for img in images]
     except ValueError as exc:
         req_logger.log_error(exc, context="이미지 전처리")
         req_logger.log_request_end(success=False)
         raise HTTPException(status_code=400, detail=str(exc))
 
+    try:
+        images.extend(await image_asset_store.load_images_async(requested_ids))
+        image_ids.extend(requested_ids)
+    except ValueError as exc:
+        req_logger.log_error(exc, context="이미지 에셋 조회")
+        req_logger.log_request_end(success=False)
+        raise HTTPException(status_code=404, detail=str(exc))
+
     if not images:
         req_logger.log_request_end(success=False)
         raise HTTPException(status_code=400, detail="처리할 이미지가 없습니다")
 
     # 첫 번째 이미지는 상세 로깅, 추가 이미지는 개수만 기록
-    req_logger.log_image(images[0], request.image_list[0])
+    req_logger.log_image(images[0], image_list[0] if image_list else None)
     if len(images) > 1:
         logger.info(f"🖼️ [{request_id}] 추가 이미지: {len(images) - 1}장")
 
@@ -488,6 +784,10 @@ async def analyze_multi_vision(request: MultiVisionRequest):
             lora_adapter=request.lora_adapter,
             request_id=request_id,
         )
+    except HTTPException as e:
+        req_logger.log_error(e, context="멀티 이미지 분석")
+        req_logger.log_request_end(success=False)
+        raise
     except Exception as e:
         req_logger.log_error(e, context="멀티 이미지 분석")
         req_logger.log_request_end(success=False)
@@ -500,16 +800,19 @@ async def analyze_multi_vision(request: MultiVisionRequest):
         stage="생성 후",
     )
 
-    add_to_conversation(conversation_id, "user", request.message, f"이미지 {len(images)}장")
+    add_to_conversation(conversation_id, "user", request.message, f"이미지 {len(images)}장", image_ids=image_ids)
     add_to_conversation(conversation_id, "assistant", response_text)
 
     generation_time = time.time() - start_time
     t_json0 = time.time()
     parsed = try_parse_json(response_text) if request.json_only else None
+    if request.json_only and parsed is None:
+        server_metrics.count_json_parse_failure()
     json_parse_ms = round((time.time() - t_json0) * 1000, 1)
 
     timings_api = {
         "endpoint_total_ms": round(generation_time * 1000, 1),
+        "image_fetch_ms": image_fetch_ms,
         "json_parse_ms": json_parse_ms,
         **gen_timings,
     }
@@ -531,6 +834,7 @@ async def analyze_multi_vision(request: MultiVisionRequest):
             "lora_adapter": request.lora_adapter or os.getenv("DEFAULT_LORA_ADAPTER", "base"),
             "multimodal": True,
             "image_count": len(images),
+            "image_ids": image_ids,
             "timings": timings_api,
         },
         response_json=parsed,
@@ -543,71 +847,163 @@ async def upload_and_analyze(
     message: str = Form(...),
     conversation_id: Optional[str] = Form(None),
     max_tokens: Optional[int] = Form(512),
+    long_document: Optional[bool] = Form(False),
 ):
     if engine.vllm_engine is None:
         raise HTTPException(status_code=503, detail="vLLM 엔진이 초기화되지 않았습니다")
+    spooled = None
     try:
-        file_content = await file.read()
-        if len(file_content) > MAX_UPLOAD_BYTES:
-            raise HTTPException(status_code=413, detail=f"파일 크기가 제한({MAX_UPLOAD_BYTES} bytes)를 초과했습니다")
         file_extension = file.filename.split('.')[-1].lower() if '.' in file.filename else ''
         supported_types = ['pdf', 'docx', 'doc', 'txt', 'png', 'jpg', 'jpeg', 'gif', 'bmp']
         if file_extension not in supported_types:
             raise HTTPException(status_code=400, detail=f"지원하지 않는 파일 형식입니다. 지원 형식: {', '.join(supported_types)}")
+        # 수신된 업로드 크기 검사 후 파서 입력 준비 (큰 파일은 디스크 임시 파일 → mmap으로 파싱)
+        try:
+            spooled = await spool_upload(file, MAX_UPLOAD_BYTES)
+        except UploadTooLargeError as exc:
+            raise HTTPException(status_code=413, detail=str(exc))
         image_types = ['png', 'jpg', 'jpeg', 'gif', 'bmp']
         is_image = file_extension in image_types
-        conversation_id = get_or_create_conversation(conversation_id)
+        conversation_id = await conversation_store.offload(get_or_create_conversation, conversation_id)
         if is_image:
-            image_base64 = base64.b64encode(file_content).decode('utf-8')
-            image_data_url = f"data:image/{file_extension};base64,{image_base64}"
-            req = VisionRequest(message=message, image_data=image_data_url, conversation_id=conversation_id, max_tokens=max_tokens)
+            with open_file_source(spooled.source) as image_file:
+                image = process_image_file(image_file)
+            req = VisionRequest(
+                message=message,
+                image_id=await image_asset_store.put_async(image),
+                conversation_id=conversation_id,
+                max_tokens=max_tokens,
+            )
             return await analyze_vision(req)
         else:
-            file_base64 = base64.b64encode(file_content).decode('utf-8')
-            req = MultimodalRequest(message=message, file_data=file_base64, file_type=file_extension, conversation_id=conversation_id, max_tokens=max_tokens)
-            return await multimodal_analysis(req)
+            req = MultimodalRequest(message=message, file_type=file_extension, conversation_id=conversation_id, max_tokens=max_tokens, long_document=long_document)
+            return await _run_multimodal(req, file_source=spooled.source)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"파일 업로드 처리 오류: {str(e)}")
+    finally:
+        if spooled is not None:
+            spooled.close()
+
+
+@app.post("/images")
+async def upload_image_asset(request: ImageUploadRequest):
+    """이미지를 한 번 업로드하고 image_id를 받아 이후 요청에서 재사용"""
+    try:
+        fetched_images, _ = await resolve_image_sources([request.image_data])
+        image = fetched_images[0]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"이미지 처리 오류: {str(e)}")
+    image_id = await image_asset_store.put_async(image)
+    return {
+        "image_id": image_id,
+        "width": image.size[0],
+        "height": image.size[1],
+        "expires_in_seconds": image_asset_store.ttl_seconds,
+    }
+
+
+@app.get("/images/{image_id}")
+async def get_image_asset(image_id: str):
+    info = await image_asset_store.info_async(image_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="이미지 에셋을 찾을 수 없습니다")
+    return info
+
+
+@app.delete("/images/{image_id}")
+async def delete_image_asset(image_id: str):
+    if not await image_asset_store.delete_async(image_id):
+        raise HTTPException(status_code=404, detail="이미지 에셋을 찾을 수 없습니다")
+    return {"message": f"이미지 {image_id}가 삭제되었습니다"}
+
+
+@app.get("/documents/{document_id}")
+async def get_document(document_id: str):
+    entry = await document_cache.get_async(document_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="문서를 찾을 수 없거나 만료되었습니다")
+    return {
+        "document_id": entry.document_id,
+        "file_type": entry.file_type,
+        "text_length": len(entry.text),
+        "estimated_tokens": estimate_tokens(entry.text),
+        "complete": entry.complete,
+        "extract_ms": entry.extract_ms,
+    }
+
+
+@app.delete("/documents/{document_id}")
+async def delete_document(document_id: str):
+    if not await document_cache.delete_async(document_id):
+        raise HTTPException(status_code=404, detail="문서를 찾을 수 없습니다")
+    return {"message": f"문서 {document_id}가 삭제되었습니다"}
 
 
 @app.get("/conversations/{conversation_id}")
 async def get_conversation_history(conversation_id: str):
-    if conversation_id not in active_conversations:
+    messages = await conversation_store.offload(conversation_store.get_messages, conversation_id)
+    if messages is None:
         raise HTTPException(status_code=404, detail="대화를 찾을 수 없습니다")
     return {
         "conversation_id": conversation_id,
-        "messages": active_conversations[conversation_id],
-        "message_count": len(active_conversations[conversation_id]),
+        "messages": [m.to_dict() for m in messages],
+        "message_count": len(messages),
     }
 
 
 @app.delete("/conversations/{conversation_id}")
 async def delete_conversation(conversation_id: str):
-    if conversation_id not in active_conversations:
+    if not await conversation_store.offload(conversation_store.delete, conversation_id):
         raise HTTPException(status_code=404, detail="대화를 찾을 수 없습니다")
-    del active_conversations[conversation_id]
     return {"message": f"대화 {conversation_id}가 삭제되었습니다"}
 
 
 @app.get("/conversations")
-async def list_conversations():
-    conversations = []
-    for conv_id, messages in active_conversations.items():
-        last_message = messages[-1] if messages else None
-        conversations.append({
-            "conversation_id": conv_id,
-            "message_count": len(messages),
-            "last_message_time": last_message["timestamp"] if last_message else None,
-            "last_message_preview": last_message["content"][:50] + "..." if last_message and len(last_message["content"]) > 50 else last_message["content"] if last_message else None,
-        })
-    return {"conversations": conversations, "total_conversations": len(conversations)}
+async def list_conversations(limit: int = CONVERSATION_LIST_DEFAULT_LIMIT, cursor: Optional[str] = None):
+    """최근 활동 순 대화 목록 (커서 기반 페이지)"""
+    limit = max(1, min(limit, CONVERSATION_LIST_MAX_LIMIT))
+    try:
+        conversations, next_cursor = await conversation_store.offload(
+            conversation_store.list_conversations, limit, cursor
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="잘못된 cursor 값입니다")
+    return {
+        "conversations": conversations,
+        "next_cursor": next_cursor,
+        "total_conversations": len(conversation_store),
+    }
+
+
+@app.get("/usage")
+async def get_usage(
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    caller: Optional[str] = None,
+    lora_adapter: Optional[str] = None,
+):
+    """호출자/LoRA 어댑터별 토큰 사용량 합계 (since/until: epoch 초, 기본 최근 24시간)"""
+    if not usage_ledger.enabled:
+        raise HTTPException(status_code=404, detail="사용량 원장이 비활성화되어 있습니다")
+    until = until if until is not None else time.time()
+    since = since if since is not None else until - 86400
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since는 until보다 이전이어야 합니다")
+    items = await asyncio.to_thread(usage_ledger.query, since, until, caller, lora_adapter)
+    return {
+        "since": since,
+        "until": until,
+        "bucket_seconds": usage_ledger.bucket_seconds,
+        "usage": items,
+    }
 
 
 @app.get("/status/detailed")
 async def detailed_status():
     gpu_status = engine.get_gpu_status()
+    gpu_devices = gpu_telemetry.devices()
     vllm_stats = await engine.get_vllm_stats()
     return {
         "server_info": {
@@ -626,19 +1022,27 @@ async def detailed_status():
             "limit_mm_per_prompt": {"image": 1} if engine.MULTIMODAL_AVAILABLE else None,
         },
         "gpu_info": {
-            "available": torch.cuda.is_available() if torch else False,
-            "device_count": torch.cuda.device_count() if torch and torch.cuda.is_available() else 0,
+            "available": bool(gpu_devices),
+            "device_count": len(gpu_devices),
             "memory_used_gb": gpu_status["memory_used"],
             "memory_total_gb": gpu_status["memory_total"],
             "memory_usage_percent": round((gpu_status["memory_used"] / gpu_status["memory_total"]) * 100, 2) if gpu_status["memory_total"] > 0 else 0,
             "utilization": float(os.getenv("VLLM_GPU_MEMORY_UTILIZATION", "0.90")),
+            "telemetry": gpu_telemetry.get_stats(),
         },
         "vllm_info": vllm_stats,
         "engine_config": engine.engine_config,
-        "conversation_info": {
-            "active_conversations": len(active_conversations),
-            "total_messages": sum(len(msgs) for msgs in active_conversations.values()),
-        },
+        "conversation_info": await conversation_store.offload(conversation_store.get_stats),
+        "conversation_summary": conversation_summarizer.get_stats(),
+        "prompt_prefix_cache": prompt_prefix_cache.get_stats(),
+        "image_assets": image_asset_store.get_stats(),
+        "image_fetch": image_fetcher.get_stats(),
+        "document_cache": document_cache.get_stats(),
+        "logging": get_logging_stats(),
+        "tracing": tracer.get_stats(),
+        "profiling": profiler.get_stats(),
+        "usage_ledger": usage_ledger.get_stats(),
+        "admission": admission_controller.get_stats(),
         "features": {
             "text_generation": True,
             "vision_analysis": engine.MULTIMODAL_AVAILABLE,
@@ -649,6 +1053,29 @@ async def detailed_status():
     }
 
 
+@app.post("/admin/profile")
+async def profile_worker(
+    request: Request,
+    seconds: float = 10.0,
+    mode: str = "sample",
+    interval_ms: float = 10.0,
+    memory: bool = False,
+):
+    """실행 중인 워커 프로파일 (PROFILING_ENABLED=1, X-Admin-Token 필요)"""
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiler.authorized(request.headers.get("X-Admin-Token")):
+        raise HTTPException(status_code=403, detail="관리자 토큰이 올바르지 않습니다")
+    if profiler.busy:
+        raise HTTPException(status_code=409, detail="이미 프로파일링이 진행 중입니다")
+    try:
+        report = await profiler.profile(seconds, mode=mode, interval_ms=interval_ms, memory=memory)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"🔬 워커 프로파일 완료 (mode={mode}, {seconds}s, memory={memory})")
+    return PlainTextResponse(report)
+
+
 @app.get("/lora/adapters")
 async def list_lora_adapters():
     """등록된 LoRA 어댑터 목록 반환"""
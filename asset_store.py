@@ -0,0 +1,325 @@
+"""
+이미지 에셋 저장소
+- 전처리된 이미지를 image_id로 보관하여 멀티턴 대화에서 재사용
+- 메모리 LRU (개수/바이트 상한) → 로컬 디스크 디렉터리로 스필
+- 마지막 접근 기준 TTL 만료
+- 이벤트 루프에서는 *_async 메서드 사용 (이미지 해시/PNG 저장/디스크 로드를 스레드에서 실행)
+"""
+
+import os
+import re
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from .logger_config import app_logger as logger
+
+
+IMAGE_ASSET_DIR = os.getenv("IMAGE_ASSET_DIR", "/tmp/vllm_image_assets")
+IMAGE_ASSET_TTL_SECONDS = int(os.getenv("IMAGE_ASSET_TTL_SECONDS", "3600"))
+IMAGE_ASSET_MEMORY_MAX_ITEMS = int(os.getenv("IMAGE_ASSET_MEMORY_MAX_ITEMS", "64"))
+IMAGE_ASSET_MEMORY_MAX_BYTES = int(os.getenv("IMAGE_ASSET_MEMORY_MAX_BYTES", str(256 * 1024 * 1024)))
+IMAGE_ASSET_DISK_MAX_BYTES = int(os.getenv("IMAGE_ASSET_DISK_MAX_BYTES", str(2 * 1024 ** 3)))
+
+_IMAGE_ID_RE = re.compile(r"^img_[0-9a-f]{24}$")
+
+
+def _image_nbytes(image: Image.Image) -> int:
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+class ImageAssetStore:
+    """image_id → 전처리 이미지 저장소 (메모리 LRU + 디스크 스필)"""
+
+    def __init__(
+        self,
+        directory: str = IMAGE_ASSET_DIR,
+        ttl_seconds: int = IMAGE_ASSET_TTL_SECONDS,
+        max_items: int = IMAGE_ASSET_MEMORY_MAX_ITEMS,
+        max_bytes: int = IMAGE_ASSET_MEMORY_MAX_BYTES,
+        disk_max_bytes: int = IMAGE_ASSET_DISK_MAX_BYTES,
+    ):
+        self.directory = Path(directory)
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max(1, max_items)
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        # image_id -> (이미지, 바이트 수), 가장 최근 접근이 뒤쪽
+        self._memory: "OrderedDict[str, Tuple[Image.Image, int]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._last_access: Dict[str, float] = {}
+        # 디스크 인덱스: image_id -> 파일 크기 (오래된 순)
+        self._disk: Optional["OrderedDict[str, int]"] = None
+        self._disk_bytes = 0
+        self.stats: Dict[str, int] = {
+            "stored": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "spilled": 0,
+            "expired": 0,
+            "disk_evicted": 0,
+        }
+
+    # ===== 공개 API =====
+    @staticmethod
+    def compute_image_id(image: Image.Image) -> str:
+        """이미지 내용 기반 ID (동일 이미지는 같은 ID로 중복 제거)"""
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode())
+        digest.update(image.tobytes())
+        return f"img_{digest.hexdigest()[:24]}"
+
+    @staticmethod
+    def is_valid_id(image_id: str) -> bool:
+        return bool(image_id) and _IMAGE_ID_RE.match(image_id) is not None
+
+    def put(self, image: Image.Image) -> str:
+        """전처리된 이미지를 저장하고 image_id 반환"""
+        image_id = self.compute_image_id(image)
+        now = time.time()
+        with self._lock:
+            self._purge_expired_locked(now)
+            if image_id in self._memory:
+                self._memory.move_to_end(image_id)
+            else:
+                nbytes = _image_nbytes(image)
+                self._memory[image_id] = (image, nbytes)
+                self._memory_bytes += nbytes
+                self.stats["stored"] += 1
+            self._last_access[image_id] = now
+            self._evict_memory_locked()
+        return image_id
+
+    def get(self, image_id: str) -> Optional[Image.Image]:
+        """image_id로 이미지 조회 (메모리 → 디스크 순). 없거나 만료 시 None"""
+        if not self.is_valid_id(image_id):
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(image_id)
+            if entry is not None:
+                if now - self._last_access.get(image_id, now) > self.ttl_seconds:
+                    self._drop_memory_locked(image_id)
+                    self._drop_disk_locked(image_id)
+                    self.stats["expired"] += 1
+                    self.stats["misses"] += 1
+                    return None
+                self._memory.move_to_end(image_id)
+                self._last_access[image_id] = now
+                self.stats["memory_hits"] += 1
+                return entry[0]
+
+            path = self._path(image_id)
+            disk = self._disk_index_locked()
+            if image_id not in disk or not path.exists():
+                self.stats["misses"] += 1
+                return None
+            try:
+                if now - path.stat().st_mtime > self.ttl_seconds:
+                    self._drop_disk_locked(image_id)
+                    self.stats["expired"] += 1
+                    self.stats["misses"] += 1
+                    return None
+                with Image.open(path) as img:
+                    image = img.convert("RGB") if img.mode != "RGB" else img.copy()
+                os.utime(path, None)
+            except Exception as e:
+                logger.warning(f"⚠️ 이미지 에셋 디스크 로드 실패 ({image_id}): {e}")
+                self._drop_disk_locked(image_id)
+                self.stats["misses"] += 1
+                return None
+            disk.move_to_end(image_id)
+            # 디스크 히트는 메모리로 다시 승격 (파일은 유지)
+            nbytes = _image_nbytes(image)
+            self._memory[image_id] = (image, nbytes)
+            self._memory_bytes += nbytes
+            self._last_access[image_id] = now
+            self.stats["disk_hits"] += 1
+            self._evict_memory_locked()
+            return image
+
+    def load_images(self, image_ids: List[str]) -> List[Image.Image]:
+        """여러 image_id 조회. 하나라도 없으면 ValueError"""
+        images: List[Image.Image] = []
+        for image_id in image_ids:
+            image = self.get(image_id)
+            if image is None:
+                raise ValueError(f"이미지 에셋을 찾을 수 없거나 만료되었습니다: {image_id}")
+            images.append(image)
+        return images
+
+    def info(self, image_id: str) -> Optional[Dict[str, Any]]:
+        image = self.get(image_id)
+        if image is None:
+            return None
+        return {
+            "image_id": image_id,
+            "width": image.size[0],
+            "height": image.size[1],
+            "mode": image.mode,
+            "expires_in_seconds": self.ttl_seconds,
+        }
+
+    def delete(self, image_id: str) -> bool:
+        if not self.is_valid_id(image_id):
+            return False
+        with self._lock:
+            found = self._drop_memory_locked(image_id)
+            found = self._drop_disk_locked(image_id) or found
+        return found
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._purge_expired_locked(time.time())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._last_access.clear()
+            self._memory_bytes = 0
+
+    # ===== 이벤트 루프용 =====
+    async def put_async(self, image: Image.Image) -> str:
+        return await asyncio.to_thread(self.put, image)
+
+    async def load_images_async(self, image_ids: List[str]) -> List[Image.Image]:
+        return await asyncio.to_thread(self.load_images, image_ids)
+
+    async def info_async(self, image_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.info, image_id)
+
+    async def delete_async(self, image_id: str) -> bool:
+        return await asyncio.to_thread(self.delete, image_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            disk = self._disk or {}
+            return {
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_items": len(disk),
+                "disk_bytes": self._disk_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                **self.stats,
+            }
+
+    # ===== 내부 구현 (self._lock 보유 상태에서 호출) =====
+    def _path(self, image_id: str) -> Path:
+        return self.directory / f"{image_id}.png"
+
+    def _disk_index_locked(self) -> "OrderedDict[str, int]":
+        if self._disk is None:
+            self._disk = OrderedDict()
+            self._disk_bytes = 0
+            if self.directory.is_dir():
+                files = []
+                for path in self.directory.glob("img_*.png"):
+                    try:
+                        st = path.stat()
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, path.stem, st.st_size))
+                for _, image_id, size in sorted(files):
+                    self._disk[image_id] = size
+                    self._disk_bytes += size
+        return self._disk
+
+    def _drop_memory_locked(self, image_id: str) -> bool:
+        entry = self._memory.pop(image_id, None)
+        self._last_access.pop(image_id, None)
+        if entry is None:
+            return False
+        self._memory_bytes -= entry[1]
+        return True
+
+    def _drop_disk_locked(self, image_id: str) -> bool:
+        disk = self._disk_index_locked()
+        size = disk.pop(image_id, None)
+        if size is not None:
+            self._disk_bytes -= size
+        try:
+            self._path(image_id).unlink()
+            return True
+        except FileNotFoundError:
+            return size is not None
+        except OSError as e:
+            logger.warning(f"⚠️ 이미지 에셋 파일 삭제 실패 ({image_id}): {e}")
+            return size is not None
+
+    def _spill_locked(self, image_id: str, image: Image.Image) -> None:
+        disk = self._disk_index_locked()
+        if image_id in disk:
+            # 디스크에서 승격됐던 항목: 메모리에서 쓰인 만큼 파일 만료 시각을 늦춤
+            try:
+                os.utime(self._path(image_id), None)
+                disk.move_to_end(image_id)
+                return
+            except OSError:
+                self._drop_disk_locked(image_id)
+        if self.disk_max_bytes <= 0:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(image_id)
+            tmp_path = path.with_suffix(".tmp")
+            image.save(tmp_path, format="PNG")
+            os.replace(tmp_path, path)
+            size = path.stat().st_size
+        except Exception as e:
+            logger.warning(f"⚠️ 이미지 에셋 디스크 스필 실패 ({image_id}): {e}")
+            return
+        disk[image_id] = size
+        self._disk_bytes += size
+        self.stats["spilled"] += 1
+        while self._disk_bytes > self.disk_max_bytes and len(disk) > 1:
+            oldest_id = next(iter(disk))
+            self._drop_disk_locked(oldest_id)
+            self.stats["disk_evicted"] += 1
+
+    def _evict_memory_locked(self) -> None:
+        while self._memory and (
+            len(self._memory) > self.max_items or self._memory_bytes > self.max_bytes
+        ):
+            if len(self._memory) == 1:
+                break
+            image_id, (image, _) = next(iter(self._memory.items()))
+            # 만료되지 않은 항목만 디스크로 스필
+            if time.time() - self._last_access.get(image_id, 0) <= self.ttl_seconds:
+                self._spill_locked(image_id, image)
+            self._drop_memory_locked(image_id)
+
+    def _purge_expired_locked(self, now: float) -> int:
+        expired = [
+            image_id for image_id, ts in self._last_access.items()
+            if now - ts > self.ttl_seconds
+        ]
+        for image_id in expired:
+            self._drop_memory_locked(image_id)
+            self._drop_disk_locked(image_id)
+        if self._disk:
+            for image_id in list(self._disk.keys()):
+                if image_id in self._memory:
+                    continue
+                try:
+                    mtime = self._path(image_id).stat().st_mtime
+                except OSError:
+                    mtime = 0
+                if now - mtime <= self.ttl_seconds:
+                    # 오래된 순 정렬이므로 이후 항목은 만료되지 않음
+                    break
+                self._drop_disk_locked(image_id)
+                expired.append(image_id)
+        self.stats["expired"] += len(expired)
+        return len(expired)
+
+
+# 전역 에셋 저장소 인스턴스
+image_asset_store = ImageAssetStore()
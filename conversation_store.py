@@ -0,0 +1,994 @@
+"""
+대화 저장소
+- 대화 수 상한 (가장 오래 사용하지 않은 대화부터 LRU 축출)
+- 대화별 메시지 수/바이트 상한 (오래된 메시지부터 제거)
+- 마지막 활동 기준 유휴 TTL, 백그라운드 스위퍼가 주기적으로 정리
+- 보유 바이트/축출 카운터를 /status/detailed에 노출
+- 백엔드: memory (기본, 프로세스 로컬) / sqlite (WAL, 재시작·워커 간 공유)
+"""
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import bisect
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from .logger_config import app_logger as logger
+
+
+CONVERSATION_MAX_COUNT = int(os.getenv("CONVERSATION_MAX_COUNT", "1000"))
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "100"))
+CONVERSATION_MAX_BYTES = int(os.getenv("CONVERSATION_MAX_BYTES", str(256 * 1024)))
+CONVERSATION_TTL_SECONDS = int(os.getenv("CONVERSATION_TTL_SECONDS", "3600"))
+CONVERSATION_SWEEP_INTERVAL_SECONDS = float(os.getenv("CONVERSATION_SWEEP_INTERVAL_SECONDS", "60"))
+# memory | sqlite
+CONVERSATION_STORE_BACKEND = os.getenv("CONVERSATION_STORE", "memory").lower()
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "/tmp/vllm_conversations.sqlite3")
+# 쓰기를 모아서 한 트랜잭션으로 기록하는 간격/최대 건수
+CONVERSATION_DB_FLUSH_INTERVAL_MS = float(os.getenv("CONVERSATION_DB_FLUSH_INTERVAL_MS", "50"))
+CONVERSATION_DB_BATCH_SIZE = int(os.getenv("CONVERSATION_DB_BATCH_SIZE", "256"))
+# 최근 활동 대화를 메모리에 두는 읽기 캐시 크기
+CONVERSATION_DB_CACHE_SIZE = int(os.getenv("CONVERSATION_DB_CACHE_SIZE", "256"))
+CONVERSATION_LIST_DEFAULT_LIMIT = int(os.getenv("CONVERSATION_LIST_DEFAULT_LIMIT", "50"))
+CONVERSATION_LIST_MAX_LIMIT = int(os.getenv("CONVERSATION_LIST_MAX_LIMIT", "500"))
+
+# __slots__ 객체 + 문자열 헤더의 대략적인 오버헤드
+_MESSAGE_OVERHEAD_BYTES = 96
+
+_MISSING = object()
+
+
+class Message:
+    """대화 메시지 레코드 (__slots__, epoch 타임스탬프)
+
+    get()/[]로 읽을 수 있어 메시지 dict를 받던 코드와 호환됩니다.
+    image_info/image_ids/summary 같은 선택 필드는 extra에 둡니다.
+    """
+
+    __slots__ = ("role", "content", "created_at", "tokens", "extra")
+    _FIELDS = ("role", "content", "created_at", "tokens")
+
+    def __init__(
+        self,
+        role: str,
+        content: str,
+        created_at: Optional[float] = None,
+        tokens: Optional[int] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ):
+        self.role = role
+        self.content = content
+        self.created_at = time.time() if created_at is None else created_at
+        self.tokens = tokens
+        self.extra = extra or None
+
+    @property
+    def timestamp(self) -> str:
+        return datetime.fromtimestamp(self.created_at).isoformat()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in Message._FIELDS:
+            return getattr(self, key)
+        if key == "timestamp":
+            return self.timestamp
+        return self.extra.get(key, default) if self.extra else default
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Message):
+            return NotImplemented
+        return (
+            self.role == other.role
+            and self.content == other.content
+            and self.created_at == other.created_at
+            and self.tokens == other.tokens
+            and (self.extra or None) == (other.extra or None)
+        )
+
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, content={self.content[:30]!r}, created_at={self.created_at})"
+
+    def to_record(self) -> Dict[str, Any]:
+        """저장용 dict (epoch 타임스탬프)"""
+        record: Dict[str, Any] = {"role": self.role, "content": self.content, "created_at": self.created_at}
+        if self.tokens is not None:
+            record["tokens"] = self.tokens
+        if self.extra:
+            record.update(self.extra)
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        """API 응답용 dict (ISO timestamp 포함)"""
+        return {**self.to_record(), "timestamp": self.timestamp}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Message":
+        extra = {k: v for k, v in data.items() if k not in cls._FIELDS and k != "timestamp"}
+        created_at = data.get("created_at")
+        if created_at is None and data.get("timestamp"):
+            # ISO 문자열 타임스탬프로 저장된 이전 형식
+            try:
+                created_at = datetime.fromisoformat(data["timestamp"]).timestamp()
+            except (TypeError, ValueError):
+                created_at = None
+        return cls(
+            role=data.get("role", "user"),
+            content=data.get("content", ""),
+            created_at=created_at,
+            tokens=data.get("tokens"),
+            extra=extra,
+        )
+
+
+MessageLike = Union[Message, Dict[str, Any]]
+
+
+def as_message(message: MessageLike) -> Message:
+    return message if isinstance(message, Message) else Message.from_dict(message)
+
+
+def message_nbytes(message: MessageLike) -> int:
+    """메시지가 차지하는 대략적인 메모리 바이트 수"""
+    message = as_message(message)
+    nbytes = _MESSAGE_OVERHEAD_BYTES + len(message.content.encode("utf-8")) + len(message.role)
+    for key, value in (message.extra or {}).items():
+        nbytes += len(key) + 16
+        if isinstance(value, str):
+            nbytes += len(value.encode("utf-8"))
+        elif isinstance(value, (list, tuple)):
+            nbytes += sum(len(str(v)) for v in value)
+    return nbytes
+
+
+def encode_cursor(last_activity: float, conversation_id: str) -> str:
+    return f"{last_activity!r}:{conversation_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """목록 커서 → (last_activity, conversation_id). 형식이 잘못되면 ValueError"""
+    ts, sep, conversation_id = cursor.partition(":")
+    if not sep or not conversation_id:
+        raise ValueError(f"잘못된 커서: {cursor}")
+    return float(ts), conversation_id
+
+
+def conversation_summary(
+    conversation_id: str, message_count: int, last_message: Optional[MessageLike], last_activity: float
+) -> Dict[str, Any]:
+    """/conversations 목록 항목"""
+    content = last_message.get("content", "") if last_message else None
+    return {
+        "conversation_id": conversation_id,
+        "message_count": message_count,
+        "last_activity": last_activity,
+        "last_message_time": last_message.get("timestamp") if last_message else None,
+        "last_message_preview": content[:50] + "..." if content and len(content) > 50 else content,
+    }
+
+
+class _ActivityIndex:
+    """(last_activity, conversation_id) 정렬 목록 — 커서 기반 최신순 페이지 조회를 O(log n + page)로"""
+
+    def __init__(self) -> None:
+        self._keys: List[Tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, last_activity: float, conversation_id: str) -> None:
+        key = (last_activity, conversation_id)
+        # 대부분 가장 최근 활동이므로 끝에 추가
+        if not self._keys or self._keys[-1] <= key:
+            self._keys.append(key)
+        else:
+            bisect.insort(self._keys, key)
+
+    def remove(self, last_activity: float, conversation_id: str) -> None:
+        key = (last_activity, conversation_id)
+        idx = bisect.bisect_left(self._keys, key)
+        if idx < len(self._keys) and self._keys[idx] == key:
+            del self._keys[idx]
+
+    def clear(self) -> None:
+        self._keys.clear()
+
+    def page(self, limit: int, before: Optional[Tuple[float, str]] = None) -> List[Tuple[float, str]]:
+        """before보다 오래된 항목을 최신순으로 limit개"""
+        end = len(self._keys) if before is None else bisect.bisect_left(self._keys, before)
+        start = max(0, end - limit)
+        return self._keys[start:end][::-1]
+
+
+class BaseConversationStore(ABC):
+    """대화 저장소 인터페이스 (add_to_conversation, /conversations 엔드포인트가 사용)"""
+
+    ttl_seconds: int
+    sweep_interval: float
+    # 조회가 블로킹 I/O인 백엔드 (이벤트 루프에서는 offload로 호출)
+    blocking = False
+
+    def __init__(self) -> None:
+        self._invalidation_listeners: List[Callable[[Optional[str]], None]] = []
+        self._trim_listeners: List[Callable[[str, int], None]] = []
+
+    def add_invalidation_listener(self, callback: Callable[[Optional[str]], None]) -> None:
+        """기존 메시지가 교체/삭제될 때 호출할 콜백 등록 (인자 None은 전체 무효화)"""
+        self._invalidation_listeners.append(callback)
+
+    def add_trim_listener(self, callback: Callable[[str, int], None]) -> None:
+        """상한 때문에 가장 오래된 메시지가 잘릴 때 호출할 콜백 등록 (대화 ID, 잘린 메시지 수)"""
+        self._trim_listeners.append(callback)
+
+    def __contains__(self, conversation_id: object) -> bool:
+        return isinstance(conversation_id, str) and self.exists(conversation_id)
+
+    @abstractmethod
+    def __len__(self) -> int: ...
+
+    @abstractmethod
+    def exists(self, conversation_id: str) -> bool: ...
+
+    @abstractmethod
+    def append(self, conversation_id: str, message: MessageLike) -> None:
+        """메시지 추가 (대화가 없으면 생성)"""
+
+    @abstractmethod
+    def get_messages(self, conversation_id: str) -> Optional[List[Message]]:
+        """대화 메시지 목록 (복사본). 없거나 만료 시 None"""
+
+    @abstractmethod
+    def message_count(self, conversation_id: str) -> int: ...
+
+    def get_messages_since(self, conversation_id: str, start: int) -> Optional[List[Message]]:
+        """start번째 이후 메시지만 반환 (증분 프롬프트 구성용)"""
+        messages = self.get_messages(conversation_id)
+        return None if messages is None else messages[start:]
+
+    @abstractmethod
+    def list_conversations(
+        self, limit: int = CONVERSATION_LIST_DEFAULT_LIMIT, cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """최근 활동 순 대화 요약 한 페이지와 다음 페이지 커서 (없으면 None)"""
+
+    @abstractmethod
+    def replace_head(
+        self, conversation_id: str, count: int, expected_first: MessageLike, replacement: List[MessageLike]
+    ) -> bool:
+        """앞쪽 count개 메시지를 replacement로 교체 (요약 등)
+
+        그 사이 앞쪽이 잘렸거나 편집되어 첫 메시지가 expected_first와 다르면 교체하지 않고 False.
+        """
+
+    @abstractmethod
+    def delete(self, conversation_id: str) -> bool: ...
+
+    @abstractmethod
+    def purge_expired(self) -> int:
+        """유휴 TTL이 지난 대화를 제거하고 제거 수 반환"""
+
+    @abstractmethod
+    def clear(self) -> None: ...
+
+    @abstractmethod
+    def get_stats(self) -> Dict[str, Any]: ...
+
+    # ===== 수명 주기 / 백그라운드 스위퍼 =====
+    _sweeper: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._sweeper is None and self.ttl_seconds > 0 and self.sweep_interval > 0:
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop())
+
+    async def aclose(self) -> None:
+        if self._sweeper is None:
+            return
+        self._sweeper.cancel()
+        try:
+            await self._sweeper
+        except asyncio.CancelledError:
+            pass
+        self._sweeper = None
+
+    async def offload(self, func: Callable[..., Any], *args: Any) -> Any:
+        """저장소를 읽는 동기 함수를 이벤트 루프에서 호출 (블로킹 백엔드면 스레드에서 실행)"""
+        if self.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    def _notify_invalidated(self, conversation_id: Optional[str]) -> None:
+        for callback in self._invalidation_listeners:
+            try:
+                callback(conversation_id)
+            except Exception as e:
+                logger.warning(f"⚠️ 대화 무효화 콜백 실패: {e}")
+
+    def _notify_trimmed(self, conversation_id: str, count: int) -> None:
+        for callback in self._trim_listeners:
+            try:
+                callback(conversation_id, count)
+            except Exception as e:
+                logger.warning(f"⚠️ 대화 트리밍 콜백 실패: {e}")
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                removed = await asyncio.to_thread(self.purge_expired)
+                if removed:
+                    logger.info(f"🧹 유휴 대화 {removed}개 정리 (TTL {self.ttl_seconds}s)")
+            except Exception as e:
+                logger.warning(f"⚠️ 대화 정리 실패: {e}")
+
+
+@dataclass
+class _Conversation:
+    messages: List[Message] = field(default_factory=list)
+    nbytes: int = 0
+    last_activity: float = field(default_factory=time.time)
+    # 읽기 캐시로 쓸 때 원본 DB의 대화 버전
+    version: int = 0
+
+
+class MemoryConversationStore(BaseConversationStore):
+    """conversation_id → 메시지 목록 저장소 (메모리, 상한/TTL 적용)"""
+
+    def __init__(
+        self,
+        max_conversations: int = CONVERSATION_MAX_COUNT,
+        max_messages: int = CONVERSATION_MAX_MESSAGES,
+        max_bytes: int = CONVERSATION_MAX_BYTES,
+        ttl_seconds: int = CONVERSATION_TTL_SECONDS,
+        sweep_interval: float = CONVERSATION_SWEEP_INTERVAL_SECONDS,
+    ):
+        super().__init__()
+        self.max_conversations = max(1, max_conversations)
+        self.max_messages = max(2, max_messages)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        # 가장 최근 활동이 뒤쪽
+        self._conversations: "OrderedDict[str, _Conversation]" = OrderedDict()
+        # 목록 페이지 조회용 (last_activity, id) 정렬 인덱스
+        self._activity = _ActivityIndex()
+        self._total_bytes = 0
+        self.stats: Dict[str, int] = {
+            "evicted_lru": 0,
+            "evicted_ttl": 0,
+            "messages_trimmed": 0,
+            "deleted": 0,
+        }
+
+    # ===== 공개 API =====
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._conversations)
+
+    def exists(self, conversation_id: str) -> bool:
+        now = time.time()
+        with self._lock:
+            return self._live_locked(conversation_id, now) is not None
+
+    def append(self, conversation_id: str, message: MessageLike) -> None:
+        """상한을 넘으면 오래된 메시지/대화부터 제거"""
+        now = time.time()
+        message = as_message(message)
+        nbytes = message_nbytes(message)
+        with self._lock:
+            conv = self._live_locked(conversation_id, now)
+            if conv is None:
+                conv = _Conversation(last_activity=now)
+                self._conversations[conversation_id] = conv
+                self._activity.add(now, conversation_id)
+            conv.messages.append(message)
+            conv.nbytes += nbytes
+            self._total_bytes += nbytes
+            self._touch_locked(conversation_id, conv, now)
+            self._trim_locked(conversation_id, conv)
+            while len(self._conversations) > self.max_conversations:
+                evicted_id, _ = next(iter(self._conversations.items()))
+                self._drop_locked(evicted_id)
+                self.stats["evicted_lru"] += 1
+
+    def get_messages(self, conversation_id: str) -> Optional[List[Message]]:
+        now = time.time()
+        with self._lock:
+            conv = self._live_locked(conversation_id, now)
+            if conv is None:
+                return None
+            self._touch_locked(conversation_id, conv, now)
+            return list(conv.messages)
+
+    def message_count(self, conversation_id: str) -> int:
+        with self._lock:
+            conv = self._conversations.get(conversation_id)
+            return len(conv.messages) if conv is not None else 0
+
+    def get_messages_since(self, conversation_id: str, start: int) -> Optional[List[Message]]:
+        now = time.time()
+        with self._lock:
+            conv = self._live_locked(conversation_id, now)
+            if conv is None:
+                return None
+            self._touch_locked(conversation_id, conv, now)
+            return conv.messages[start:]
+
+    def set_messages(
+        self,
+        conversation_id: str,
+        messages: List[MessageLike],
+        last_activity: Optional[float] = None,
+        version: int = 0,
+    ) -> None:
+        """대화 전체를 교체 (다른 백엔드의 읽기 캐시로 쓸 때 사용)"""
+        messages = [as_message(m) for m in messages]
+        with self._lock:
+            self._drop_locked(conversation_id)
+            conv = _Conversation(
+                messages=messages,
+                nbytes=sum(message_nbytes(m) for m in messages),
+                last_activity=last_activity or time.time(),
+                version=version,
+            )
+            self._conversations[conversation_id] = conv
+            self._activity.add(conv.last_activity, conversation_id)
+            self._total_bytes += conv.nbytes
+            while len(self._conversations) > self.max_conversations:
+                self._drop_locked(next(iter(self._conversations)))
+
+    def cached_version(self, conversation_id: str) -> Optional[int]:
+        """set_messages/set_version으로 기록한 원본 버전 (캐시에 없으면 None)"""
+        with self._lock:
+            conv = self._conversations.get(conversation_id)
+            return conv.version if conv is not None else None
+
+    def set_version(self, conversation_id: str, version: int) -> None:
+        with self._lock:
+            conv = self._conversations.get(conversation_id)
+            if conv is not None:
+                conv.version = version
+
+    def replace_head(
+        self, conversation_id: str, count: int, expected_first: MessageLike, replacement: List[MessageLike]
+    ) -> bool:
+        with self._lock:
+            conv = self._conversations.get(conversation_id)
+            if conv is None or count <= 0 or len(conv.messages) < count or conv.messages[0] != as_message(expected_first):
+                return False
+            conv.messages[:count] = [as_message(m) for m in replacement]
+            nbytes = sum(message_nbytes(m) for m in conv.messages)
+            self._total_bytes += nbytes - conv.nbytes
+            conv.nbytes = nbytes
+            self._notify_invalidated(conversation_id)
+            return True
+
+    def list_conversations(
+        self, limit: int = CONVERSATION_LIST_DEFAULT_LIMIT, cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        before = decode_cursor(cursor) if cursor else None
+        with self._lock:
+            keys = self._activity.page(limit + 1, before)
+            items = []
+            for last_activity, cid in keys[:limit]:
+                conv = self._conversations[cid]
+                items.append(conversation_summary(
+                    cid, len(conv.messages), conv.messages[-1] if conv.messages else None, last_activity
+                ))
+        next_cursor = encode_cursor(*keys[limit - 1]) if len(keys) > limit else None
+        return items, next_cursor
+
+    def delete(self, conversation_id: str) -> bool:
+        with self._lock:
+            if conversation_id not in self._conversations:
+                return False
+            self._drop_locked(conversation_id)
+            self.stats["deleted"] += 1
+            return True
+
+    def purge_expired(self) -> int:
+        if self.ttl_seconds <= 0:
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        removed = 0
+        with self._lock:
+            # 활동 순으로 정렬되어 있으므로 앞쪽부터 만료 검사
+            while self._conversations:
+                cid, conv = next(iter(self._conversations.items()))
+                if conv.last_activity > cutoff:
+                    break
+                self._drop_locked(cid)
+                removed += 1
+            self.stats["evicted_ttl"] += removed
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conversations.clear()
+            self._activity.clear()
+            self._total_bytes = 0
+        self._notify_invalidated(None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "active_conversations": len(self._conversations),
+                "total_messages": sum(len(c.messages) for c in self._conversations.values()),
+                "total_bytes": self._total_bytes,
+                "max_conversations": self.max_conversations,
+                "max_messages_per_conversation": self.max_messages,
+                "max_bytes_per_conversation": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                **self.stats,
+            }
+
+    async def aclose(self) -> None:
+        await super().aclose()
+        self.clear()
+
+    # ===== 내부 구현 (self._lock 보유 상태에서 호출) =====
+    def _live_locked(self, conversation_id: str, now: float) -> Optional[_Conversation]:
+        conv = self._conversations.get(conversation_id)
+        if conv is None:
+            return None
+        if self.ttl_seconds > 0 and now - conv.last_activity > self.ttl_seconds:
+            self._drop_locked(conversation_id)
+            self.stats["evicted_ttl"] += 1
+            return None
+        return conv
+
+    def _touch_locked(self, conversation_id: str, conv: _Conversation, now: float) -> None:
+        if conv.last_activity != now:
+            self._activity.remove(conv.last_activity, conversation_id)
+            conv.last_activity = now
+            self._activity.add(now, conversation_id)
+        self._conversations.move_to_end(conversation_id)
+
+    def _trim_locked(self, conversation_id: str, conv: _Conversation) -> None:
+        before = len(conv.messages)
+        # 최신 메시지는 항상 남김
+        while len(conv.messages) > 1 and (
+            len(conv.messages) > self.max_messages or conv.nbytes > self.max_bytes
+        ):
+            self._pop_oldest_locked(conv)
+        # 잘린 뒤 assistant 답변으로 시작하면 짝이 없는 답변도 제거
+        while len(conv.messages) > 1 and conv.messages[0].get("role") == "assistant":
+            self._pop_oldest_locked(conv)
+        if len(conv.messages) != before:
+            self._notify_trimmed(conversation_id, before - len(conv.messages))
+
+    def _pop_oldest_locked(self, conv: _Conversation) -> None:
+        removed = conv.messages.pop(0)
+        nbytes = message_nbytes(removed)
+        conv.nbytes -= nbytes
+        self._total_bytes -= nbytes
+        self.stats["messages_trimmed"] += 1
+
+    def _drop_locked(self, conversation_id: str) -> None:
+        conv = self._conversations.pop(conversation_id, None)
+        if conv is not None:
+            self._activity.remove(conv.last_activity, conversation_id)
+            self._total_bytes -= conv.nbytes
+            self._notify_invalidated(conversation_id)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    last_activity REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    nbytes INTEGER NOT NULL DEFAULT 0,
+    -- 메시지가 바뀔 때마다 증가 (워커별 읽기 캐시의 최신 여부 확인용)
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_activity ON conversations(last_activity, id);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    body TEXT NOT NULL,
+    nbytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id, id);
+"""
+
+
+class SQLiteConversationStore(BaseConversationStore):
+    """SQLite(WAL) 대화 저장소
+
+    쓰기는 대기열에 모았다가 백그라운드에서 한 트랜잭션으로 기록하고,
+    최근 활동 대화는 MemoryConversationStore 읽기 캐시에서 반환합니다.
+    여러 uvicorn 워커/재시작 간에 같은 DB 파일을 공유할 수 있으며,
+    캐시는 읽을 때마다 DB의 대화 버전과 비교해 다른 워커가 바꾼 대화는 다시 읽습니다.
+    조회는 블로킹이므로 이벤트 루프에서는 offload()로 호출합니다.
+    """
+
+    blocking = True
+
+    def __init__(
+        self,
+        path: str = CONVERSATION_DB_PATH,
+        max_conversations: int = CONVERSATION_MAX_COUNT,
+        max_messages: int = CONVERSATION_MAX_MESSAGES,
+        max_bytes: int = CONVERSATION_MAX_BYTES,
+        ttl_seconds: int = CONVERSATION_TTL_SECONDS,
+        sweep_interval: float = CONVERSATION_SWEEP_INTERVAL_SECONDS,
+        flush_interval_ms: float = CONVERSATION_DB_FLUSH_INTERVAL_MS,
+        batch_size: int = CONVERSATION_DB_BATCH_SIZE,
+        cache_size: int = CONVERSATION_DB_CACHE_SIZE,
+    ):
+        super().__init__()
+        self.path = path
+        self.max_conversations = max(1, max_conversations)
+        self.max_messages = max(2, max_messages)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000
+        self.batch_size = max(1, batch_size)
+        # 캐시는 DB와 같은 대화별 상한으로 잘라서 DB 내용과 일치시킴
+        self._cache = MemoryConversationStore(
+            max_conversations=cache_size,
+            max_messages=max_messages,
+            max_bytes=max_bytes,
+            ttl_seconds=ttl_seconds,
+            sweep_interval=0,
+        )
+        # 캐시된 대화는 append 시점에 캐시에서 잘리므로 그 알림을 그대로 전달
+        self._cache.add_trim_listener(self._notify_trimmed)
+        self._pending: List[Tuple[str, str, str, int, float]] = []
+        self._pending_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._flush_event: Optional[asyncio.Event] = None
+        self._writer: Optional[asyncio.Task] = None
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        # __len__용 대화 수 (쓰기/삭제 시 갱신, 스위퍼가 DB 기준으로 다시 맞춤)
+        self._count = self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+        self.stats: Dict[str, int] = {
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "cache_stale": 0,
+            "flushes": 0,
+            "messages_written": 0,
+            "evicted_lru": 0,
+            "evicted_ttl": 0,
+            "messages_trimmed": 0,
+            "deleted": 0,
+        }
+
+    # ===== 공개 API =====
+    def __len__(self) -> int:
+        return self._count
+
+    def exists(self, conversation_id: str) -> bool:
+        return self._has_pending(conversation_id) or self._db_state(conversation_id) is not None
+
+    def append(self, conversation_id: str, message: MessageLike) -> None:
+        # 캐시에 있는 대화만 캐시에 반영 (없는 대화를 부분 메시지로 캐시하지 않음)
+        message = as_message(message)
+        if self._cache.exists(conversation_id):
+            self._cache.append(conversation_id, message)
+        body = json.dumps(message.to_record(), ensure_ascii=False)
+        with self._pending_lock:
+            self._pending.append((conversation_id, message.role, body, message_nbytes(message), time.time()))
+            pending = len(self._pending)
+        if self._writer is None:
+            # 백그라운드 writer가 없으면 (시작 전/종료 후) 즉시 기록
+            self.flush()
+        elif self._flush_event is not None and (pending == 1 or pending >= self.batch_size):
+            self._flush_event.set()
+
+    def get_messages(self, conversation_id: str) -> Optional[List[Message]]:
+        state = self._db_state(conversation_id)
+        if state is not None:
+            # 캐시 내용 = DB(같은 버전) + 이 워커의 미기록 쓰기
+            cached_version = self._cache.cached_version(conversation_id)
+            if cached_version == state[0]:
+                messages = self._cache.get_messages(conversation_id)
+                if messages is not None:
+                    self.stats["cache_hits"] += 1
+                    return messages
+            elif cached_version is not None:
+                # 다른 워커가 추가/요약/삭제한 대화 → 캐시를 버리고 다시 읽음
+                self.stats["cache_stale"] += 1
+                self._cache.delete(conversation_id)
+                self._notify_invalidated(conversation_id)
+        elif not self._has_pending(conversation_id):
+            self._cache.delete(conversation_id)
+            return None
+        self.stats["cache_misses"] += 1
+        self.flush()
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT version, last_activity FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+            rows = self._conn.execute(
+                "SELECT body FROM messages WHERE conversation_id = ? ORDER BY id", (conversation_id,)
+            ).fetchall()
+        if row is None or self._expired(row[1]):
+            return None
+        messages = [Message.from_dict(json.loads(body)) for (body,) in rows]
+        self._cache.set_messages(conversation_id, messages, row[1], version=row[0])
+        return list(messages)
+
+    def message_count(self, conversation_id: str) -> int:
+        messages = self.get_messages(conversation_id)
+        return len(messages) if messages else 0
+
+    def list_conversations(
+        self, limit: int = CONVERSATION_LIST_DEFAULT_LIMIT, cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        # 커서 위치부터 (last_activity, id) 인덱스를 역순으로 limit+1개만 읽음
+        before = decode_cursor(cursor) if cursor else None
+        where = "WHERE (c.last_activity, c.id) < (?, ?)" if before else ""
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT c.id, c.last_activity, c.message_count, m.body
+                FROM conversations c
+                LEFT JOIN messages m ON m.id = (
+                    SELECT MAX(id) FROM messages WHERE conversation_id = c.id
+                )
+                {where}
+                ORDER BY c.last_activity DESC, c.id DESC
+                LIMIT ?
+                """,
+                (*(before or ()), limit + 1),
+            ).fetchall()
+        items = [
+            conversation_summary(cid, count, Message.from_dict(json.loads(body)) if body else None, last_activity)
+            for cid, last_activity, count, body in rows[:limit]
+        ]
+        next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+        return items, next_cursor
+
+    def replace_head(
+        self, conversation_id: str, count: int, expected_first: MessageLike, replacement: List[MessageLike]
+    ) -> bool:
+        if count <= 0:
+            return False
+        self.flush()
+        with self._db_lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT id, body FROM messages WHERE conversation_id = ? ORDER BY id LIMIT ?", (conversation_id, count)
+            ).fetchall()
+            if len(rows) < count or Message.from_dict(json.loads(rows[0][1])) != as_message(expected_first):
+                return False
+            replacement = [as_message(m) for m in replacement]
+            head_ids = [row[0] for row in rows]
+            self._conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in head_ids])
+            # 교체 메시지는 삭제한 id 자리에 넣어 순서를 유지
+            slots = head_ids[-len(replacement):] if replacement else []
+            self._conn.executemany(
+                "INSERT INTO messages (id, conversation_id, role, body, nbytes) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (slot, conversation_id, m.role, json.dumps(m.to_record(), ensure_ascii=False), message_nbytes(m))
+                    for slot, m in zip(slots, replacement)
+                ],
+            )
+            self._trim_locked(conversation_id)
+            self._conn.execute("UPDATE conversations SET version = version + 1 WHERE id = ?", (conversation_id,))
+        self._cache.delete(conversation_id)
+        self._notify_invalidated(conversation_id)
+        return True
+
+    def delete(self, conversation_id: str) -> bool:
+        self._cache.delete(conversation_id)
+        self.flush()
+        with self._db_lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            deleted = self._conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,)).rowcount
+        if deleted:
+            self._count = max(0, self._count - deleted)
+            self.stats["deleted"] += 1
+            self._notify_invalidated(conversation_id)
+        return bool(deleted)
+
+    def purge_expired(self) -> int:
+        self.flush()
+        self._cache.purge_expired()
+        expired: List[str] = []
+        overflow: List[str] = []
+        with self._db_lock, self._conn:
+            if self.ttl_seconds > 0:
+                expired = [row[0] for row in self._conn.execute(
+                    "SELECT id FROM conversations WHERE last_activity < ?", (time.time() - self.ttl_seconds,)
+                )]
+                self._delete_conversations_locked(expired)
+            overflow = [row[0] for row in self._conn.execute(
+                "SELECT id FROM conversations ORDER BY last_activity DESC LIMIT -1 OFFSET ?", (self.max_conversations,)
+            )]
+            self._delete_conversations_locked(overflow)
+            # 다른 워커가 만든/지운 대화까지 반영
+            self._count = self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+        for cid in expired + overflow:
+            self._cache.delete(cid)
+            self._notify_invalidated(cid)
+        self.stats["evicted_ttl"] += len(expired)
+        self.stats["evicted_lru"] += len(overflow)
+        return len(expired) + len(overflow)
+
+    def clear(self) -> None:
+        with self._pending_lock:
+            self._pending.clear()
+        self._cache.clear()
+        with self._db_lock, self._conn:
+            self._conn.execute("DELETE FROM messages")
+            self._conn.execute("DELETE FROM conversations")
+            self._count = 0
+        self._notify_invalidated(None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._pending_lock:
+            pending = len(self._pending)
+        with self._db_lock:
+            count, messages, nbytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(message_count), 0), COALESCE(SUM(nbytes), 0) FROM conversations"
+            ).fetchone()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "active_conversations": count,
+            "total_messages": messages,
+            "total_bytes": nbytes,
+            "pending_writes": pending,
+            "cached_conversations": len(self._cache),
+            "max_conversations": self.max_conversations,
+            "max_messages_per_conversation": self.max_messages,
+            "max_bytes_per_conversation": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            **self.stats,
+        }
+
+    def flush(self) -> int:
+        """대기 중인 쓰기를 한 트랜잭션으로 기록하고 기록 건수 반환"""
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        touched: Dict[str, float] = {}
+        for cid, _, _, _, ts in batch:
+            touched[cid] = ts
+        with self._db_lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO messages (conversation_id, role, body, nbytes) VALUES (?, ?, ?, ?)",
+                    [(cid, role, body, nbytes) for cid, role, body, nbytes, _ in batch],
+                )
+                created = 0
+                versions: Dict[str, int] = {}
+                for cid, ts in touched.items():
+                    created += self._conn.execute(
+                        "INSERT OR IGNORE INTO conversations (id, last_activity) VALUES (?, ?)", (cid, ts)
+                    ).rowcount
+                    self._conn.execute(
+                        "UPDATE conversations SET last_activity = MAX(last_activity, ?), version = version + 1 "
+                        "WHERE id = ?",
+                        (ts, cid),
+                    )
+                    self._trim_locked(cid)
+                    versions[cid] = self._conn.execute(
+                        "SELECT version FROM conversations WHERE id = ?", (cid,)
+                    ).fetchone()[0]
+            self._count += created
+            for cid, version in versions.items():
+                # 그 사이 다른 워커의 쓰기가 없었으면 캐시는 (이미 반영된) 이번 쓰기만큼만 앞서 있음
+                if self._cache.cached_version(cid) == version - 1:
+                    self._cache.set_version(cid, version)
+        self.stats["flushes"] += 1
+        self.stats["messages_written"] += len(batch)
+        return len(batch)
+
+    async def start(self) -> None:
+        await super().start()
+        if self._writer is None:
+            self._flush_event = asyncio.Event()
+            self._writer = asyncio.get_running_loop().create_task(self._writer_loop())
+
+    async def aclose(self) -> None:
+        await super().aclose()
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+            self._flush_event = None
+        self.flush()
+        self._cache.clear()
+
+    # ===== 내부 구현 =====
+    async def _writer_loop(self) -> None:
+        assert self._flush_event is not None
+        while True:
+            await self._flush_event.wait()
+            # 짧게 기다려 같은 구간의 쓰기를 한 배치로 모음
+            if self.flush_interval > 0:
+                await asyncio.sleep(self.flush_interval)
+            self._flush_event.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.warning(f"⚠️ 대화 DB 기록 실패: {e}")
+
+    def _has_pending(self, conversation_id: str) -> bool:
+        with self._pending_lock:
+            return any(item[0] == conversation_id for item in self._pending)
+
+    def _db_state(self, conversation_id: str) -> Optional[Tuple[int, float]]:
+        """DB의 (version, last_activity). 없거나 만료 시 None"""
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT version, last_activity FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+        if row is None or self._expired(row[1]):
+            return None
+        return row[0], row[1]
+
+    def _expired(self, last_activity: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - last_activity > self.ttl_seconds
+
+    def _trim_locked(self, conversation_id: str) -> None:
+        """메시지 수/바이트 상한을 넘는 오래된 메시지 삭제 후 집계 갱신"""
+        rows = self._conn.execute(
+            "SELECT id, role, nbytes FROM messages WHERE conversation_id = ? ORDER BY id DESC",
+            (conversation_id,),
+        ).fetchall()
+        keep = 0
+        used = 0
+        for _, _, nbytes in rows:
+            if keep >= 1 and (keep >= self.max_messages or used + nbytes > self.max_bytes):
+                break
+            keep += 1
+            used += nbytes
+        # 잘린 뒤 assistant 답변으로 시작하면 짝이 없는 답변도 제거
+        while keep > 1 and keep < len(rows) and rows[keep - 1][1] == "assistant":
+            keep -= 1
+            used -= rows[keep][2]
+        if keep < len(rows):
+            self._conn.execute(
+                "DELETE FROM messages WHERE conversation_id = ? AND id <= ?", (conversation_id, rows[keep][0])
+            )
+            self.stats["messages_trimmed"] += len(rows) - keep
+            if self._cache.cached_version(conversation_id) is None:
+                self._notify_trimmed(conversation_id, len(rows) - keep)
+        self._conn.execute(
+            "UPDATE conversations SET message_count = ?, nbytes = ? WHERE id = ?", (keep, used, conversation_id)
+        )
+
+    def _delete_conversations_locked(self, conversation_ids: List[str]) -> None:
+        for cid in conversation_ids:
+            self._conn.execute("DELETE FROM messages WHERE conversation_id = ?", (cid,))
+            self._conn.execute("DELETE FROM conversations WHERE id = ?", (cid,))
+
+
+def create_conversation_store(backend: str = CONVERSATION_STORE_BACKEND) -> BaseConversationStore:
+    if backend == "sqlite":
+        logger.info(f"💾 대화 저장소: SQLite ({CONVERSATION_DB_PATH})")
+        return SQLiteConversationStore()
+    if backend != "memory":
+        logger.warning(f"⚠️ 알 수 없는 CONVERSATION_STORE={backend}, memory 사용")
+    return MemoryConversationStore()
+
+
+# 전역 대화 저장소 인스턴스
+conversation_store = create_conversation_store()
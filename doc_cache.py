@@ -0,0 +1,409 @@
+"""
+추출 문서 캐시
+- 파일 내용 해시 → 추출 텍스트 (PyPDF2/python-docx 재파싱 방지)
+- 메모리 LRU + 로컬 디스크 스필, TTL 만료
+- document_id로 이후 /multimodal 요청에서 file_data 없이 재사용
+- 예산 때문에 일부만 추출한 문서는 원본 파일도 보관해, 전체 텍스트가 필요하면 다시 추출
+  (원본 크기도 디스크 예산에 포함, 초과 시 오래된 항목부터 원본과 함께 제거)
+- 디스크 I/O는 스레드에서 실행 (이벤트 루프에서는 async 메서드 사용)
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import asyncio
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .file_io import FileSource, hash_file_source, process_uploaded_file_async, trim_to_tokens
+from .logger_config import app_logger as logger
+
+
+DOCUMENT_CACHE_DIR = os.getenv("DOCUMENT_CACHE_DIR", "/tmp/vllm_document_cache")
+DOCUMENT_CACHE_TTL_SECONDS = int(os.getenv("DOCUMENT_CACHE_TTL_SECONDS", "86400"))
+DOCUMENT_CACHE_MEMORY_MAX_ITEMS = int(os.getenv("DOCUMENT_CACHE_MEMORY_MAX_ITEMS", "32"))
+DOCUMENT_CACHE_MEMORY_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MEMORY_MAX_BYTES", str(128 * 1024 * 1024)))
+DOCUMENT_CACHE_DISK_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_DISK_MAX_BYTES", str(1024 ** 3)))
+
+_DOCUMENT_ID_RE = re.compile(r"^doc_[0-9a-f]{24}$")
+
+
+@dataclass
+class CachedDocument:
+    document_id: str
+    file_type: str
+    text: str
+    # False이면 토큰 예산 때문에 추출을 중간에 멈춘 텍스트
+    complete: bool
+    extract_ms: float
+    created_at: float
+    nbytes: int = 0
+    # 압축 단계에서 절약한 토큰 수 (캐시 적중 시에도 보고)
+    tokens_saved: int = 0
+    # complete=False일 때 추출에 사용한 토큰 예산
+    extract_budget: Optional[int] = None
+    # 텍스트가 거의 없는 (스캔) PDF 페이지 번호
+    scanned_pages: List[int] = field(default_factory=list)
+
+
+class DocumentCache:
+    """document_id → 추출 텍스트 캐시 (메모리 LRU + 디스크 스필)"""
+
+    def __init__(
+        self,
+        directory: str = DOCUMENT_CACHE_DIR,
+        ttl_seconds: int = DOCUMENT_CACHE_TTL_SECONDS,
+        max_items: int = DOCUMENT_CACHE_MEMORY_MAX_ITEMS,
+        max_bytes: int = DOCUMENT_CACHE_MEMORY_MAX_BYTES,
+        disk_max_bytes: int = DOCUMENT_CACHE_DISK_MAX_BYTES,
+    ):
+        self.directory = Path(directory)
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max(1, max_items)
+        self.max_bytes = max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, CachedDocument]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: Optional["OrderedDict[str, int]"] = None
+        self._disk_bytes = 0
+        # 보관 중인 원본 파일 크기 (document_id → bytes, 오래된 순)
+        self._sources: "OrderedDict[str, int]" = OrderedDict()
+        self._source_bytes = 0
+        self.stats: Dict[str, float] = {
+            "hits": 0,
+            "misses": 0,
+            "partial_refreshes": 0,
+            "extraction_ms_saved": 0.0,
+            "spilled": 0,
+            "expired": 0,
+            "sources_evicted": 0,
+        }
+
+    # ===== 공개 API =====
+    @staticmethod
+    def compute_document_id(file_content: FileSource, file_type: str) -> str:
+        prefix = file_type.lower().encode() + b"\0"
+        return f"doc_{hash_file_source(file_content, prefix)[:24]}"
+
+    @staticmethod
+    def is_valid_id(document_id: str) -> bool:
+        return bool(document_id) and _DOCUMENT_ID_RE.match(document_id) is not None
+
+    def get(self, document_id: str) -> Optional[CachedDocument]:
+        """동기 조회 (디스크 로드 포함, 이벤트 루프에서는 get_async 사용)"""
+        if not self.is_valid_id(document_id):
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(document_id)
+            if entry is not None:
+                if now - entry.created_at > self.ttl_seconds:
+                    self._drop_locked(document_id)
+                    self.stats["expired"] += 1
+                    return None
+                self._memory.move_to_end(document_id)
+                return entry
+            entry = self._load_disk_locked(document_id, now)
+            if entry is not None:
+                self._insert_memory_locked(entry)
+            return entry
+
+    def put(self, entry: CachedDocument, source: Optional[FileSource] = None) -> None:
+        """항목 저장. 일부만 추출한 항목(complete=False)은 source(원본 파일)도 보관"""
+        entry.nbytes = len(entry.text.encode("utf-8"))
+        with self._lock:
+            self._drop_locked(entry.document_id, keep_source=not entry.complete)
+            self._insert_memory_locked(entry)
+        if not entry.complete and source is not None:
+            self._save_source(entry.document_id, source)
+
+    def delete(self, document_id: str) -> bool:
+        if not self.is_valid_id(document_id):
+            return False
+        with self._lock:
+            return self._drop_locked(document_id)
+
+    async def get_async(self, document_id: str) -> Optional[CachedDocument]:
+        return await asyncio.to_thread(self.get, document_id)
+
+    async def delete_async(self, document_id: str) -> bool:
+        return await asyncio.to_thread(self.delete, document_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            disk = self._disk or {}
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_items": len(disk),
+                "disk_bytes": self._disk_bytes,
+                "source_items": len(self._sources),
+                "source_bytes": self._source_bytes,
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+                **{k: (round(v, 1) if isinstance(v, float) else v) for k, v in self.stats.items()},
+            }
+
+    async def get_or_extract(
+        self, file_content: FileSource, file_type: str, token_budget: Optional[int] = None
+    ) -> Tuple[str, str, Dict[str, Any]]:
+        """캐시에서 찾거나 추출 후 저장. (텍스트, document_id, 통계) 반환"""
+        document_id = await asyncio.to_thread(self.compute_document_id, file_content, file_type)
+        cached = await self.get_async(document_id)
+        if cached is not None and self._covers(cached, token_budget):
+            text = self._serve(cached, token_budget)
+            return text, document_id, self._hit_stats(cached, text)
+
+        if cached is not None:
+            self.stats["partial_refreshes"] += 1
+        self.stats["misses"] += 1
+        text, file_stats, _ = await self._extract(file_content, file_type, document_id, token_budget)
+        return text, document_id, file_stats
+
+    async def get_text(
+        self, document_id: str, token_budget: Optional[int] = None
+    ) -> Optional[Tuple[CachedDocument, str, Dict[str, Any]]]:
+        """document_id로 캐시된 텍스트 조회. 없으면 None
+
+        일부만 추출된 항목이 요청 예산(None이면 전체)을 채우지 못하면 보관한 원본에서 다시 추출하고,
+        원본이 없으면 잘린 텍스트를 document_truncated=True로 반환합니다.
+        """
+        cached = await self.get_async(document_id)
+        if cached is None:
+            self.stats["misses"] += 1
+            return None
+        if not self._covers(cached, token_budget):
+            source = self._source_path(document_id)
+            if await asyncio.to_thread(source.exists):
+                self.stats["partial_refreshes"] += 1
+                self.stats["misses"] += 1
+                text, file_stats, entry = await self._extract(str(source), cached.file_type, document_id, token_budget)
+                if entry is not None:
+                    return entry, text, file_stats
+        text = self._serve(cached, token_budget)
+        return cached, text, self._hit_stats(cached, text)
+
+    # ===== 내부 구현 =====
+    async def _extract(
+        self, file_content: FileSource, file_type: str, document_id: str, token_budget: Optional[int]
+    ) -> Tuple[str, Dict[str, Any], Optional[CachedDocument]]:
+        text, file_stats = await process_uploaded_file_async(file_content, file_type, token_budget=token_budget)
+        complete = not file_stats.get("extract_budget_reached", False)
+        entry: Optional[CachedDocument] = None
+        if text:
+            entry = CachedDocument(
+                document_id=document_id,
+                file_type=file_type.lower(),
+                text=text,
+                complete=complete,
+                extract_ms=float(file_stats.get("file_extract_ms", 0.0)),
+                created_at=time.time(),
+                tokens_saved=int(file_stats.get("compaction_tokens_saved", 0)),
+                extract_budget=None if complete else token_budget,
+                scanned_pages=list(file_stats.get("pdf_scanned_page_numbers", [])),
+            )
+            await asyncio.to_thread(self.put, entry, file_content)
+        return text, {**file_stats, "document_cache_hit": False, "document_truncated": not complete}, entry
+
+    @staticmethod
+    def _covers(entry: CachedDocument, token_budget: Optional[int]) -> bool:
+        if entry.complete:
+            return True
+        return token_budget is not None and entry.extract_budget is not None and token_budget <= entry.extract_budget
+
+    @staticmethod
+    def _serve(entry: CachedDocument, token_budget: Optional[int]) -> str:
+        if token_budget is None:
+            return entry.text
+        return trim_to_tokens(entry.text, token_budget)
+
+    def _hit_stats(self, entry: CachedDocument, served_text: str) -> Dict[str, Any]:
+        self.stats["hits"] += 1
+        self.stats["extraction_ms_saved"] += entry.extract_ms
+        return {
+            "document_cache_hit": True,
+            # 추출이 중간에 멈췄거나 예산에 맞춰 잘라서 제공한 경우
+            "document_truncated": not entry.complete or len(served_text) < len(entry.text),
+            "file_extract_ms": 0.0,
+            "extraction_ms_saved": entry.extract_ms,
+            "compaction_tokens_saved": entry.tokens_saved,
+            "pdf_scanned_page_numbers": list(entry.scanned_pages),
+        }
+
+    def _path(self, document_id: str) -> Path:
+        return self.directory / f"{document_id}.json"
+
+    def _source_path(self, document_id: str) -> Path:
+        return self.directory / f"{document_id}.src"
+
+    def _save_source(self, document_id: str, source: FileSource) -> None:
+        """원본 보관 (복사는 잠금 밖에서, 크기 등록과 디스크 예산 적용은 잠금 안에서)"""
+        path = self._source_path(document_id)
+        try:
+            size = os.path.getsize(source) if isinstance(source, str) else len(source)
+            if size > self.disk_max_bytes:
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            if isinstance(source, str):
+                if os.path.abspath(source) != str(path.absolute()):
+                    shutil.copyfile(source, path)
+            else:
+                with open(path, "wb") as f:
+                    f.write(source)
+        except Exception as e:
+            logger.warning(f"⚠️ 문서 원본 보관 실패 ({document_id}): {e}")
+            return
+        with self._lock:
+            disk = self._disk_index_locked()
+            if document_id not in self._memory and document_id not in disk:
+                # 복사하는 사이 항목이 제거됨
+                self._unlink_source(document_id)
+                return
+            self._drop_source_locked(document_id, unlink=False)
+            self._sources[document_id] = size
+            self._source_bytes += size
+            self._enforce_disk_limit_locked()
+
+    def _unlink_source(self, document_id: str) -> None:
+        try:
+            self._source_path(document_id).unlink()
+        except OSError:
+            pass
+
+    def _drop_source_locked(self, document_id: str, unlink: bool = True) -> None:
+        size = self._sources.pop(document_id, None)
+        if size is not None:
+            self._source_bytes -= size
+        if unlink:
+            self._unlink_source(document_id)
+
+    def _enforce_disk_limit_locked(self) -> None:
+        """스필 JSON + 원본 합계가 disk_max_bytes를 넘으면 오래된 디스크 항목(원본 포함)부터 제거"""
+        disk = self._disk_index_locked()
+        while self._disk_bytes + self._source_bytes > self.disk_max_bytes:
+            if len(disk) > 1:
+                self._drop_disk_locked(next(iter(disk)))
+            elif self._sources:
+                # 남은 항목은 메모리에 두고 원본만 제거 (이후 요청에는 잘린 텍스트로 응답)
+                self._drop_source_locked(next(iter(self._sources)))
+                self.stats["sources_evicted"] += 1
+            else:
+                break
+
+    def _disk_index_locked(self) -> "OrderedDict[str, int]":
+        if self._disk is None:
+            self._disk = OrderedDict()
+            self._disk_bytes = 0
+            if self.directory.is_dir():
+                files = []
+                for path in self.directory.glob("doc_*.json"):
+                    try:
+                        st = path.stat()
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, path.stem, st.st_size))
+                for _, document_id, size in sorted(files):
+                    self._disk[document_id] = size
+                    self._disk_bytes += size
+                # 항목 없이 남은 원본 (이전 프로세스의 메모리 전용 항목)은 삭제, 나머지는 크기 등록
+                sources = []
+                for path in self.directory.glob("doc_*.src"):
+                    if path.stem not in self._disk and path.stem not in self._memory:
+                        self._unlink_source(path.stem)
+                        continue
+                    try:
+                        st = path.stat()
+                    except OSError:
+                        continue
+                    sources.append((st.st_mtime, path.stem, st.st_size))
+                for _, document_id, size in sorted(sources):
+                    if document_id not in self._sources:
+                        self._sources[document_id] = size
+                        self._source_bytes += size
+        return self._disk
+
+    def _load_disk_locked(self, document_id: str, now: float) -> Optional[CachedDocument]:
+        disk = self._disk_index_locked()
+        if document_id not in disk:
+            return None
+        try:
+            with open(self._path(document_id), "r", encoding="utf-8") as f:
+                entry = CachedDocument(**json.load(f))
+        except Exception as e:
+            logger.warning(f"⚠️ 문서 캐시 디스크 로드 실패 ({document_id}): {e}")
+            self._drop_disk_locked(document_id)
+            return None
+        if now - entry.created_at > self.ttl_seconds:
+            self._drop_disk_locked(document_id)
+            self.stats["expired"] += 1
+            return None
+        disk.move_to_end(document_id)
+        return entry
+
+    def _insert_memory_locked(self, entry: CachedDocument) -> None:
+        self._memory[entry.document_id] = entry
+        self._memory_bytes += entry.nbytes
+        while len(self._memory) > 1 and (
+            len(self._memory) > self.max_items or self._memory_bytes > self.max_bytes
+        ):
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+            if time.time() - evicted.created_at <= self.ttl_seconds:
+                self._spill_locked(evicted)
+            else:
+                self._drop_source_locked(evicted.document_id)
+
+    def _spill_locked(self, entry: CachedDocument) -> None:
+        disk = self._disk_index_locked()
+        if entry.document_id in disk or self.disk_max_bytes <= 0:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(entry.document_id)
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(asdict(entry), f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            size = path.stat().st_size
+        except Exception as e:
+            logger.warning(f"⚠️ 문서 캐시 디스크 스필 실패 ({entry.document_id}): {e}")
+            return
+        disk[entry.document_id] = size
+        self._disk_bytes += size
+        self.stats["spilled"] += 1
+        self._enforce_disk_limit_locked()
+
+    def _drop_locked(self, document_id: str, keep_source: bool = False) -> bool:
+        entry = self._memory.pop(document_id, None)
+        if entry is not None:
+            self._memory_bytes -= entry.nbytes
+        return self._drop_disk_locked(document_id, keep_source) or entry is not None
+
+    def _drop_disk_locked(self, document_id: str, keep_source: bool = False) -> bool:
+        if not keep_source:
+            self._drop_source_locked(document_id)
+        disk = self._disk_index_locked()
+        size = disk.pop(document_id, None)
+        if size is None:
+            return False
+        self._disk_bytes -= size
+        try:
+            self._path(document_id).unlink()
+        except OSError:
+            pass
+        return True
+
+
+# 전역 문서 캐시 인스턴스
+document_cache = DocumentCache()
@@ -13,6 +13,12 @@ from vllm.inputs import TextPrompt
 
 # 로깅 시스템 임포트
 from .logger_config import engine_logger as logger, RequestLogger
+from .metrics import server_metrics
+from .tracing import traced
+from .gpu_telemetry import gpu_telemetry
+from .usage_ledger import usage_ledger
+from .utils import estimate_tokens, estimate_image_tokens
+from .admission import admission_controller
 
 
 MULTIMODAL_AVAILABLE = True
@@ -29,6 +35,70 @@ except Exception:
 
 vllm_engine: Optional[AsyncLLMEngine] = None
 engine_config: Dict[str, Any] = {}
+# 진행 중인 generate_with_vllm 호출 수 (백그라운드 작업의 여유 용량 판단용)
+active_requests = 0
+# 자동 prefix caching 누적 통계
+prefix_cache_stats: Dict[str, int] = {"requests": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0}
+
+VISION_TAG = "<|vision_start|><|image_pad|><|vision_end|>"
+
+
+class _TokenTimer:
+    """스트리밍 출력마다 첫 출력 시각과 토큰 간 간격을 기록
+
+    한 번의 출력에 토큰이 여러 개 붙어 오면 경과 시간을 토큰 수로 나눠 각 간격으로 봅니다.
+    """
+
+    __slots__ = ("start", "first", "last", "tokens", "gaps")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.first: Optional[float] = None
+        self.last = start
+        self.tokens = 0
+        self.gaps: List[float] = []
+
+    def on_output(self, output: Any) -> None:
+        now = time.time()
+        tokens = len(output.outputs[0].token_ids) if output.outputs else 0
+        added = tokens - self.tokens
+        if added <= 0:
+            return
+        if self.first is None:
+            self.first = now
+            # 첫 출력에 함께 온 나머지 토큰은 간격 0으로 계산하지 않음
+        else:
+            gap = (now - self.last) / added
+            self.gaps.extend([gap] * added)
+        self.last = now
+        self.tokens = tokens
+
+    def timings(self) -> Dict[str, Any]:
+        if self.first is None:
+            return {}
+        result: Dict[str, Any] = {"ttft_ms": round((self.first - self.start) * 1000, 1)}
+        if self.gaps:
+            gaps = sorted(self.gaps)
+            result["inter_token_mean_ms"] = round(sum(gaps) / len(gaps) * 1000, 2)
+            result["inter_token_p50_ms"] = round(gaps[len(gaps) // 2] * 1000, 2)
+            result["inter_token_p95_ms"] = round(gaps[min(len(gaps) - 1, int(len(gaps) * 0.95))] * 1000, 2)
+            result["inter_token_max_ms"] = round(gaps[-1] * 1000, 2)
+        return result
+
+
+def _engine_queue_ms(output: Any) -> Optional[float]:
+    """엔진이 보고하는 스케줄러 대기 시간 (RequestOutput.metrics를 제공하는 vLLM 버전에서만)"""
+    metrics = getattr(output, "metrics", None)
+    if metrics is None:
+        return None
+    time_in_queue = getattr(metrics, "time_in_queue", None)
+    if time_in_queue is None:
+        arrival = getattr(metrics, "arrival_time", None)
+        scheduled = getattr(metrics, "first_scheduled_time", None)
+        if arrival is None or scheduled is None:
+            return None
+        time_in_queue = scheduled - arrival
+    return round(max(0.0, time_in_queue) * 1000, 1)
 
 
 async def initialize_vllm_engine() -> bool:
@@ -149,6 +219,8 @@ async def initialize_vllm_engine() -> bool:
         max_num_seqs = int(pick_env("MAX_NUM_SEQS", str(default_max_seqs)))
         block_size = int(pick_env("BLOCK_SIZE", str(default_block_size)))
         swap_space = int(pick_env("SWAP_SPACE", "4"))
+        # 시스템 프롬프트/대화 히스토리/문서처럼 반복되는 프롬프트 앞부분의 KV 캐시 재사용
+        enable_prefix_caching = pick_env("ENABLE_PREFIX_CACHING", "1").strip().lower() in ("1", "true", "yes", "y")
 
         # Tensor parallel size (support mode preset or generic)
         tensor_parallel_size = int(
@@ -161,6 +233,7 @@ async def initialize_vllm_engine() -> bool:
         logger.info(f"📊 최대 시퀀스 수: {max_num_seqs}")
         logger.info(f"🧱 블록 크기: {block_size}")
         logger.info(f"💽 스왑 공간: {swap_space}GB")
+        logger.info(f"♻️ Prefix caching: {'활성화' if enable_prefix_caching else '비활성화'}")
 
         # trust_remote_code 설정 (.env 제어 가능; 기본 True)
         trc_val = os.getenv("VLLM_TRUST_REMOTE_CODE", "1").strip().lower()
@@ -181,6 +254,7 @@ async def initialize_vllm_engine() -> bool:
             "max_num_seqs": max_num_seqs,
             "block_size": block_size,
             "swap_space": swap_space,
+            "enable_prefix_caching": enable_prefix_caching,
             "gpu_memory_utilization": chosen_gpu_util,
             "trust_remote_code": trust_remote_code,
             "enforce_eager": False,
@@ -283,6 +357,9 @@ async def initialize_vllm_engine() -> bool:
             "load_mode": load_mode,
             "quantization": quantization or "none",
             "kv_cache_dtype": kv_cache_dtype or None,
+            "block_size": block_size,
+            "enable_prefix_caching": bool(getattr(engine_args, "enable_prefix_caching", False)),
+            "num_gpu_blocks": _kv_cache_blocks(vllm_engine),
         })
 
         # GPU 상태 로깅
@@ -299,6 +376,18 @@ async def initialize_vllm_engine() -> bool:
         return False
 
 
+def _kv_cache_blocks(llm_engine: Any) -> Optional[int]:
+    """gpu_memory_utilization 기준으로 엔진이 할당한 KV 캐시 블록 수 (버전에 따라 위치가 다름)"""
+    for path in (("engine", "cache_config"), ("vllm_config", "cache_config"), ("cache_config",)):
+        target = llm_engine
+        for attr in path:
+            target = getattr(target, attr, None)
+        blocks = getattr(target, "num_gpu_blocks", None)
+        if isinstance(blocks, int) and blocks > 0:
+            return blocks
+    return None
+
+
 async def get_vllm_stats() -> Dict[str, Any]:
     global vllm_engine
     if vllm_engine is None:
@@ -306,23 +395,22 @@ async def get_vllm_stats() -> Dict[str, Any]:
     return {
         "engine_status": "running",
         "pending_requests": 0,
-        "running_requests": 0,
+        "running_requests": active_requests,
+        "prefix_cache": {
+            **prefix_cache_stats,
+            "hit_rate": round(prefix_cache_stats["cached_prompt_tokens"] / prefix_cache_stats["prompt_tokens"], 3)
+            if prefix_cache_stats["prompt_tokens"] else 0.0,
+        },
     }
 
 
+@traced("gpu.status")
 def get_gpu_status() -> Dict[str, float]:
-    try:
-        if torch.cuda.is_available():
-            memory_used = torch.cuda.memory_allocated() / 1024 ** 3
-            memory_total = torch.cuda.get_device_properties(0).total_memory / 1024 ** 3
-            return {"memory_used": round(memory_used, 2), "memory_total": round(memory_total, 2)}
-        else:
-            return {"memory_used": 0.0, "memory_total": 0.0}
-    except Exception as e:
-        print(f"GPU 상태 확인 오류: {e}")
-        return {"memory_used": 0.0, "memory_total": 0.0}
+    """백그라운드 샘플러의 캐시된 GPU 메모리 (전체 장치 합계, GB)"""
+    return gpu_telemetry.status()
 
 
+@traced("engine.generate")
 async def generate_with_vllm(
     prompt: str,
     max_tokens: int = 512,
@@ -330,6 +418,35 @@ async def generate_with_vllm(
     images: Optional[List[Image.Image]] = None,
     lora_adapter: Optional[str] = None,
     request_id: Optional[str] = None,  # 🆕 요청 ID 파라미터 추가
+) -> Tuple[str, Dict[str, Any]]:
+    global active_requests
+    # 호출자별 토큰/초 제한과 공정 큐를 통과한 뒤 엔진에 제출
+    estimated_tokens = (
+        estimate_tokens(prompt)
+        + sum(estimate_image_tokens(img) for img in images or [])
+        + min(max_tokens, int(os.getenv("MAX_TOKENS_CAP", "512")))
+    )
+    async with admission_controller.admit(estimated_tokens) as ticket:
+        active_requests += 1
+        timings: Dict[str, Any] = {}
+        try:
+            text, timings = await _generate_with_vllm(prompt, max_tokens, temperature, images, lora_adapter, request_id)
+        finally:
+            active_requests -= 1
+            # 실패한 생성은 사용량 0으로 정산 (선차감한 추정 토큰을 모두 환급)
+            admission_controller.settle(ticket, timings.get("prompt_tokens", 0) + timings.get("tokens_generated", 0))
+    timings["admission_wait_ms"] = ticket.wait_ms
+    timings["admission_kv_blocks"] = ticket.cost
+    return text, timings
+
+
+async def _generate_with_vllm(
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    images: Optional[List[Image.Image]],
+    lora_adapter: Optional[str],
+    request_id: Optional[str],
 ) -> Tuple[str, Dict[str, Any]]:
     global vllm_engine
     if vllm_engine is None:
@@ -346,26 +463,27 @@ async def generate_with_vllm(
     timings: Dict[str, Any] = {}
     original_prompt = prompt
 
-    # 엔진 레벨 로깅
-    logger.info(f"🚀 [{request_id}] vLLM 엔진 생성 요청 시작")
-    logger.debug(f"📝 [{request_id}] 프롬프트 원본 길이: {len(prompt)}자")
-    logger.debug(f"🖼️ [{request_id}] 이미지 개수: {len(images) if images else 0}")
-    logger.debug(f"⚙️ [{request_id}] 최대 토큰: {max_tokens}, 온도: {temperature}")
+    # 엔진 레벨 로깅 (json 형식에서는 요청 레코드 필드로만 남김)
+    req_logger.info("🚀 [%s] vLLM 엔진 생성 요청 시작", request_id)
+    req_logger.debug("📝 [%s] 프롬프트 원본 길이: %d자", request_id, len(prompt))
+    req_logger.debug("🖼️ [%s] 이미지 개수: %d", request_id, len(images) if images else 0)
+    req_logger.debug("⚙️ [%s] 최대 토큰: %s, 온도: %s", request_id, max_tokens, temperature)
 
     # LoRA 어댑터 정보
     if lora_adapter:
-        logger.info(f"🎯 [{request_id}] 요청된 LoRA 어댑터: {lora_adapter}")
+        req_logger.info("🎯 [%s] 요청된 LoRA 어댑터: %s", request_id, lora_adapter)
     else:
         default_adapter = os.getenv("DEFAULT_LORA_ADAPTER", "")
         if default_adapter:
             lora_adapter = default_adapter
-            logger.info(f"🌟 [{request_id}] 기본 LoRA 어댑터 사용: {lora_adapter}")
+            req_logger.info("🌟 [%s] 기본 LoRA 어댑터 사용: %s", request_id, lora_adapter)
         else:
-            logger.info(f"🎯 [{request_id}] LoRA 어댑터: 사용 안함 (베이스 모델)")
+            req_logger.info("🎯 [%s] LoRA 어댑터: 사용 안함 (베이스 모델)", request_id)
 
     eff_tokens = max(1, int(min(max_tokens, int(os.getenv("MAX_TOKENS_CAP", "512")))))
     if eff_tokens != max_tokens:
-        logger.info(f"⚙️ [{request_id}] 토큰 수 조정: {max_tokens} -> {eff_tokens}")
+        req_logger.info("⚙️ [%s] 토큰 수 조정: %s -> %s", request_id, max_tokens, eff_tokens)
+    req_logger.set(engine_lora_adapter=lora_adapter, effective_max_tokens=eff_tokens, image_count=len(images) if images else 0)
 
     sampling_params = SamplingParams(
         max_tokens=eff_tokens,
@@ -379,7 +497,7 @@ async def generate_with_vllm(
     if lora_adapter:
         try:
             sampling_params.lora_request = lora_adapter
-            logger.info(f"✅ [{request_id}] LoRA 어댑터 설정 완료: {lora_adapter}")
+            req_logger.info("✅ [%s] LoRA 어댑터 설정 완료: %s", request_id, lora_adapter)
         except AttributeError:
             logger.warning(f"⚠️ [{request_id}] 현재 vLLM 버전에서 요청별 LoRA 지정 미지원")
         except Exception as e:
@@ -388,14 +506,22 @@ async def generate_with_vllm(
     use_multimodal = False
     if images and MULTIMODAL_AVAILABLE:
         try:
-            logger.info(f"🖼️ [{request_id}] 멀티모달 프롬프트 준비 중...")
+            req_logger.info("🖼️ [%s] 멀티모달 프롬프트 준비 중...", request_id)
             if "<|image_pad|>" not in prompt and "<|vision_start|>" not in prompt:
-                prompt = f"<|vision_start|><|image_pad|><|vision_end|>\n{prompt}"
-                logger.debug(f"📄 [{request_id}] 비전 태그 추가됨")
+                # 프롬프트 맨 앞이 아니라 마지막 user 턴 시작에 넣어 system/히스토리 prefix를 유지
+                # 이미지마다 비전 태그 하나 (태그 수와 이미지 수가 다르면 vLLM이 거부)
+                vision_tags = VISION_TAG * len(images)
+                user_start = prompt.rfind("<|im_start|>user\n")
+                if user_start >= 0:
+                    insert_at = user_start + len("<|im_start|>user\n")
+                    prompt = f"{prompt[:insert_at]}{vision_tags}\n{prompt[insert_at:]}"
+                else:
+                    prompt = f"{vision_tags}\n{prompt}"
+                req_logger.debug("📄 [%s] 비전 태그 추가됨", request_id)
 
-            logger.info(f"🖼️ [{request_id}] 이미지 수: {len(images)}장")
+            req_logger.info("🖼️ [%s] 이미지 수: %d장", request_id, len(images))
 
-            if logger.level <= 10:
+            if logger.level <= 10 and not req_logger.structured:
                 for idx, img in enumerate(images):
                     img_size = img.size
                     img_mode = img.mode
@@ -410,18 +536,21 @@ async def generate_with_vllm(
             multi_modal_payload = {"image": images[0] if len(images) == 1 else images}
             prompt = TextPrompt({"prompt": prompt, "multi_modal_data": multi_modal_payload})
             use_multimodal = True
-            logger.info(f"✅ [{request_id}] 멀티모달 프롬프트 준비 완료")
+            req_logger.info("✅ [%s] 멀티모달 프롬프트 준비 완료", request_id)
         except Exception as e:
             logger.warning(f"⚠️ [{request_id}] 멀티모달 준비 실패, 텍스트 모드로 전환: {e}")
             prompt = original_prompt
             use_multimodal = False
 
-    # GPU 상태 로깅
-    gpu_status = get_gpu_status()
-    logger.info(f"🖥️ [{request_id}] 생성 전 GPU 메모리: {gpu_status['memory_used']:.2f}GB / {gpu_status['memory_total']:.2f}GB ({gpu_status['memory_used']/gpu_status['memory_total']*100:.1f}%)")
+    req_logger.set(multimodal=use_multimodal)
+
+    # GPU 상태 로깅 (json 형식에서는 엔드포인트가 기록한 값으로 충분)
+    if not req_logger.structured:
+        gpu_status = get_gpu_status()
+        req_logger.log_gpu_status(gpu_status['memory_used'], gpu_status['memory_total'], stage="생성 전")
 
     # 프롬프트 상세 로깅 (DEBUG 모드)
-    if logger.level <= 10:  # DEBUG
+    if logger.level <= 10 and not req_logger.structured:  # DEBUG
         if isinstance(prompt, str):
             prompt_preview = prompt[:500] if len(prompt) > 500 else prompt
             logger.debug(f"💬 [{request_id}] 프롬프트 미리보기:\n{'-'*80}\n{prompt_preview}\n{'-'*80}")
@@ -429,25 +558,29 @@ async def generate_with_vllm(
             logger.debug(f"💬 [{request_id}] 프롬프트 타입: {type(prompt).__name__}")
 
     t_gen_start = time.time()
-    logger.info(f"🚀 [{request_id}] vLLM 생성 시작...")
+    req_logger.info("🚀 [%s] vLLM 생성 시작...", request_id)
 
     try:
         results_generator = vllm_engine.generate(prompt, sampling_params, request_id)
     except Exception as e:
         logger.error(f"❌ [{request_id}] 생성 시작 실패: {e}")
         if use_multimodal:
-            logger.info(f"🔄 [{request_id}] 텍스트 모드로 재시도...")
+            logger.info("🔄 [%s] 텍스트 모드로 재시도...", request_id)
+            req_logger.set(multimodal_fallback=True)
+            server_metrics.count_multimodal_fallback(lora_adapter)
             prompt = original_prompt
             results_generator = vllm_engine.generate(prompt, sampling_params, request_id)
         else:
             raise
 
     final_output = None
+    token_timer = _TokenTimer(t_gen_start)
     try:
-        logger.info(f"⏳ [{request_id}] 응답 스트리밍 중...")
+        req_logger.info("⏳ [%s] 응답 스트리밍 중...", request_id)
         async for request_output in results_generator:
+            token_timer.on_output(request_output)
             final_output = request_output
-        logger.info(f"✅ [{request_id}] 응답 스트리밍 완료")
+        req_logger.info("✅ [%s] 응답 스트리밍 완료", request_id)
     except Exception as e:
         logger.error(f"❌ [{request_id}] 스트리밍 실패: {e}")
         if logger.level <= 10:  # DEBUG
@@ -455,10 +588,14 @@ async def generate_with_vllm(
             logger.debug(f"🔍 [{request_id}] 스택 트레이스:\n{traceback.format_exc()}")
         
         if use_multimodal:
-            logger.info(f"🔄 [{request_id}] 텍스트 모드로 재시도...")
+            logger.info("🔄 [%s] 텍스트 모드로 재시도...", request_id)
+            req_logger.set(multimodal_fallback=True)
+            server_metrics.count_multimodal_fallback(lora_adapter)
             prompt = original_prompt
             results_generator = vllm_engine.generate(prompt, sampling_params, request_id)
+            token_timer = _TokenTimer(time.time())
             async for request_output in results_generator:
+                token_timer.on_output(request_output)
                 final_output = request_output
         else:
             raise
@@ -472,34 +609,56 @@ async def generate_with_vllm(
     response_text = "".join(o.text for o in final_output.outputs)
     timings["total_ms"] = round((time.time() - start_time) * 1000, 1)
     timings["tokens_generated"] = len(final_output.outputs[0].token_ids) if final_output.outputs else 0
+    prompt_tokens = len(final_output.prompt_token_ids or [])
+    # num_cached_tokens는 prefix caching을 지원하는 vLLM 버전에서만 제공
+    cached_tokens = getattr(final_output, "num_cached_tokens", None)
+    timings["prompt_tokens"] = prompt_tokens
+    if cached_tokens is not None:
+        timings["cached_prompt_tokens"] = int(cached_tokens)
+        timings["prefix_cache_hit_rate"] = round(cached_tokens / prompt_tokens, 3) if prompt_tokens else 0.0
+        prefix_cache_stats["requests"] += 1
+        prefix_cache_stats["prompt_tokens"] += prompt_tokens
+        prefix_cache_stats["cached_prompt_tokens"] += int(cached_tokens)
 
     # 타입 안전한 토큰/초 계산
     generation_time_seconds = float(timings["generation_ms"]) / 1000.0 if timings.get("generation_ms", 0) > 0 else 0
     timings["tokens_per_second"] = round(
         float(timings["tokens_generated"]) / generation_time_seconds, 1
     ) if generation_time_seconds > 0 else 0
+    # SLO 지표: 대기(엔진 보고 시) / 첫 토큰까지 / 토큰 간 간격 분포
+    timings["image_count"] = len(images) if use_multimodal and images else 0
+    timings["image_tokens_estimated"] = sum(estimate_image_tokens(img) for img in images) if timings["image_count"] else 0
+    queue_ms = _engine_queue_ms(final_output)
+    if queue_ms is not None:
+        timings["queue_ms"] = queue_ms
+    timings.update(token_timer.timings())
+    server_metrics.observe_generation(lora_adapter, timings)
+    usage_ledger.record(lora_adapter, timings)
+
+    if req_logger.structured:
+        # 엔드포인트 레코드에 합치거나, 엔진만 쓰는 요청(요약 등)이면 여기서 레코드 기록
+        req_logger.log_timings(timings)
+        if req_logger.owns_record:
+            req_logger.log_response(response_text)
+            req_logger.log_request_end(success=True)
+        return response_text.strip(), timings
 
     # 생성 완료 로깅
-    logger.info(f"✅ [{request_id}] 텍스트 생성 완료")
-    logger.info(f"⏱️ [{request_id}] 생성 시간: {timings['generation_ms']}ms")
-    logger.info(f"📊 [{request_id}] 생성 토큰: {timings['tokens_generated']}개")
-    logger.info(f"🚀 [{request_id}] 속도: {timings['tokens_per_second']} tokens/sec")
-    logger.info(f"📤 [{request_id}] 응답 길이: {len(response_text)}자")
-    
-    # 응답 상세 로깅 (DEBUG 모드)
-    if logger.level <= 10:  # DEBUG
-        response_preview = response_text[:500] if len(response_text) > 500 else response_text
-        logger.debug(f"💡 [{request_id}] 응답 미리보기:\n{'-'*80}\n{response_preview}\n{'-'*80}")
-    else:
-        # INFO 모드에서는 짧은 미리보기
-        response_preview = response_text[:100] if len(response_text) > 100 else response_text
-        if len(response_text) > 100:
-            response_preview += "..."
-        logger.info(f"💡 [{request_id}] 응답 미리보기: {response_preview}")
+    logger.info("✅ [%s] 텍스트 생성 완료", request_id)
+    logger.info("⏱️ [%s] 생성 시간: %sms", request_id, timings['generation_ms'])
+    logger.info("📊 [%s] 생성 토큰: %s개", request_id, timings['tokens_generated'])
+    logger.info("🚀 [%s] 속도: %s tokens/sec", request_id, timings['tokens_per_second'])
+    if "ttft_ms" in timings:
+        logger.info(
+            "⏱️ [%s] TTFT: %sms, 토큰 간격 p50/p95/max: %s/%s/%sms, 대기: %sms",
+            request_id, timings["ttft_ms"], timings.get("inter_token_p50_ms"), timings.get("inter_token_p95_ms"),
+            timings.get("inter_token_max_ms"), timings.get("queue_ms", "-"),
+        )
+    req_logger.log_response(response_text)
 
     # 최종 GPU 상태 로깅
     final_gpu_status = get_gpu_status()
-    logger.info(f"🖥️ [{request_id}] 생성 후 GPU 메모리: {final_gpu_status['memory_used']:.2f}GB / {final_gpu_status['memory_total']:.2f}GB ({final_gpu_status['memory_used']/final_gpu_status['memory_total']*100:.1f}%)")
+    req_logger.log_gpu_status(final_gpu_status['memory_used'], final_gpu_status['memory_total'], stage="생성 후")
 
     return response_text.strip(), timings
 
@@ -1,42 +1,542 @@
 import io
-from typing import Any
+import os
+import re
+import mmap
+import time
+import asyncio
+import hashlib
+import tempfile
+import multiprocessing
+from collections import Counter, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, BinaryIO, Deque, Dict, Iterator, List, Optional, Tuple, Union
 import PyPDF2
 import docx
+from PIL import Image
 
+from .utils import estimate_tokens, process_image_bytes, MAX_IMAGE_SIDE
+from .tracing import traced
 
-def extract_text_from_pdf(file_content: bytes) -> str:
+# 스캔 PDF 페이지 렌더링 (선택 의존성: PyMuPDF)
+try:
+    import fitz  # noqa: F401
+    PDF_RENDER_AVAILABLE = True
+except Exception:
+    fitz = None
+    PDF_RENDER_AVAILABLE = False
+
+
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = max(1, int(os.getenv("PDF_PAGES_PER_TASK", "8")))
+# fork는 CUDA/vLLM 스레드가 있는 프로세스에서 안전하지 않으므로 기본 spawn
+PDF_EXTRACT_MP_CONTEXT = os.getenv("PDF_EXTRACT_MP_CONTEXT", "spawn")
+DOCUMENT_COMPACTION = os.getenv("DOCUMENT_COMPACTION", "0").strip().lower() in ("1", "true", "yes", "y")
+DOCUMENT_DEDUPE_PARAGRAPHS = os.getenv("DOCUMENT_DEDUPE_PARAGRAPHS", "0").strip().lower() in ("1", "true", "yes", "y")
+# 추출 텍스트가 이보다 짧은 페이지는 스캔 페이지로 간주
+PDF_SCANNED_PAGE_MIN_CHARS = int(os.getenv("PDF_SCANNED_PAGE_MIN_CHARS", "20"))
+
+# 업로드 스풀: 이 크기까지는 메모리, 넘으면 디스크 임시 파일
+UPLOAD_SPOOL_MAX_MEMORY = int(os.getenv("UPLOAD_SPOOL_MAX_MEMORY", str(1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+UPLOAD_READ_CHUNK_BYTES = int(os.getenv("UPLOAD_READ_CHUNK_BYTES", str(1024 * 1024)))
+
+# 파서 입력: 메모리 바이트 또는 디스크 파일 경로 (경로는 워커 프로세스에 복사 없이 전달)
+FileSource = Union[bytes, str]
+
+# 추출 텍스트의 PDF 페이지 경계 (청크 분할 등에 사용, 프롬프트에는 to_prompt_text로 변환)
+PAGE_BREAK = "\f"
+
+_extract_pool: Optional[ProcessPoolExecutor] = None
+
+
+# ===== 업로드 스풀 / 메모리 매핑 =====
+class UploadTooLargeError(ValueError):
+    """업로드 크기 제한 초과"""
+
+
+class SpooledUpload:
+    """업로드 파서 입력: 작은 파일은 메모리 바이트, 큰 파일은 이름 있는 임시 파일 경로"""
+
+    def __init__(self, max_memory: int = UPLOAD_SPOOL_MAX_MEMORY):
+        self.max_memory = max_memory
+        self.size = 0
+        self.path: Optional[str] = None
+        self._data = b""
+
+    def load(self, fileobj: BinaryIO, size: int, max_bytes: int) -> None:
+        """이미 수신된 업로드 파일을 처음부터 읽어 옴 (블로킹 I/O, 스레드에서 호출)
+
+        프로세스 풀 워커에는 경로로 넘겨야 하므로, 이름 없는 스풀 파일은
+        max_memory를 넘을 때만 임시 파일로 한 번 복사합니다.
+        """
+        fileobj.seek(0)
+        if size <= self.max_memory:
+            self._data = fileobj.read(max_bytes + 1)
+            self.size = len(self._data)
+            if self.size > max_bytes:
+                raise UploadTooLargeError(f"파일 크기가 제한({max_bytes} bytes)를 초과했습니다")
+            return
+        with tempfile.NamedTemporaryFile(prefix="vllm_upload_", dir=UPLOAD_SPOOL_DIR, delete=False) as out:
+            self.path = out.name
+            while True:
+                chunk = fileobj.read(UPLOAD_READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                self.size += len(chunk)
+                if self.size > max_bytes:
+                    raise UploadTooLargeError(f"파일 크기가 제한({max_bytes} bytes)를 초과했습니다")
+                out.write(chunk)
+
+    @property
+    def source(self) -> FileSource:
+        return self.path if self.path is not None else self._data
+
+    def close(self) -> None:
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+        self._data = b""
+
+
+def _upload_file_size(fileobj: BinaryIO) -> int:
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
+async def spool_upload(upload: Any, max_bytes: int) -> SpooledUpload:
+    """Starlette가 이미 받아 둔 UploadFile.file의 크기를 먼저 검사한 뒤 파서 입력으로 준비
+
+    본문 수신은 핸들러 실행 전에 끝나므로 이 검사는 수신 후에 적용됩니다.
+    (수신 중 차단은 Content-Length 검사 미들웨어/프록시 본문 제한 담당)
+    파일 I/O는 모두 스레드에서 수행합니다.
+    """
+    size = getattr(upload, "size", None)
+    if size is None:
+        size = await asyncio.to_thread(_upload_file_size, upload.file)
+    if size > max_bytes:
+        raise UploadTooLargeError(f"파일 크기가 제한({max_bytes} bytes)를 초과했습니다")
+    spooled = SpooledUpload()
     try:
-        pdf_file = io.BytesIO(file_content)
-        reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
+        await asyncio.to_thread(spooled.load, upload.file, size, max_bytes)
+    except BaseException:
+        spooled.close()
+        raise
+    return spooled
+
+
+@contextmanager
+def open_file_source(source: FileSource) -> Iterator[Any]:
+    """파서용 읽기 스트림. 경로는 복사 없이 읽기 전용 mmap으로 엽니다."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield io.BytesIO(source)
+        return
+    with open(source, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield io.BytesIO(b"")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            yield view
+
+
+def hash_file_source(source: FileSource, prefix: bytes = b"") -> str:
+    digest = hashlib.sha256(prefix)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    else:
+        with open_file_source(source) as view:
+            digest.update(view.getbuffer() if isinstance(view, io.BytesIO) else view)
+    return digest.hexdigest()
+
+
+def extract_text_from_pdf(file_content: FileSource) -> str:
+    try:
+        with open_file_source(file_content) as pdf_file:
+            reader = PyPDF2.PdfReader(pdf_file)
+            pages = [(page.extract_text() or "") for page in reader.pages]
+        return PAGE_BREAK.join(pages).strip()
     except Exception as e:
         print(f"PDF 텍스트 추출 오류: {e}")
         return ""
 
 
-def extract_text_from_docx(file_content: bytes) -> str:
+def extract_text_from_docx(file_content: FileSource) -> str:
     try:
-        doc_file = io.BytesIO(file_content)
-        d = docx.Document(doc_file)
-        text = ""
-        for paragraph in d.paragraphs:
-            text += paragraph.text + "\n"
-        return text.strip()
+        with open_file_source(file_content) as doc_file:
+            d = docx.Document(doc_file)
+        return "\n".join(paragraph.text for paragraph in d.paragraphs).strip()
     except Exception as e:
         print(f"DOCX 텍스트 추출 오류: {e}")
         return ""
 
 
-def process_uploaded_file(file_content: bytes, file_type: str) -> str:
+def process_uploaded_file(file_content: FileSource, file_type: str) -> str:
     file_type = file_type.lower()
     if file_type == "pdf":
         return extract_text_from_pdf(file_content)
     elif file_type in ["docx", "doc"]:
         return extract_text_from_docx(file_content)
     elif file_type == "txt":
-        return file_content.decode('utf-8', errors='ignore')
+        with open_file_source(file_content) as view:
+            return str(view.read(), 'utf-8', errors='ignore')
     else:
         return f"지원하지 않는 파일 형식: {file_type}"
+
+
+def to_prompt_text(text: str) -> str:
+    """페이지 경계 표시를 프롬프트용 줄바꿈으로 변환"""
+    return text.replace(PAGE_BREAK, "\n\n")
+
+
+# ===== 병렬 PDF 추출 (프로세스 풀, 페이지 순서 스트리밍, 토큰 예산 조기 종료) =====
+def _count_pdf_pages(file_content: FileSource) -> int:
+    with open_file_source(file_content) as stream:
+        return len(PyPDF2.PdfReader(stream).pages)
+
+
+def _extract_pdf_page_range(file_content: FileSource, start: int, end: int) -> List[str]:
+    """워커 프로세스에서 실행: [start, end) 페이지 텍스트 목록"""
+    pages: List[str] = []
+    with open_file_source(file_content) as stream:
+        reader = PyPDF2.PdfReader(stream)
+        for idx in range(start, min(end, len(reader.pages))):
+            try:
+                pages.append(reader.pages[idx].extract_text() or "")
+            except Exception as e:
+                pages.append("")
+                print(f"PDF 페이지 {idx + 1} 텍스트 추출 오류: {e}")
+    return pages
+
+
+def _write_temp_source(data: bytes) -> str:
+    """여러 워커에 나눠 줄 바이트 입력을 임시 파일 하나로 기록 (작업마다 바이트를 피클하지 않음)"""
+    with tempfile.NamedTemporaryFile(prefix="vllm_pdf_", suffix=".pdf", dir=UPLOAD_SPOOL_DIR, delete=False) as f:
+        f.write(data)
+        return f.name
+
+
+def _get_extract_pool() -> Optional[ProcessPoolExecutor]:
+    global _extract_pool
+    if PDF_EXTRACT_WORKERS <= 0:
+        return None
+    if _extract_pool is None:
+        _extract_pool = ProcessPoolExecutor(
+            max_workers=PDF_EXTRACT_WORKERS,
+            mp_context=multiprocessing.get_context(PDF_EXTRACT_MP_CONTEXT),
+        )
+    return _extract_pool
+
+
+def shutdown_extract_pool() -> None:
+    global _extract_pool
+    if _extract_pool is not None:
+        _extract_pool.shutdown(wait=False, cancel_futures=True)
+        _extract_pool = None
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """토큰 추정치가 max_tokens 이하가 되도록 비율로 잘라냄"""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    return text[: max(0, int(len(text) * max_tokens / tokens))]
+
+
+async def extract_text_from_pdf_async(
+    file_content: FileSource, token_budget: Optional[int] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """페이지 범위 단위로 프로세스 풀에서 병렬 추출하고, 페이지 순서대로 이어 붙이며
+    토큰 예산에 도달하면 남은 페이지 추출을 취소합니다."""
+    t_start = time.time()
+    stats: Dict[str, Any] = {"pdf_pages_total": 0, "pdf_pages_processed": 0, "pdf_pages_skipped": 0}
+    scanned_pages: List[int] = []
+    try:
+        total_pages = await asyncio.to_thread(_count_pdf_pages, file_content)
+    except Exception as e:
+        print(f"PDF 텍스트 추출 오류: {e}")
+        stats["file_extract_ms"] = round((time.time() - t_start) * 1000, 1)
+        return "", stats
+    stats["pdf_pages_total"] = total_pages
+
+    ranges = [(s, min(s + PDF_PAGES_PER_TASK, total_pages)) for s in range(0, total_pages, PDF_PAGES_PER_TASK)]
+    pool = _get_extract_pool()
+    loop = asyncio.get_running_loop()
+    # 프로세스 풀에는 경로만 전달: 바이트 입력은 임시 파일 하나로 쓰고 finally에서 삭제
+    source = file_content
+    temp_path: Optional[str] = None
+    if pool is not None and not isinstance(file_content, str):
+        temp_path = await asyncio.to_thread(_write_temp_source, bytes(file_content))
+        source = temp_path
+    # 앞쪽 범위부터 제출하되 동시에 떠 있는 작업 수는 워커 수의 2배로 제한
+    window = max(1, PDF_EXTRACT_WORKERS * 2)
+    pending: Deque[Tuple[Tuple[int, int], "asyncio.Future[List[str]]"]] = deque()
+    next_range = 0
+
+    def submit(page_range: Tuple[int, int]) -> "asyncio.Future[List[str]]":
+        if pool is None:
+            return asyncio.ensure_future(asyncio.to_thread(_extract_pdf_page_range, source, *page_range))
+        return loop.run_in_executor(pool, _extract_pdf_page_range, source, *page_range)
+
+    parts: List[str] = []
+    used_tokens = 0
+    budget_reached = False
+    try:
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < window:
+                pending.append((ranges[next_range], submit(ranges[next_range])))
+                next_range += 1
+            page_range, future = pending.popleft()
+            try:
+                pages = await future
+            except BrokenProcessPool:
+                # 워커 비정상 종료 시 풀을 재생성하고 해당 범위는 스레드에서 처리
+                shutdown_extract_pool()
+                pages = await asyncio.to_thread(_extract_pdf_page_range, source, *page_range)
+            for page_text in pages:
+                stats["pdf_pages_processed"] += 1
+                if len(page_text.strip()) < PDF_SCANNED_PAGE_MIN_CHARS:
+                    scanned_pages.append(stats["pdf_pages_processed"])
+                if token_budget is not None:
+                    page_tokens = estimate_tokens(page_text)
+                    if used_tokens + page_tokens > token_budget:
+                        parts.append(trim_to_tokens(page_text, token_budget - used_tokens))
+                        budget_reached = True
+                        break
+                    used_tokens += page_tokens
+                parts.append(page_text)
+                # 예산이 정확히 찼어도 남은 페이지가 없으면 전체 추출
+                if token_budget is not None and used_tokens >= token_budget and stats["pdf_pages_processed"] < total_pages:
+                    budget_reached = True
+                    break
+            if budget_reached:
+                break
+    finally:
+        for _, future in pending:
+            future.cancel()
+        if temp_path is not None:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+
+    stats["pdf_pages_skipped"] = total_pages - stats["pdf_pages_processed"]
+    stats["extract_budget_reached"] = budget_reached
+    # 텍스트가 거의 없는 페이지 번호 (1부터), 비전 경로 렌더링 후보
+    stats["pdf_scanned_page_numbers"] = scanned_pages
+    stats["pdf_scanned_pages"] = len(scanned_pages)
+    stats["file_extract_ms"] = round((time.time() - t_start) * 1000, 1)
+    return PAGE_BREAK.join(parts).strip(), stats
+
+
+def _render_pdf_page(file_content: FileSource, page_number: int, max_side: int) -> bytes:
+    """워커 프로세스에서 실행: 한 페이지를 긴 변 max_side 이하로 렌더링한 PNG 바이트"""
+    if isinstance(file_content, str):
+        doc = fitz.open(file_content, filetype="pdf")
+    else:
+        doc = fitz.open(stream=file_content, filetype="pdf")
+    with doc:
+        page = doc.load_page(page_number - 1)
+        rect = page.rect
+        zoom = min(4.0, max_side / max(rect.width, rect.height, 1.0))
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        return pixmap.tobytes("png")
+
+
+async def render_pdf_pages_async(
+    file_content: FileSource, page_numbers: List[int], max_side: int = MAX_IMAGE_SIDE
+) -> Tuple[List[Image.Image], List[int], Dict[str, Any]]:
+    """선택한 페이지(1부터)만 워커 풀에서 한 장씩 렌더링.
+    동시에 떠 있는 페이지는 워커 수로 제한해 메모리를 일정하게 유지합니다.
+    (이미지, 실제로 렌더링된 페이지 번호, 통계)를 반환하며 실패한 페이지는 둘 다에서 빠집니다."""
+    if not PDF_RENDER_AVAILABLE:
+        raise RuntimeError("PDF 페이지 렌더링을 사용하려면 PyMuPDF(pymupdf)가 필요합니다")
+    t_start = time.time()
+    pool = _get_extract_pool()
+    loop = asyncio.get_running_loop()
+    window = max(1, PDF_EXTRACT_WORKERS)
+    pending: Deque[Tuple[int, "asyncio.Future[bytes]"]] = deque()
+    queue = list(dict.fromkeys(page_numbers))
+
+    def submit(page_number: int) -> "asyncio.Future[bytes]":
+        if pool is None:
+            return asyncio.ensure_future(asyncio.to_thread(_render_pdf_page, file_content, page_number, max_side))
+        return loop.run_in_executor(pool, _render_pdf_page, file_content, page_number, max_side)
+
+    images: List[Image.Image] = []
+    rendered: List[int] = []
+    failed: List[int] = []
+    try:
+        while queue or pending:
+            while queue and len(pending) < window:
+                page_number = queue.pop(0)
+                pending.append((page_number, submit(page_number)))
+            page_number, future = pending.popleft()
+            try:
+                images.append(process_image_bytes(await future))
+                rendered.append(page_number)
+            except Exception as e:
+                failed.append(page_number)
+                print(f"PDF 페이지 {page_number} 렌더링 오류: {e}")
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+    return images, rendered, {
+        "pdf_pages_rendered": len(images),
+        "pdf_render_failed_pages": len(failed),
+        "pdf_render_ms": round((time.time() - t_start) * 1000, 1),
+    }
+
+
+@traced("file.extract")
+async def process_uploaded_file_async(
+    file_content: FileSource, file_type: str, token_budget: Optional[int] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """이벤트 루프를 막지 않는 파일 처리. (텍스트, 추출 통계)를 반환"""
+    file_type = file_type.lower()
+    if file_type == "pdf":
+        text, stats = await extract_text_from_pdf_async(file_content, token_budget)
+    else:
+        t_start = time.time()
+        text = await asyncio.to_thread(process_uploaded_file, file_content, file_type)
+        stats = {"extract_budget_reached": False}
+        if token_budget is not None and estimate_tokens(text) > token_budget:
+            text = trim_to_tokens(text, token_budget)
+            stats["extract_budget_reached"] = True
+        stats["file_extract_ms"] = round((time.time() - t_start) * 1000, 1)
+    if DOCUMENT_COMPACTION and text:
+        text, compaction_stats = await asyncio.to_thread(
+            compact_document_text, text, DOCUMENT_DEDUPE_PARAGRAPHS, file_type == "pdf"
+        )
+        stats.update(compaction_stats)
+    return text, stats
+
+
+# ===== 문서 텍스트 압축 (프롬프트 토큰 절약) =====
+_PAGE_NUMBER_RE = re.compile(
+    r"^(?:page\s*)?[-–—(\[]?\s*\d{1,4}\s*[-–—)\]]?(?:\s*(?:/|of)\s*\d{1,4})?(?:\s*(?:페이지|쪽|page))?$",
+    re.IGNORECASE,
+)
+_DIGITS_RE = re.compile(r"\d+")
+_INLINE_SPACE_RE = re.compile(r"[ \t\u00a0\u3000]+")
+# 문장이 끝났다고 볼 수 있는 줄 끝 문자
+_SENTENCE_END = tuple(".!?:;。！？…\"'”’)]}>")
+_LIST_ITEM_RE = re.compile(r"^(?:[-•*·▪◦]|\d+[.)]|[a-zA-Z][.)]|[가-힣][.)]|\(\d+\))\s")
+# 머리말/꼬리말 후보로 보는 페이지 위/아래 줄 수
+_BOILERPLATE_EDGE_LINES = 3
+
+
+def _boilerplate_key(line: str) -> str:
+    """페이지 번호 등 숫자만 다른 머리말/꼬리말을 같은 줄로 취급"""
+    return _DIGITS_RE.sub("#", line.strip().lower())
+
+
+def _edge_indices(lines: List[str]) -> List[int]:
+    """페이지 위/아래 가장자리 줄(비어 있지 않은 줄 기준)의 인덱스"""
+    non_empty = [i for i, ln in enumerate(lines) if ln.strip()]
+    if len(non_empty) <= _BOILERPLATE_EDGE_LINES * 2:
+        return non_empty
+    return non_empty[:_BOILERPLATE_EDGE_LINES] + non_empty[-_BOILERPLATE_EDGE_LINES:]
+
+
+def _merge_broken_lines(lines: List[str]) -> List[str]:
+    merged: List[str] = []
+    for line in lines:
+        if not line:
+            merged.append(line)
+            continue
+        prev = merged[-1] if merged else ""
+        if prev and not _LIST_ITEM_RE.match(line):
+            if prev.endswith("-") and len(prev) > 1 and prev[-2].isalpha() and line[:1].islower():
+                # 하이픈 줄바꿈: "exam-" + "ple" → "example"
+                merged[-1] = prev[:-1] + line
+                continue
+            if not prev.endswith(_SENTENCE_END) and not prev.endswith(":"):
+                merged[-1] = f"{prev} {line}"
+                continue
+        merged.append(line)
+    return merged
+
+
+def compact_document_text(
+    text: str, dedupe_paragraphs: bool = False, pdf_text: bool = False
+) -> Tuple[str, Dict[str, Any]]:
+    """반복 머리말/꼬리말, 페이지 번호, 빈 줄을 정리하고 (옵션) 동일 문단을 제거합니다.
+
+    머리말/꼬리말과 페이지 번호는 여러 페이지(PAGE_BREAK)가 있을 때 각 페이지의
+    위/아래 줄에서만 찾습니다. 줄바꿈 병합과 줄 안 공백 정리는 PDF 추출 텍스트(pdf_text)에만
+    적용하고, DOCX/TXT는 줄 내용을 그대로 둡니다. 페이지 경계는 유지합니다.
+    """
+    t_start = time.time()
+    tokens_before = estimate_tokens(text)
+    pages = [page.split("\n") for page in text.split(PAGE_BREAK)]
+
+    boilerplate: set = set()
+    if len(pages) >= 3:
+        # 숫자만 있는 줄(표 셀, 연도)은 머리말 후보에서 제외 — 페이지 번호는 아래에서 따로 처리
+        counts = Counter(
+            key
+            for page in pages
+            for key in {_boilerplate_key(page[i]) for i in _edge_indices(page)}
+            if any(ch.isalpha() for ch in key)
+        )
+        threshold = max(2, (len(pages) + 1) // 2)
+        boilerplate = {key for key, count in counts.items() if count >= threshold}
+
+    seen_paragraphs: set = set()
+    removed_lines = 0
+    removed_paragraphs = 0
+    out_pages: List[str] = []
+    for page in pages:
+        edge_idx = set(_edge_indices(page)) if boilerplate else set()
+        # 페이지 번호는 페이지의 첫/마지막 줄에만 있다고 봄 (본문의 숫자 셀/연도는 유지)
+        number_slots = set()
+        if len(pages) > 1:
+            non_empty = [i for i, ln in enumerate(page) if ln.strip()]
+            number_slots = {non_empty[0], non_empty[-1]} if non_empty else set()
+        lines: List[str] = []
+        for i, raw in enumerate(page):
+            line = _INLINE_SPACE_RE.sub(" ", raw).strip() if pdf_text else raw.rstrip()
+            if line and (
+                (i in number_slots and _PAGE_NUMBER_RE.match(line.strip()))
+                or (i in edge_idx and _boilerplate_key(line) in boilerplate)
+            ):
+                removed_lines += 1
+                continue
+            lines.append(line)
+        paragraphs: List[str] = []
+        current: List[str] = []
+        for line in (_merge_broken_lines(lines) if pdf_text else lines) + [""]:
+            if line:
+                current.append(line)
+                continue
+            if current:
+                paragraph = "\n".join(current)
+                current = []
+                if dedupe_paragraphs:
+                    key = paragraph.lower()
+                    if key in seen_paragraphs:
+                        removed_paragraphs += 1
+                        continue
+                    seen_paragraphs.add(key)
+                paragraphs.append(paragraph)
+        out_pages.append("\n\n".join(paragraphs))
+
+    compacted = PAGE_BREAK.join(out_pages).strip()
+    tokens_after = estimate_tokens(compacted)
+    return compacted, {
+        "compaction_tokens_before": tokens_before,
+        "compaction_tokens_after": tokens_after,
+        "compaction_tokens_saved": tokens_before - tokens_after,
+        "compaction_lines_removed": removed_lines,
+        "compaction_paragraphs_deduped": removed_paragraphs,
+        "compaction_ms": round((time.time() - t_start) * 1000, 1),
+    }
@@ -0,0 +1,175 @@
+"""
+GPU 텔레메트리 백그라운드 샘플러
+- 짧은 주기로 장치별 메모리/사용률을 수집해 스냅샷으로 캐시
+- 요청 경로와 /health는 캐시된 스냅샷만 읽음 (torch.cuda 호출 없음)
+- 소스: NVML (pynvml, 장치 전체 사용량 = vLLM KV 캐시 선할당 포함 + 사용률) → torch.cuda.mem_get_info → 없음
+- 테스트에서는 GpuTelemetry(source=...)로 소스를 주입
+"""
+
+import os
+import time
+import asyncio
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from .logger_config import app_logger as logger
+
+
+GPU_TELEMETRY_INTERVAL_SECONDS = float(os.getenv("GPU_TELEMETRY_INTERVAL_SECONDS", "2.0"))
+# auto | nvml | torch | none
+GPU_TELEMETRY_SOURCE = os.getenv("GPU_TELEMETRY_SOURCE", "auto").lower()
+
+_GB = 1024 ** 3
+
+# 장치별 {"index", "name", "memory_used_gb", "memory_total_gb", "utilization_percent"} 목록을 반환
+GpuSource = Callable[[], List[Dict[str, Any]]]
+
+
+class NvmlSource:
+    """NVML 장치 단위 측정 (다른 프로세스의 할당과 사용률까지 포함)"""
+
+    def __init__(self):
+        import pynvml
+        pynvml.nvmlInit()
+        self._nvml = pynvml
+        self._handles = [pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(pynvml.nvmlDeviceGetCount())]
+        self._names = []
+        for handle in self._handles:
+            name = pynvml.nvmlDeviceGetName(handle)
+            self._names.append(name.decode() if isinstance(name, bytes) else name)
+
+    def __call__(self) -> List[Dict[str, Any]]:
+        devices = []
+        for index, handle in enumerate(self._handles):
+            memory = self._nvml.nvmlDeviceGetMemoryInfo(handle)
+            utilization = self._nvml.nvmlDeviceGetUtilizationRates(handle)
+            devices.append({
+                "index": index,
+                "name": self._names[index],
+                "memory_used_gb": round(memory.used / _GB, 2),
+                "memory_total_gb": round(memory.total / _GB, 2),
+                "utilization_percent": float(utilization.gpu),
+            })
+        return devices
+
+
+class TorchSource:
+    """torch.cuda.mem_get_info 기반 (장치 전체 여유 메모리 기준, 사용률 없음)"""
+
+    def __init__(self):
+        import torch
+        if not torch.cuda.is_available():
+            raise RuntimeError("CUDA를 사용할 수 없습니다")
+        self._torch = torch
+        self._names = [torch.cuda.get_device_name(i) for i in range(torch.cuda.device_count())]
+
+    def __call__(self) -> List[Dict[str, Any]]:
+        devices = []
+        for index, name in enumerate(self._names):
+            free, total = self._torch.cuda.mem_get_info(index)
+            devices.append({
+                "index": index,
+                "name": name,
+                "memory_used_gb": round((total - free) / _GB, 2),
+                "memory_total_gb": round(total / _GB, 2),
+                "utilization_percent": None,
+            })
+        return devices
+
+
+def _null_source() -> List[Dict[str, Any]]:
+    return []
+
+
+def default_source(kind: str = GPU_TELEMETRY_SOURCE) -> GpuSource:
+    candidates = {"nvml": [NvmlSource], "torch": [TorchSource], "none": [], "auto": [NvmlSource, TorchSource]}
+    for factory in candidates.get(kind, [NvmlSource, TorchSource]):
+        try:
+            return factory()
+        except Exception as e:
+            logger.debug(f"GPU 텔레메트리 소스 {factory.__name__} 사용 불가: {e}")
+    return _null_source
+
+
+class GpuTelemetry:
+    """주기적으로 소스를 호출해 최신 스냅샷을 보관"""
+
+    def __init__(self, source: Optional[GpuSource] = None, interval: float = GPU_TELEMETRY_INTERVAL_SECONDS):
+        self._source = source
+        self.interval = max(0.1, interval)
+        self._devices: List[Dict[str, Any]] = []
+        self._sampled_at = 0.0
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"samples": 0, "errors": 0}
+
+    @property
+    def source(self) -> GpuSource:
+        # 기본 소스는 처음 샘플링할 때 초기화 (import 시 NVML/CUDA 초기화 방지)
+        if self._source is None:
+            self._source = default_source()
+        return self._source
+
+    async def start(self) -> None:
+        if self._task is None:
+            await asyncio.to_thread(self.sample)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def aclose(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def sample(self) -> None:
+        try:
+            devices = self.source()
+        except Exception as e:
+            self.stats["errors"] += 1
+            if self.stats["errors"] == 1:
+                logger.warning(f"⚠️ GPU 텔레메트리 수집 실패: {e}")
+            return
+        with self._lock:
+            self._devices = devices
+            self._sampled_at = time.time()
+        self.stats["samples"] += 1
+
+    def devices(self) -> List[Dict[str, Any]]:
+        """장치별 최신 스냅샷 (샘플러가 시작되지 않았으면 한 번 직접 수집)"""
+        if self._sampled_at == 0.0 and self._task is None:
+            self.sample()
+        with self._lock:
+            return list(self._devices)
+
+    def status(self) -> Dict[str, Any]:
+        """전체 장치 합계 (기존 get_gpu_status 형식)"""
+        devices = self.devices()
+        return {
+            "memory_used": round(sum(d["memory_used_gb"] for d in devices), 2),
+            "memory_total": round(sum(d["memory_total_gb"] for d in devices), 2),
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            age = round(time.time() - self._sampled_at, 2) if self._sampled_at else None
+            devices = list(self._devices)
+        return {
+            "interval_seconds": self.interval,
+            "source": getattr(self._source, "__name__", type(self._source).__name__) if self._source is not None else None,
+            "snapshot_age_seconds": age,
+            "devices": devices,
+            **self.stats,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await asyncio.to_thread(self.sample)
+
+
+# 전역 GPU 텔레메트리 인스턴스
+gpu_telemetry = GpuTelemetry()
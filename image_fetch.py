@@ -0,0 +1,369 @@
+"""
+원격 이미지 URL 가져오기
+- 연결 풀을 공유하는 비동기 HTTP 클라이언트 (httpx)
+- 타임아웃, 최대 크기, Content-Type 검사
+- ETag/Last-Modified 재검증 캐시로 반복 참조 시 재다운로드 방지
+- 리다이렉트는 직접 따라가며 매 단계 허용 호스트와 DNS 해석 결과(사설/루프백/링크로컬/메타데이터 IP 거부)를 검사
+- 연결은 전송 계층에서 다시 해석·검사한 IP로만 맺음 (DNS 재바인딩 방지, Host 헤더/TLS SNI는 원래 호스트 이름)
+"""
+
+import os
+import time
+import socket
+import asyncio
+import ipaddress
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import httpx
+import httpcore
+from PIL import Image
+
+from .utils import is_image_url, process_image_bytes, process_image_data
+from .logger_config import app_logger as logger
+from .tracing import traced
+
+
+IMAGE_FETCH_TIMEOUT_SECONDS = float(os.getenv("IMAGE_FETCH_TIMEOUT_SECONDS", "10"))
+IMAGE_FETCH_CONNECT_TIMEOUT_SECONDS = float(os.getenv("IMAGE_FETCH_CONNECT_TIMEOUT_SECONDS", "3"))
+IMAGE_FETCH_MAX_BYTES = int(os.getenv("IMAGE_FETCH_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_FETCH_MAX_CONNECTIONS = int(os.getenv("IMAGE_FETCH_MAX_CONNECTIONS", "32"))
+IMAGE_FETCH_MAX_KEEPALIVE = int(os.getenv("IMAGE_FETCH_MAX_KEEPALIVE", "16"))
+IMAGE_FETCH_CACHE_MAX_BYTES = int(os.getenv("IMAGE_FETCH_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+# 이 시간 동안은 재검증 없이 캐시를 그대로 사용
+IMAGE_FETCH_CACHE_FRESH_SECONDS = float(os.getenv("IMAGE_FETCH_CACHE_FRESH_SECONDS", "60"))
+# 허용 호스트 (쉼표 구분, 비어 있으면 공인 IP로 해석되는 모든 호스트)
+IMAGE_FETCH_ALLOWED_HOSTS = [
+    h.strip().lower() for h in os.getenv("IMAGE_FETCH_ALLOWED_HOSTS", "").split(",") if h.strip()
+]
+IMAGE_FETCH_MAX_REDIRECTS = int(os.getenv("IMAGE_FETCH_MAX_REDIRECTS", "3"))
+
+# 호스트 이름 → IP 주소 목록 (테스트에서 주입)
+HostResolver = Callable[[str], Awaitable[List[str]]]
+
+
+class ImageFetchError(ValueError):
+    """원격 이미지 가져오기 실패"""
+
+
+class ImageFetchRefused(ImageFetchError):
+    """허용되지 않은 호스트/주소로의 요청 (리다이렉트 포함)"""
+
+
+async def resolve_host(host: str) -> List[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    return [info[4][0] for info in infos]
+
+
+def _is_public_ip(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    # IPv4-mapped IPv6 (::ffff:127.0.0.1)는 IPv4 기준으로 판단
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    # 클라우드 메타데이터(169.254.169.254, fd00:ec2::254)는 링크로컬/사설 대역에 포함
+    return not (
+        ip.is_private
+        or ip.is_loopback
+        or ip.is_link_local
+        or ip.is_multicast
+        or ip.is_reserved
+        or ip.is_unspecified
+    )
+
+
+class _PinnedNetworkBackend(httpcore.AsyncNetworkBackend):
+    """연결 시점에 호스트를 해석·검사하고, 검사를 통과한 IP 주소로만 TCP 연결"""
+
+    def __init__(self, resolve_public: Callable[[str], Awaitable[List[str]]]):
+        self._resolve_public = resolve_public
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        addresses = await self._resolve_public(host)
+        error: Optional[Exception] = None
+        for address in addresses:
+            try:
+                return await self._backend.connect_tcp(
+                    address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        raise error or httpcore.ConnectError(f"연결할 주소가 없습니다: {host}")
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        raise httpcore.ConnectError("이미지 fetch에서는 유닉스 소켓 연결을 허용하지 않습니다")
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+class _PinnedTransport(httpx.AsyncHTTPTransport):
+    """httpx 기본 전송과 같되, 연결은 _PinnedNetworkBackend로만 맺음"""
+
+    def __init__(self, resolve_public: Callable[[str], Awaitable[List[str]]], limits: httpx.Limits):
+        super().__init__(limits=limits, trust_env=False)
+        # AsyncHTTPTransport는 network_backend 인자를 받지 않으므로 같은 설정으로 풀을 구성
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            network_backend=_PinnedNetworkBackend(resolve_public),
+        )
+
+
+@dataclass
+class _CachedImage:
+    content: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    validated_at: float
+
+
+class RemoteImageFetcher:
+    """공유 httpx.AsyncClient 기반 원격 이미지 fetcher"""
+
+    def __init__(
+        self,
+        client: Optional[httpx.AsyncClient] = None,
+        max_bytes: int = IMAGE_FETCH_MAX_BYTES,
+        cache_max_bytes: int = IMAGE_FETCH_CACHE_MAX_BYTES,
+        fresh_seconds: float = IMAGE_FETCH_CACHE_FRESH_SECONDS,
+        allowed_hosts: Optional[List[str]] = None,
+        resolver: Optional[HostResolver] = None,
+        max_redirects: int = IMAGE_FETCH_MAX_REDIRECTS,
+    ):
+        self._client = client
+        self._owns_client = client is None
+        self.max_bytes = max_bytes
+        self.cache_max_bytes = cache_max_bytes
+        self.fresh_seconds = fresh_seconds
+        self.allowed_hosts = IMAGE_FETCH_ALLOWED_HOSTS if allowed_hosts is None else allowed_hosts
+        self.resolver = resolver or resolve_host
+        self.max_redirects = max(0, max_redirects)
+        self._cache: "OrderedDict[str, _CachedImage]" = OrderedDict()
+        self._cache_bytes = 0
+        self._cache_lock = threading.Lock()
+        # 동일 URL 동시 요청은 하나의 다운로드로 합침
+        self._inflight: Dict[str, "asyncio.Future[bytes]"] = {}
+        self.stats: Dict[str, int] = {
+            "fetched": 0,
+            "cache_fresh_hits": 0,
+            "revalidated": 0,
+            "errors": 0,
+            "refused": 0,
+            "bytes_downloaded": 0,
+        }
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(
+                max_connections=IMAGE_FETCH_MAX_CONNECTIONS,
+                max_keepalive_connections=IMAGE_FETCH_MAX_KEEPALIVE,
+            )
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(IMAGE_FETCH_TIMEOUT_SECONDS, connect=IMAGE_FETCH_CONNECT_TIMEOUT_SECONDS),
+                # 검사한 IP로만 연결 (환경 프록시를 거치면 고정이 풀리므로 사용하지 않음)
+                transport=_PinnedTransport(self._resolve_public, limits),
+                trust_env=False,
+                # 리다이렉트는 _download에서 단계마다 검사하며 직접 따라감
+                follow_redirects=False,
+                headers={"Accept": "image/*"},
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None and self._owns_client:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch(self, url: str) -> bytes:
+        """URL의 이미지 바이트 반환 (캐시/재검증 포함)"""
+        self._check_url(url)
+        cached = self._cache_get(url)
+        if cached is not None and time.time() - cached.validated_at < self.fresh_seconds:
+            self.stats["cache_fresh_hits"] += 1
+            return cached.content
+
+        pending = self._inflight.get(url)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future: "asyncio.Future[bytes]" = asyncio.get_running_loop().create_future()
+        self._inflight[url] = future
+        try:
+            content = await self._download(url, cached)
+            future.set_result(content)
+            return content
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 대기자가 없으면 "exception was never retrieved" 경고 방지
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(url, None)
+
+    async def fetch_many(self, urls: List[str]) -> List[bytes]:
+        return list(await asyncio.gather(*(self.fetch(url) for url in urls)))
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._cache_lock:
+            return {"cache_items": len(self._cache), "cache_bytes": self._cache_bytes, **self.stats}
+
+    # ===== 내부 구현 =====
+    def _check_url(self, url: str) -> str:
+        """스킴과 허용 호스트 검사, 호스트 이름 반환"""
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ImageFetchError(f"지원하지 않는 이미지 URL: {url}")
+        host = parsed.hostname.lower()
+        if self.allowed_hosts and host not in self.allowed_hosts:
+            raise ImageFetchRefused(f"허용되지 않은 이미지 호스트: {host}")
+        return host
+
+    async def _check_target(self, url: str) -> None:
+        """요청 직전 검사 (리다이렉트 단계마다): 허용 호스트 + 해석된 IP가 모두 공인 주소인지
+
+        실제 연결은 전송 계층(_PinnedNetworkBackend)이 다시 해석·검사한 주소로 맺습니다.
+        """
+        await self._resolve_public(self._check_url(url))
+
+    async def _resolve_public(self, host: str) -> List[str]:
+        """호스트를 IP 목록으로 해석하고, 하나라도 공인 주소가 아니면 거부"""
+        try:
+            addresses = [str(ipaddress.ip_address(host))]
+        except ValueError:
+            try:
+                addresses = await self.resolver(host)
+            except OSError as e:
+                raise ImageFetchError(f"이미지 호스트를 찾을 수 없습니다: {host}") from e
+        if not addresses or not all(_is_public_ip(address) for address in addresses):
+            raise ImageFetchRefused(f"내부/사설 주소로 해석되는 이미지 호스트는 허용되지 않습니다: {host}")
+        return addresses
+
+    async def _download(self, url: str, cached: Optional[_CachedImage]) -> bytes:
+        headers: Dict[str, str] = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        target = url
+        try:
+            for _ in range(self.max_redirects + 1):
+                await self._check_target(target)
+                async with self.client.stream("GET", target, headers=headers, follow_redirects=False) as response:
+                    if response.is_redirect:
+                        location = response.headers.get("location")
+                        if not location:
+                            raise ImageFetchError(f"Location 없는 리다이렉트: {target}")
+                        target = urljoin(target, location)
+                        continue
+                    if response.status_code == 304 and cached is not None:
+                        cached.validated_at = time.time()
+                        self.stats["revalidated"] += 1
+                        return cached.content
+                    if response.status_code != 200:
+                        raise ImageFetchError(f"이미지 URL 응답 오류 {response.status_code}: {target}")
+                    content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+                    if not content_type.startswith("image/"):
+                        raise ImageFetchError(f"이미지가 아닌 Content-Type: {content_type or '없음'}")
+                    declared = response.headers.get("content-length")
+                    if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                        raise ImageFetchError(f"이미지 크기가 제한({self.max_bytes} bytes)를 초과했습니다")
+                    chunks: List[bytes] = []
+                    received = 0
+                    async for chunk in response.aiter_bytes():
+                        received += len(chunk)
+                        if received > self.max_bytes:
+                            raise ImageFetchError(f"이미지 크기가 제한({self.max_bytes} bytes)를 초과했습니다")
+                        chunks.append(chunk)
+                    content = b"".join(chunks)
+                    etag = response.headers.get("etag")
+                    last_modified = response.headers.get("last-modified")
+                    break
+            else:
+                raise ImageFetchError(f"리다이렉트가 너무 많습니다 (최대 {self.max_redirects}회): {url}")
+        except ImageFetchRefused:
+            self.stats["refused"] += 1
+            raise
+        except ImageFetchError:
+            self.stats["errors"] += 1
+            raise
+        except httpx.HTTPError as e:
+            self.stats["errors"] += 1
+            raise ImageFetchError(f"이미지 URL 가져오기 실패: {type(e).__name__}: {e}") from e
+
+        self.stats["fetched"] += 1
+        self.stats["bytes_downloaded"] += len(content)
+        if etag or last_modified:
+            self._cache_put(url, _CachedImage(content, etag, last_modified, time.time()))
+        return content
+
+    def _cache_get(self, url: str) -> Optional[_CachedImage]:
+        with self._cache_lock:
+            entry = self._cache.get(url)
+            if entry is not None:
+                self._cache.move_to_end(url)
+            return entry
+
+    def _cache_put(self, url: str, entry: _CachedImage) -> None:
+        if len(entry.content) > self.cache_max_bytes:
+            return
+        with self._cache_lock:
+            old = self._cache.pop(url, None)
+            if old is not None:
+                self._cache_bytes -= len(old.content)
+            self._cache[url] = entry
+            self._cache_bytes += len(entry.content)
+            while self._cache_bytes > self.cache_max_bytes and self._cache:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted.content)
+
+
+@traced("image.resolve")
+async def resolve_image_sources(
+    image_sources: List[str], fetcher: Optional["RemoteImageFetcher"] = None
+) -> Tuple[List[Image.Image], float]:
+    """base64/data URL/http(s) URL 혼합 목록을 이미지로 변환
+
+    URL은 동시에 가져오며, (이미지 목록, 원격 가져오기 시간 ms)를 반환합니다.
+    실패 시 process_image_list와 같은 형식의 ValueError를 발생시킵니다.
+    """
+    fetcher = fetcher or image_fetcher
+    url_indices = [idx for idx, src in enumerate(image_sources) if is_image_url(src)]
+    fetched: Dict[int, bytes] = {}
+    fetch_ms = 0.0
+    if url_indices:
+        t_fetch0 = time.time()
+        results = await asyncio.gather(
+            *(fetcher.fetch(image_sources[idx]) for idx in url_indices), return_exceptions=True
+        )
+        fetch_ms = round((time.time() - t_fetch0) * 1000, 1)
+        for idx, result in zip(url_indices, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"⚠️ 원격 이미지 {idx} 가져오기 실패: {result}")
+                raise ValueError(f"이미지 {idx} 처리 실패: {result}") from result
+            fetched[idx] = result
+
+    images: List[Image.Image] = []
+    for idx, src in enumerate(image_sources):
+        try:
+            if idx in fetched:
+                images.append(process_image_bytes(fetched[idx]))
+            else:
+                images.append(process_image_data(src))
+        except Exception as exc:
+            raise ValueError(f"이미지 {idx} 처리 실패: {exc}") from exc
+    return images, fetch_ms
+
+
+# 전역 fetcher 인스턴스 (연결 풀 공유)
+image_fetcher = RemoteImageFetcher()
@@ -4,11 +4,23 @@
 - DEBUG 모드에서 상세한 입출력 정보 로깅
 - 구조화된 로그 포맷
 - 이미지 정보, 프롬프트, 응답 등 상세 정보 기록
+- 큐 핸들러 + 백그라운드 리스너로 콘솔/파일 출력 (요청 처리 스레드에서 디스크 I/O 없음)
+- 크기/시간 기준 로그 회전 + gzip 압축
+- REQUEST_LOG_FORMAT=json: 요청당 구조화 JSON 레코드 하나 (성공 로그 샘플링, 오류/느린 요청은 항상 기록)
 """
 
 import os
 import json
+import gzip
+import time
+import queue
+import random
+import shutil
+import atexit
 import logging
+import logging.handlers
+import traceback
+from contextvars import ContextVar
 from typing import Any, Dict, Optional, List
 from datetime import datetime
 import base64
@@ -16,6 +28,21 @@ from PIL import Image
 import io
 
 
+# 큐 크기와 큐가 가득 찼을 때 정책 (drop: 버리고 집계 / block: 빈자리 날 때까지 대기)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_QUEUE_FULL_POLICY = os.getenv("LOG_QUEUE_FULL_POLICY", "drop").lower()
+# 회전: LOG_ROTATE_WHEN을 지정하면 시간 기준 (midnight, H, D 등), 아니면 크기 기준
+LOG_ROTATE_MAX_BYTES = int(os.getenv("LOG_ROTATE_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+LOG_ROTATE_BACKUP_COUNT = int(os.getenv("LOG_ROTATE_BACKUP_COUNT", "5"))
+LOG_ROTATE_COMPRESS = os.getenv("LOG_ROTATE_COMPRESS", "1").lower() in ("1", "true", "yes")
+# 요청 로그 형식: text (단계별 여러 줄) / json (요청당 구조화 레코드 하나)
+REQUEST_LOG_FORMAT = os.getenv("REQUEST_LOG_FORMAT", "text").lower()
+# json 형식에서 성공 요청을 기록할 비율 (오류/느린 요청은 항상 기록)
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv("REQUEST_LOG_SAMPLE_RATE", "1.0"))
+REQUEST_LOG_SLOW_MS = float(os.getenv("REQUEST_LOG_SLOW_MS", "5000"))
+
+
 class ColoredFormatter(logging.Formatter):
     """컬러 로그 포맷터 (터미널에서 보기 좋게)"""
     
@@ -29,11 +56,96 @@ class ColoredFormatter(logging.Formatter):
     RESET = '\033[0m'
     
     def format(self, record):
+        # 같은 레코드를 파일 핸들러도 쓰므로 복사본에만 색을 입힘
+        record = logging.makeLogRecord(record.__dict__)
         log_color = self.COLORS.get(record.levelname, self.RESET)
         record.levelname = f"{log_color}{record.levelname}{self.RESET}"
         return super().format(record)
 
 
+class LazyJSON:
+    """리스너 스레드에서 출력될 때 처음 직렬화되는 로그 메시지"""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+
+    def __str__(self) -> str:
+        return json.dumps(self.data, ensure_ascii=False, default=str)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """큐가 가득 차면 정책에 따라 레코드를 버리거나(drop) 기다리는(block) 큐 핸들러"""
+
+    def __init__(self, log_queue: "queue.Queue", policy: str = LOG_QUEUE_FULL_POLICY):
+        super().__init__(log_queue)
+        self.block = policy == "block"
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 구조화 레코드는 호출 스레드에서 포맷하지 않음 (완성된 dict만 넘어옴)
+        if isinstance(record.msg, LazyJSON):
+            return record
+        return super().prepare(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _rotating_file_handler(log_file: str) -> logging.Handler:
+    if LOG_ROTATE_WHEN:
+        handler: logging.handlers.BaseRotatingHandler = logging.handlers.TimedRotatingFileHandler(
+            log_file, when=LOG_ROTATE_WHEN, backupCount=LOG_ROTATE_BACKUP_COUNT, encoding='utf-8'
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_ROTATE_MAX_BYTES, backupCount=LOG_ROTATE_BACKUP_COUNT, encoding='utf-8'
+        )
+    if LOG_ROTATE_COMPRESS:
+        handler.namer = lambda name: f"{name}.gz"
+        handler.rotator = _gzip_rotator
+    return handler
+
+
+# 로거 이름 → (큐 핸들러, 리스너)
+_queue_logging: Dict[str, Any] = {}
+
+
+def _stop_listeners() -> None:
+    """종료 시 큐에 남은 레코드를 모두 기록"""
+    for _, listener in _queue_logging.values():
+        listener.stop()
+    _queue_logging.clear()
+
+
+atexit.register(_stop_listeners)
+
+
+def get_logging_stats() -> Dict[str, Any]:
+    """로거별 큐 적재량/버린 레코드 수"""
+    return {
+        "queue_full_policy": LOG_QUEUE_FULL_POLICY,
+        "queue_size": LOG_QUEUE_SIZE,
+        "loggers": {
+            name: {"queued": handler.queue.qsize(), "dropped": handler.dropped}
+            for name, (handler, _) in _queue_logging.items()
+        },
+    }
+
+
 def setup_logger(name: str, log_file: Optional[str] = None) -> logging.Logger:
     """
     로거 설정
@@ -52,8 +164,10 @@ def setup_logger(name: str, log_file: Optional[str] = None) -> logging.Logger:
     level = getattr(logging, log_level, logging.INFO)
     logger.setLevel(level)
     
-    # 기존 핸들러 제거
+    # 기존 핸들러/리스너 제거
     logger.handlers.clear()
+    if name in _queue_logging:
+        _queue_logging.pop(name)[1].stop()
     
     # 콘솔 핸들러
     console_handler = logging.StreamHandler()
@@ -68,29 +182,82 @@ def setup_logger(name: str, log_file: Optional[str] = None) -> logging.Logger:
     # 컬러 포맷터 적용
     colored_formatter = ColoredFormatter(format_str, datefmt='%Y-%m-%d %H:%M:%S')
     console_handler.setFormatter(colored_formatter)
-    logger.addHandler(console_handler)
+    handlers: List[logging.Handler] = [console_handler]
     
-    # 파일 핸들러 (옵션)
+    # 파일 핸들러 (옵션, 회전/압축)
     if log_file:
-        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        file_handler = _rotating_file_handler(log_file)
         file_handler.setLevel(level)
         plain_formatter = logging.Formatter(format_str, datefmt='%Y-%m-%d %H:%M:%S')
         file_handler.setFormatter(plain_formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
+    
+    # 로거에는 큐 핸들러만 두고 실제 출력은 리스너 스레드에서 처리
+    queue_handler = BoundedQueueHandler(queue.Queue(maxsize=max(1, LOG_QUEUE_SIZE)))
+    queue_handler.setLevel(level)
+    logger.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _queue_logging[name] = (queue_handler, listener)
     
     return logger
 
 
+# 현재 요청의 구조화 레코드 (엔드포인트와 엔진이 같은 레코드에 필드를 모음)
+_current_request: ContextVar[Optional["RequestLogger"]] = ContextVar("current_request", default=None)
+
+
+def _active_request(request_id: str) -> Optional["RequestLogger"]:
+    current = _current_request.get()
+    return current if current is not None and current.request_id == request_id else None
+
+
 class RequestLogger:
-    """요청별 상세 로깅 클래스"""
+    """요청별 상세 로깅 클래스
+
+    REQUEST_LOG_FORMAT=json이면 각 log_* 호출은 필드만 모으고,
+    log_request_end에서 요청당 JSON 레코드 하나를 (샘플링 후) 기록합니다.
+    같은 request_id로 안쪽에서 만든 RequestLogger(엔진)는 바깥 레코드를 공유합니다.
+    """
     
     def __init__(self, logger: logging.Logger, request_id: str):
         self.logger = logger
         self.request_id = request_id
         self.start_time = datetime.now()
+        self.structured = REQUEST_LOG_FORMAT == "json"
+        self.owns_record = False
+        if self.structured:
+            parent = _active_request(request_id)
+            if parent is not None:
+                self.fields = parent.fields
+                self._t0 = parent._t0
+            else:
+                self.owns_record = True
+                self._t0 = time.perf_counter()
+                self.fields: Dict[str, Any] = {"request_id": request_id, "logger": logger.name}
+                self._token = _current_request.set(self)
+    
+    def set(self, **fields):
+        """구조화 레코드에 필드 추가 (text 형식에서는 무시)"""
+        if self.structured:
+            self.fields.update(fields)
+    
+    def info(self, msg: str, *args):
+        """text 형식에서만 출력되는 진행 로그 (인자는 출력 시 포맷)"""
+        if not self.structured:
+            self.logger.info(msg, *args)
+    
+    def debug(self, msg: str, *args):
+        if not self.structured:
+            self.logger.debug(msg, *args)
         
     def log_request_start(self, endpoint: str, **kwargs):
         """요청 시작 로깅"""
+        if self.structured:
+            self.fields["endpoint"] = endpoint
+            self.fields["start_time"] = self.start_time.isoformat(timespec="milliseconds")
+            self.fields["request"] = kwargs
+            return
         self.logger.info(f"🎯 [{self.request_id}] ===== 요청 시작: {endpoint} =====")
         self.logger.info(f"⏰ [{self.request_id}] 시작 시각: {self.start_time.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}")
         
@@ -101,6 +268,9 @@ class RequestLogger:
     def log_prompt(self, prompt: str, max_length: int = 500):
         """프롬프트 로깅"""
         prompt_length = len(prompt)
+        if self.structured:
+            self.fields["prompt_chars"] = prompt_length
+            return
         self.logger.info(f"📝 [{self.request_id}] 프롬프트 길이: {prompt_length}자")
         
         if self.logger.level <= logging.DEBUG:
@@ -112,6 +282,9 @@ class RequestLogger:
     
     def log_image(self, image: Image.Image, image_data: Optional[str] = None):
         """이미지 정보 로깅"""
+        if self.structured:
+            self.fields.setdefault("images", []).append({"size": list(image.size), "mode": image.mode})
+            return
         self.logger.info(f"🖼️ [{self.request_id}] 이미지 포함: 예")
         self.logger.info(f"📐 [{self.request_id}] 이미지 크기: {image.size[0]}x{image.size[1]}")
         self.logger.info(f"🎨 [{self.request_id}] 이미지 모드: {image.mode}")
@@ -132,6 +305,9 @@ class RequestLogger:
     
     def log_generation_params(self, **params):
         """생성 파라미터 로깅"""
+        if self.structured:
+            self.fields["params"] = params
+            return
         self.logger.info(f"⚙️ [{self.request_id}] 생성 파라미터:")
         for key, value in params.items():
             self.logger.info(f"   - {key}: {value}")
@@ -139,6 +315,10 @@ class RequestLogger:
     def log_response(self, response: str, max_length: int = 500):
         """응답 로깅"""
         response_length = len(response)
+        if self.structured:
+            self.fields["response_chars"] = response_length
+            self.fields["response_preview"] = response[:100]
+            return
         self.logger.info(f"📤 [{self.request_id}] 응답 길이: {response_length}자")
         
         if self.logger.level <= logging.DEBUG:
@@ -157,6 +337,9 @@ class RequestLogger:
     
     def log_json_response(self, json_data: Optional[Dict[str, Any]]):
         """JSON 응답 로깅"""
+        if self.structured:
+            self.fields["response_is_json"] = json_data is not None
+            return
         if json_data:
             self.logger.info(f"📋 [{self.request_id}] JSON 파싱: 성공")
             
@@ -171,6 +354,9 @@ class RequestLogger:
     
     def log_timings(self, timings: Dict[str, Any]):
         """타이밍 정보 로깅"""
+        if self.structured:
+            self.fields.setdefault("timings", {}).update(timings)
+            return
         self.logger.info(f"⏱️ [{self.request_id}] 성능 지표:")
         for key, value in timings.items():
             if 'ms' in key:
@@ -182,12 +368,18 @@ class RequestLogger:
     
     def log_gpu_status(self, memory_used: float, memory_total: float, stage: str = ""):
         """GPU 상태 로깅"""
+        if self.structured:
+            self.fields.setdefault("gpu_memory_gb", {})[stage or "current"] = [round(memory_used, 2), round(memory_total, 2)]
+            return
         memory_percent = (memory_used / memory_total * 100) if memory_total > 0 else 0
         stage_label = f" ({stage})" if stage else ""
         self.logger.info(f"🖥️ [{self.request_id}] GPU 메모리{stage_label}: {memory_used:.2f}GB / {memory_total:.2f}GB ({memory_percent:.1f}%)")
     
     def log_lora_adapter(self, adapter_name: Optional[str], is_default: bool = False):
         """LoRA 어댑터 로깅"""
+        if self.structured:
+            self.fields["lora_adapter"] = adapter_name
+            return
         if adapter_name:
             prefix = "🌟" if is_default else "🎯"
             label = "기본 LoRA 어댑터" if is_default else "LoRA 어댑터"
@@ -197,15 +389,25 @@ class RequestLogger:
     
     def log_error(self, error: Exception, context: str = ""):
         """에러 로깅"""
+        if self.structured:
+            self.fields["error"] = {
+                "type": type(error).__name__,
+                "message": str(error),
+                "context": context,
+                "traceback": traceback.format_exc(),
+            }
+            return
         context_label = f" - {context}" if context else ""
         self.logger.error(f"❌ [{self.request_id}] 오류 발생{context_label}: {type(error).__name__}: {str(error)}")
         
         if self.logger.level <= logging.DEBUG:
-            import traceback
             self.logger.debug(f"🔍 [{self.request_id}] 스택 트레이스:\n{traceback.format_exc()}")
     
     def log_request_end(self, success: bool = True):
         """요청 종료 로깅"""
+        if self.structured:
+            self._emit_record(success)
+            return
         end_time = datetime.now()
         duration = (end_time - self.start_time).total_seconds()
         
@@ -215,11 +417,40 @@ class RequestLogger:
         self.logger.info(f"{status_icon} [{self.request_id}] ===== 요청 {status_text} =====")
         self.logger.info(f"⏰ [{self.request_id}] 종료 시각: {end_time.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}")
         self.logger.info(f"⏱️ [{self.request_id}] 총 소요 시간: {duration:.3f}초")
+    
+    def _emit_record(self, success: bool):
+        """오류/느린 요청은 항상, 성공 요청은 REQUEST_LOG_SAMPLE_RATE 비율로 기록"""
+        if not self.owns_record:
+            return
+        self.owns_record = False
+        try:
+            _current_request.reset(self._token)
+        except ValueError:
+            # 다른 컨텍스트에서 종료된 경우
+            pass
+        duration_ms = round((time.perf_counter() - self._t0) * 1000, 1)
+        slow = duration_ms >= REQUEST_LOG_SLOW_MS
+        if not success:
+            level = logging.ERROR
+        elif slow:
+            level = logging.WARNING
+        elif random.random() < REQUEST_LOG_SAMPLE_RATE:
+            level = logging.INFO
+        else:
+            return
+        self.fields.update(success=success, duration_ms=duration_ms, slow=slow)
+        if level == logging.INFO:
+            self.fields["sample_rate"] = REQUEST_LOG_SAMPLE_RATE
+        self.logger.log(level, LazyJSON(self.fields))
 
 
 def log_multimodal_content(logger: logging.Logger, request_id: str, 
                           has_image: bool, has_file: bool, file_type: Optional[str] = None):
     """멀티모달 컨텐츠 로깅"""
+    record = _active_request(request_id)
+    if record is not None:
+        record.set(has_image=has_image, has_file=has_file, file_type=file_type)
+        return
     content_parts = []
     if has_image:
         content_parts.append("이미지")
@@ -236,6 +467,10 @@ def log_multimodal_content(logger: logging.Logger, request_id: str,
 def log_conversation_context(logger: logging.Logger, request_id: str, 
                              conversation_id: str, message_count: int):
     """대화 컨텍스트 로깅"""
+    record = _active_request(request_id)
+    if record is not None:
+        record.set(conversation_id=conversation_id, conversation_messages=message_count)
+        return
     logger.info(f"💬 [{request_id}] 대화 ID: {conversation_id}")
     logger.info(f"📚 [{request_id}] 대화 메시지 수: {message_count}")
 
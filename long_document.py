@@ -0,0 +1,229 @@
+"""
+긴 문서 map-reduce 처리
+- max_model_len을 넘는 문서를 페이지/문단 경계로 청크 분할
+- 청크별 질문을 동시 엔진 요청으로 실행 (vLLM 배칭으로 GPU 공유)
+- 청크 답변을 토큰 예산 내 그룹으로 단계적으로 합침 (bounded reduce)
+"""
+
+import os
+import re
+import time
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from . import engine
+from .file_io import PAGE_BREAK, to_prompt_text, trim_to_tokens
+from .models import format_chat_prompt
+from .utils import estimate_tokens
+from .logger_config import app_logger as logger
+
+
+LONG_DOC_MAP_MAX_TOKENS = int(os.getenv("LONG_DOC_MAP_MAX_TOKENS", "256"))
+# 청크를 작게 나눌수록 동시 요청이 늘고 청크당 prefill이 짧아짐
+LONG_DOC_CHUNK_TOKENS = int(os.getenv("LONG_DOC_CHUNK_TOKENS", "3000"))
+LONG_DOC_MAX_CHUNKS = int(os.getenv("LONG_DOC_MAX_CHUNKS", "32"))
+LONG_DOC_MAX_CONCURRENCY = int(os.getenv("LONG_DOC_MAX_CONCURRENCY", "8"))
+NO_RELEVANT_CONTENT = "관련 내용 없음"
+# map/reduce 지시문이 차지하는 토큰 여유분
+INSTRUCTION_TOKENS = 96
+
+_PARAGRAPH_SPLIT_RE = re.compile(r"\n\s*\n")
+
+
+def _split_units(text: str) -> List[str]:
+    """페이지 → 문단 → 줄 순으로 자연스러운 분할 단위 목록"""
+    units: List[str] = []
+    for page in text.split(PAGE_BREAK):
+        for paragraph in _PARAGRAPH_SPLIT_RE.split(page):
+            paragraph = paragraph.strip()
+            if paragraph:
+                units.append(paragraph)
+        if units and units[-1] != PAGE_BREAK:
+            units.append(PAGE_BREAK)
+    while units and units[-1] == PAGE_BREAK:
+        units.pop()
+    return units
+
+
+def split_into_chunks(text: str, chunk_tokens: int) -> List[str]:
+    """페이지/문단 경계를 지키며 chunk_tokens 이하의 청크로 분할
+
+    한 문단이 예산보다 크면 줄 단위, 그래도 크면 길이 비율로 자릅니다.
+    """
+    chunk_tokens = max(1, chunk_tokens)
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+
+    def flush() -> None:
+        nonlocal current, current_tokens
+        body = "\n\n".join(u for u in current if u != PAGE_BREAK).strip()
+        if body:
+            chunks.append(body)
+        current, current_tokens = [], 0
+
+    def pieces_of(unit: str) -> List[str]:
+        if estimate_tokens(unit) <= chunk_tokens:
+            return [unit]
+        out: List[str] = []
+        for line in unit.split("\n"):
+            while estimate_tokens(line) > chunk_tokens:
+                head = trim_to_tokens(line, chunk_tokens) or line[:1]
+                out.append(head)
+                line = line[len(head):]
+            if line.strip():
+                out.append(line)
+        return out
+
+    for unit in _split_units(text):
+        if unit == PAGE_BREAK:
+            # 페이지 경계는 청크가 절반 이상 찼을 때 끊는 지점으로 사용
+            if current_tokens >= chunk_tokens // 2:
+                flush()
+            continue
+        for piece in pieces_of(unit):
+            piece_tokens = estimate_tokens(piece)
+            if current and current_tokens + piece_tokens > chunk_tokens:
+                flush()
+            current.append(piece)
+            current_tokens += piece_tokens
+    flush()
+    return chunks
+
+
+def _map_prompt(message: str, chunk: str, index: int, total: int) -> str:
+    # 청크를 앞에 두어 같은 문서에 대한 다른 질문이 청크 prefix를 재사용
+    content = (
+        f"=== 문서 일부 ({index}/{total}) ===\n{chunk}\n\n=== 질문 ===\n{message}\n\n"
+        f"위 문서 일부에 근거해서만 질문에 답해주세요. 관련된 내용이 없으면 '{NO_RELEVANT_CONTENT}'이라고만 답해주세요."
+    )
+    return format_chat_prompt([{"role": "user", "content": content}])
+
+
+def _reduce_prompt(message: str, partials: List[str], image_count: int = 0) -> str:
+    answers = "\n\n".join(f"[부분 답변 {i + 1}]\n{answer}" for i, answer in enumerate(partials))
+    # 이미지 수만큼 비전 태그를 넣어야 vLLM이 multi_modal_data와 짝을 맞춤
+    vision_tags = f"{engine.VISION_TAG * image_count}\n" if image_count else ""
+    content = (
+        f"{vision_tags}{message}\n\n=== 문서 각 부분에 대한 답변 ===\n{answers}\n\n"
+        "위 부분 답변들을 종합해 질문에 대한 하나의 완결된 답변을 작성해주세요. 중복은 합치고 서로 다른 내용은 모두 반영해주세요."
+    )
+    return format_chat_prompt([{"role": "user", "content": content}])
+
+
+def _group_by_budget(items: List[str], budget: int) -> List[List[str]]:
+    groups: List[List[str]] = []
+    current: List[str] = []
+    used = 0
+    for item in items:
+        tokens = estimate_tokens(item)
+        if current and used + tokens > budget:
+            groups.append(current)
+            current, used = [], 0
+        current.append(trim_to_tokens(item, budget))
+        used += min(tokens, budget)
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def map_reduce_document(
+    message: str,
+    document_text: str,
+    chunk_tokens: int,
+    reduce_budget: int,
+    max_tokens: int,
+    temperature: float = 0.7,
+    images: Optional[List[Image.Image]] = None,
+    lora_adapter: Optional[str] = None,
+    request_id: str = "longdoc",
+) -> Tuple[str, Dict[str, Any]]:
+    """문서를 청크별로 질의(map)한 뒤 답변을 합쳐(reduce) 최종 답변과 타이밍을 반환
+
+    LONG_DOC_MAX_CHUNKS를 넘는 뒤쪽 청크는 처리하지 않으며, 이 경우
+    long_doc_truncated=True와 long_doc_coverage(처리한 청크 비율)로 알립니다.
+    """
+    chunks = split_into_chunks(document_text, chunk_tokens)
+    total_chunks = len(chunks)
+    truncated_chunks = max(0, total_chunks - LONG_DOC_MAX_CHUNKS)
+    chunks = chunks[:LONG_DOC_MAX_CHUNKS]
+    timings: Dict[str, Any] = {
+        "long_doc_chunks": len(chunks),
+        "long_doc_chunks_dropped": truncated_chunks,
+        "long_doc_truncated": truncated_chunks > 0,
+        "long_doc_coverage": round(len(chunks) / total_chunks, 3) if total_chunks else 1.0,
+    }
+    logger.info(f"📚 [{request_id}] 긴 문서 map-reduce: 청크 {len(chunks)}개 (청크당 최대 {chunk_tokens} 토큰)")
+    if truncated_chunks:
+        logger.warning(f"⚠️ [{request_id}] 청크 상한({LONG_DOC_MAX_CHUNKS}) 초과: 뒤쪽 청크 {truncated_chunks}개는 처리하지 않음")
+
+    semaphore = asyncio.Semaphore(max(1, LONG_DOC_MAX_CONCURRENCY))
+    tokens_generated = 0
+
+    async def run_map(idx: int, chunk: str) -> str:
+        nonlocal tokens_generated
+        async with semaphore:
+            text, gen_timings = await engine.generate_with_vllm(
+                prompt=_map_prompt(message, to_prompt_text(chunk), idx + 1, len(chunks)),
+                max_tokens=LONG_DOC_MAP_MAX_TOKENS,
+                temperature=temperature,
+                lora_adapter=lora_adapter,
+                request_id=f"{request_id}-m{idx}",
+            )
+        tokens_generated += int(gen_timings.get("tokens_generated", 0))
+        return text
+
+    t_map0 = time.time()
+    partials = await asyncio.gather(*(run_map(i, c) for i, c in enumerate(chunks)))
+    timings["long_doc_map_ms"] = round((time.time() - t_map0) * 1000, 1)
+
+    relevant = [p.strip() for p in partials if p.strip() and NO_RELEVANT_CONTENT not in p[:40]]
+    if not relevant:
+        relevant = [p.strip() for p in partials if p.strip()] or [NO_RELEVANT_CONTENT]
+    timings["long_doc_relevant_chunks"] = len(relevant)
+
+    # 한 번에 합칠 수 있을 때까지 그룹 단위로 중간 reduce 반복
+    t_reduce0 = time.time()
+    reduce_rounds = 0
+    group_budget = max(1, reduce_budget)
+    while len(relevant) > 1 and sum(estimate_tokens(p) for p in relevant) > group_budget:
+        groups = _group_by_budget(relevant, group_budget)
+        if len(groups) >= len(relevant):
+            # 더 줄일 수 없으면 각 답변을 예산에 맞게 잘라서 마지막 reduce로 넘김
+            per_item = max(1, group_budget // len(relevant))
+            relevant = [trim_to_tokens(p, per_item) for p in relevant]
+            break
+        reduce_rounds += 1
+
+        async def run_reduce(idx: int, group: List[str]) -> str:
+            nonlocal tokens_generated
+            async with semaphore:
+                text, gen_timings = await engine.generate_with_vllm(
+                    prompt=_reduce_prompt(message, group),
+                    max_tokens=LONG_DOC_MAP_MAX_TOKENS,
+                    temperature=temperature,
+                    lora_adapter=lora_adapter,
+                    request_id=f"{request_id}-r{reduce_rounds}-{idx}",
+                )
+            tokens_generated += int(gen_timings.get("tokens_generated", 0))
+            return text.strip()
+
+        relevant = list(await asyncio.gather(*(run_reduce(i, g) for i, g in enumerate(groups))))
+
+    if len(relevant) == 1:
+        relevant = [trim_to_tokens(relevant[0], group_budget)]
+
+    final_text, final_timings = await engine.generate_with_vllm(
+        prompt=_reduce_prompt(message, relevant, len(images) if images else 0),
+        max_tokens=max_tokens,
+        temperature=temperature,
+        images=images,
+        lora_adapter=lora_adapter,
+        request_id=f"{request_id}-final",
+    )
+    timings["long_doc_reduce_ms"] = round((time.time() - t_reduce0) * 1000, 1)
+    timings["long_doc_reduce_rounds"] = reduce_rounds + 1
+    timings["long_doc_map_tokens_generated"] = tokens_generated
+    return final_text, {**final_timings, **timings}
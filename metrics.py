@@ -0,0 +1,168 @@
+"""
+Prometheus 메트릭 (/metrics)
+- 히스토그램: 큐 대기, 첫 토큰까지 시간(TTFT), 토큰 간 지연, 전체 지연, 프롬프트/생성 토큰 수
+- 카운터: 요청, 오류, JSON 파싱 실패, 멀티모달 → 텍스트 폴백
+- 게이지: 진행 중 요청, 보유 대화 수
+- 라벨: endpoint, lora_adapter, json_only
+- prometheus_client가 없거나 METRICS_ENABLED=0이면 모든 기록이 no-op
+"""
+
+import os
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    from prometheus_client import REGISTRY, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+
+LABELS = ("endpoint", "lora_adapter", "json_only")
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+_TTFT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_ITL_BUCKETS = (0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.2, 0.5, 1.0)
+_TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+class RequestLabels:
+    """요청 하나의 메트릭 라벨 (미들웨어가 만들고 엔드포인트/엔진이 채움)"""
+
+    __slots__ = ("scope", "lora_adapter", "json_only")
+
+    def __init__(self, scope: Dict[str, Any]):
+        self.scope = scope
+        self.lora_adapter: Optional[str] = None
+        self.json_only = False
+
+    @property
+    def endpoint(self) -> str:
+        # 라우팅 후에는 경로 템플릿(/conversations/{conversation_id})을 사용해 라벨 수를 제한
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or self.scope.get("path", "unknown")
+
+    def key(self, lora_adapter: Optional[str] = None) -> Tuple[str, str, str]:
+        adapter = lora_adapter or self.lora_adapter or os.getenv("DEFAULT_LORA_ADAPTER") or "base"
+        return (self.endpoint, adapter, "true" if self.json_only else "false")
+
+
+_current_labels: ContextVar[Optional[RequestLabels]] = ContextVar("metric_labels", default=None)
+# HTTP 요청 밖(백그라운드 요약 등)에서 생성할 때의 라벨
+_INTERNAL_LABELS = RequestLabels({"path": "internal"})
+
+
+class ServerMetrics:
+    """서버 메트릭 모음. 라벨 조합별 child를 캐시해 핫 패스에서는 dict 조회 + 관측만 수행"""
+
+    def __init__(self, enabled: bool = METRICS_ENABLED and PROMETHEUS_AVAILABLE, registry: Any = None):
+        self.enabled = enabled
+        self._children: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+        if not enabled:
+            return
+        self.registry = registry or REGISTRY
+        kw = {"registry": self.registry}
+        self.queue_wait = Histogram(
+            "vllm_server_queue_wait_seconds", "엔진 스케줄러 대기 시간", LABELS, buckets=_TTFT_BUCKETS, **kw
+        )
+        self.ttft = Histogram(
+            "vllm_server_time_to_first_token_seconds", "첫 출력까지 시간", LABELS, buckets=_TTFT_BUCKETS, **kw
+        )
+        self.inter_token = Histogram(
+            "vllm_server_inter_token_latency_seconds", "토큰 간 평균 지연 (요청별)", LABELS, buckets=_ITL_BUCKETS, **kw
+        )
+        self.latency = Histogram(
+            "vllm_server_request_latency_seconds", "요청 전체 지연", LABELS, buckets=_LATENCY_BUCKETS, **kw
+        )
+        self.prompt_tokens = Histogram(
+            "vllm_server_prompt_tokens", "생성 요청별 프롬프트 토큰 수", LABELS, buckets=_TOKEN_BUCKETS, **kw
+        )
+        self.generated_tokens = Histogram(
+            "vllm_server_generated_tokens", "생성 요청별 출력 토큰 수", LABELS, buckets=_TOKEN_BUCKETS, **kw
+        )
+        self.requests = Counter("vllm_server_requests", "처리한 HTTP 요청 수", LABELS, **kw)
+        self.errors = Counter("vllm_server_request_errors", "5xx/예외로 끝난 요청 수", LABELS, **kw)
+        self.json_parse_failures = Counter(
+            "vllm_server_json_parse_failures", "json_only 요청에서 JSON 파싱 실패 수", LABELS, **kw
+        )
+        self.multimodal_fallbacks = Counter(
+            "vllm_server_multimodal_fallbacks", "멀티모달 생성 실패 후 텍스트 모드 재시도 수", LABELS, **kw
+        )
+        self.in_flight = Gauge("vllm_server_requests_in_flight", "진행 중인 HTTP 요청 수", **kw)
+        self.conversations = Gauge("vllm_server_conversations", "보유 중인 대화 수", **kw)
+
+    # ===== 요청 수명 (HTTP 미들웨어) =====
+    def begin(self, scope: Dict[str, Any]) -> Optional[RequestLabels]:
+        if not self.enabled:
+            return None
+        labels = RequestLabels(scope)
+        _current_labels.set(labels)
+        self.in_flight.inc()
+        return labels
+
+    def end(self, labels: Optional[RequestLabels], duration_s: float, error: bool) -> None:
+        if labels is None:
+            return
+        self.in_flight.dec()
+        key = labels.key()
+        self._child(self.requests, key).inc()
+        self._child(self.latency, key).observe(duration_s)
+        if error:
+            self._child(self.errors, key).inc()
+
+    # ===== 엔드포인트/엔진에서 호출 =====
+    def label(self, lora_adapter: Optional[str] = None, json_only: Optional[bool] = None) -> None:
+        """현재 요청의 라벨 지정"""
+        labels = _current_labels.get()
+        if labels is None:
+            return
+        if lora_adapter:
+            labels.lora_adapter = lora_adapter
+        if json_only is not None:
+            labels.json_only = bool(json_only)
+
+    def observe_generation(self, lora_adapter: Optional[str], timings: Dict[str, Any]) -> None:
+        """generate_with_vllm 한 번의 timings 기록"""
+        if not self.enabled:
+            return
+        key = (_current_labels.get() or _INTERNAL_LABELS).key(lora_adapter)
+        if timings.get("queue_ms") is not None:
+            self._child(self.queue_wait, key).observe(timings["queue_ms"] / 1000)
+        if timings.get("ttft_ms") is not None:
+            self._child(self.ttft, key).observe(timings["ttft_ms"] / 1000)
+        if timings.get("inter_token_mean_ms") is not None:
+            self._child(self.inter_token, key).observe(timings["inter_token_mean_ms"] / 1000)
+        if timings.get("prompt_tokens") is not None:
+            self._child(self.prompt_tokens, key).observe(timings["prompt_tokens"])
+        if timings.get("tokens_generated") is not None:
+            self._child(self.generated_tokens, key).observe(timings["tokens_generated"])
+
+    def count_json_parse_failure(self) -> None:
+        if self.enabled:
+            self._child(self.json_parse_failures, (_current_labels.get() or _INTERNAL_LABELS).key()).inc()
+
+    def count_multimodal_fallback(self, lora_adapter: Optional[str] = None) -> None:
+        if self.enabled:
+            self._child(self.multimodal_fallbacks, (_current_labels.get() or _INTERNAL_LABELS).key(lora_adapter)).inc()
+
+    def track_conversations(self, count: Callable[[], float]) -> None:
+        """스크레이프 시점에 대화 수를 읽음"""
+        if self.enabled:
+            self.conversations.set_function(count)
+
+    def render(self) -> bytes:
+        return generate_latest(self.registry)
+
+    # ===== 내부 구현 =====
+    def _child(self, metric: Any, key: Tuple[str, ...]) -> Any:
+        cache_key = (metric._name, key)
+        child = self._children.get(cache_key)
+        if child is None:
+            child = self._children[cache_key] = metric.labels(*key)
+        return child
+
+
+# 전역 메트릭 인스턴스
+server_metrics = ServerMetrics()
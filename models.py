@@ -1,7 +1,10 @@
-from typing import Any, Dict, List, Optional
-from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
 from pydantic import BaseModel
 
+from .conversation_store import Message, conversation_store
+from .utils import estimate_tokens
+from .tracing import traced
+
 
 class ChatRequest(BaseModel):
     message: str
@@ -13,7 +16,8 @@ class ChatRequest(BaseModel):
 
 class VisionRequest(BaseModel):
     message: str
-    image_data: str
+    image_data: Optional[str] = None
+    image_id: Optional[str] = None  # /images로 등록한 이미지 재사용
     conversation_id: Optional[str] = None
     max_tokens: Optional[int] = 512
     json_only: Optional[bool] = False
@@ -23,9 +27,14 @@ class VisionRequest(BaseModel):
 class MultimodalRequest(BaseModel):
     message: str
     image_data: Optional[str] = None
+    image_id: Optional[str] = None
     image_list: Optional[List[str]] = None
     file_data: Optional[str] = None
     file_type: Optional[str] = None
+    document_id: Optional[str] = None  # 이전 응답의 document_id로 추출 텍스트 재사용
+    long_document: Optional[bool] = False  # 컨텍스트를 넘는 문서를 map-reduce로 처리
+    pdf_pages: Optional[List[int]] = None  # 이미지로 렌더링할 PDF 페이지 번호 (1부터)
+    render_scanned_pages: Optional[bool] = False  # pdf_pages 미지정 시 스캔 페이지 렌더링 (opt-in)
     conversation_id: Optional[str] = None
     max_tokens: Optional[int] = 512
     json_only: Optional[bool] = False
@@ -34,7 +43,8 @@ class MultimodalRequest(BaseModel):
 
 class MultiVisionRequest(BaseModel):
     message: str
-    image_list: List[str]
+    image_list: Optional[List[str]] = None
+    image_ids: Optional[List[str]] = None
     conversation_id: Optional[str] = None
     max_tokens: Optional[int] = 512
     json_only: Optional[bool] = False
@@ -42,6 +52,10 @@ class MultiVisionRequest(BaseModel):
     image_count: Optional[int] = None
 
 
+class ImageUploadRequest(BaseModel):
+    image_data: str
+
+
 class GenerationResponse(BaseModel):
     response: str
     conversation_id: str
@@ -62,46 +76,110 @@ class ServerStatus(BaseModel):
 
 
 # ===== 대화 상태 =====
-active_conversations: Dict[str, List[Dict[str, Any]]] = {}
+# <|im_start|>role\n ... <|im_end|>\n 태그가 메시지마다 차지하는 토큰
+CHATML_MESSAGE_OVERHEAD_TOKENS = 5
+CHATML_ASSISTANT_START = "<|im_start|>assistant\n"
+
+
+@traced("conversation.append")
+def add_to_conversation(
+    conversation_id: str,
+    role: str,
+    content: str,
+    image_info: Optional[str] = None,
+    image_ids: Optional[List[str]] = None,
+):
+    extra: Dict[str, Any] = {}
+    if image_info:
+        extra["image_info"] = image_info
+    if image_ids:
+        extra["image_ids"] = list(image_ids)
+    # tokens: 히스토리 윈도우 계산 시 재추정하지 않도록 저장
+    conversation_store.append(
+        conversation_id, Message(role, content, tokens=estimate_tokens(content), extra=extra)
+    )
 
 
-def add_to_conversation(conversation_id: str, role: str, content: str, image_info: Optional[str] = None):
-    if conversation_id not in active_conversations:
-        active_conversations[conversation_id] = []
-    message = {"role": role, "content": content, "timestamp": datetime.now().isoformat()}
-    if image_info:
-        message["image_info"] = image_info
-    active_conversations[conversation_id].append(message)
+def get_conversation_image_ids(conversation_id: str) -> List[str]:
+    """대화에서 가장 최근에 참조된 이미지 ID 목록 (후속 질문에서 재사용)"""
+    for message in reversed(conversation_store.get_messages(conversation_id) or []):
+        if message.get("image_ids"):
+            return list(message["image_ids"])
+    return []
 
 
 def get_or_create_conversation(conversation_id: Optional[str]) -> str:
+    """기존 대화면 그대로, 아니면 새 ID 반환 (저장소 항목은 첫 메시지 추가 시 생성)"""
     import uuid
-    if conversation_id and conversation_id in active_conversations:
+    if conversation_id and conversation_id in conversation_store:
         return conversation_id
-    new_id = str(uuid.uuid4())
-    active_conversations[new_id] = []
-    return new_id
-
-
-def get_conversation_messages(conversation_id: str) -> List[Dict[str, Any]]:
-    if conversation_id not in active_conversations:
-        return []
-    return [{"role": m.get("role", "user"), "content": m.get("content", "")} for m in active_conversations[conversation_id]]
-
-
-def format_chat_prompt(messages: List[Dict[str, Any]]) -> str:
-    parts = []
-    for msg in messages:
-        role = msg.get("role", "user")
-        content = msg.get("content", "")
-        if role == "user":
-            parts.append(f"<|im_start|>user\n{content}<|im_end|>")
-        elif role == "assistant":
-            parts.append(f"<|im_start|>assistant\n{content}<|im_end|>")
-    parts.append("<|im_start|>assistant\n")
+    return str(uuid.uuid4())
+
+
+def get_conversation_messages(conversation_id: str) -> List[Message]:
+    # 저장소의 메시지 레코드를 그대로 반환 (읽기 전용으로 사용)
+    return conversation_store.get_messages(conversation_id) or []
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """메시지 토큰 수 (저장된 값 우선) + ChatML 태그 오버헤드"""
+    tokens = message.get("tokens")
+    if tokens is None:
+        tokens = estimate_tokens(message.get("content", ""))
+    return int(tokens) + CHATML_MESSAGE_OVERHEAD_TOKENS
+
+
+def window_messages(messages: List[Dict[str, Any]], token_budget: int) -> Tuple[List[Dict[str, Any]], int]:
+    """토큰 예산 안에 드는 최신 턴만 남긴 메시지 목록과 제외된 메시지 수
+
+    첫 system 메시지(없으면 첫 user/assistant 턴)와 마지막 메시지를 유지하고,
+    그 사이는 최신 순으로 예산이 허락하는 만큼 채웁니다.
+    고정한 첫 턴과 마지막 메시지만으로 예산을 넘으면 첫 턴도 제외합니다.
+    """
+    if not messages:
+        return [], 0
+    costs = [message_tokens(m) for m in messages]
+    if sum(costs) <= token_budget:
+        return list(messages), 0
+
+    pinned_end = 1
+    if messages[0].get("role") == "user" and len(messages) > 2 and messages[1].get("role") == "assistant":
+        pinned_end = 2
+    pinned_end = min(pinned_end, len(messages) - 1)
+    used = sum(costs[:pinned_end]) + costs[-1]
+    if used > token_budget:
+        pinned_end = 0
+        used = costs[-1]
+
+    start = len(messages) - 1
+    while start > pinned_end and used + costs[start - 1] <= token_budget:
+        start -= 1
+        used += costs[start]
+    # 윈도우가 assistant 답변으로 시작하면 짝이 없는 답변은 제외
+    while start < len(messages) - 1 and start > pinned_end and messages[start].get("role") == "assistant":
+        start += 1
+    window = messages[:pinned_end] + messages[start:]
+    return window, len(messages) - len(window)
+
+
+def render_chat_message(message: Dict[str, Any]) -> Optional[str]:
+    """메시지 하나의 ChatML 세그먼트 (지원하지 않는 role은 None)"""
+    role = message.get("role", "user")
+    if role not in ("system", "user", "assistant"):
+        return None
+    return f"<|im_start|>{role}\n{message.get('content', '')}<|im_end|>"
+
+
+@traced("prompt.format")
+def format_chat_prompt(messages: List[Dict[str, Any]], token_budget: Optional[int] = None) -> str:
+    if token_budget is not None:
+        messages, _ = window_messages(messages, token_budget)
+    parts = [segment for segment in map(render_chat_message, messages) if segment is not None]
+    parts.append(CHATML_ASSISTANT_START)
     return "\n".join(parts)
 
 
+@traced("prompt.format")
 def format_vision_prompt(message: str, json_only: bool = False) -> str:
     system_prompt = """이미지를 분석하고 사용자의 질문에 답해주세요. 
 이미지의 내용을 정확하게 인식하고 상세히 설명해주세요.
@@ -122,6 +200,7 @@ def format_vision_prompt(message: str, json_only: bool = False) -> str:
     return "\n".join(parts)
 
 
+@traced("prompt.format")
 def format_multi_vision_prompt(message: str, image_count: int, json_only: bool = False) -> str:
     system_prompt = """여러 이미지를 순서대로 분석하고 사용자의 질문에 답해주세요.
 각 이미지에 대해 관찰한 내용을 명시하고, 필요한 경우 비교하거나 종합하세요.
@@ -0,0 +1,141 @@
+"""
+실행 중인 워커의 온디맨드 프로파일링 (관리자용, 기본 비활성)
+- sample: 모든 스레드(이벤트 루프 + 워커 스레드)의 스택을 주기적으로 샘플링 → collapsed stack (flamegraph 입력 형식)
+- pstats: 이벤트 루프 스레드에 cProfile을 N초 동안 걸고 누적 시간 순 pstats 텍스트
+- memory: tracemalloc 스냅샷 차이 (구간 동안 늘어난 할당 상위 항목)
+- 실행 중이 아닐 때는 아무 훅도 걸려 있지 않음
+"""
+
+import io
+import os
+import hmac
+import sys
+import time
+import asyncio
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, Optional
+
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0").lower() in ("1", "true", "yes")
+# 요청 헤더 X-Admin-Token과 비교 (설정하지 않으면 활성화해도 모든 요청 거부)
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", "60"))
+PROFILING_TOP_N = int(os.getenv("PROFILING_TOP_N", "40"))
+
+
+def _frame_label(frame: Any) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """sys._current_frames() 기반 샘플링 프로파일러 (별도 스레드에서 run 호출)"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = max(0.001, interval)
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+    def run(self, seconds: float) -> None:
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def collapsed(self) -> str:
+        """flamegraph.pl / speedscope 입력용 collapsed stack 텍스트"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+def _memory_diff(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, top_n: int) -> str:
+    lines = [f"# tracemalloc diff (top {top_n}, lineno)"]
+    for stat in after.compare_to(before, "lineno")[:top_n]:
+        lines.append(str(stat))
+    return "\n".join(lines)
+
+
+class Profiler:
+    """한 번에 하나의 프로파일만 실행"""
+
+    def __init__(self, enabled: bool = PROFILING_ENABLED, token: str = PROFILING_TOKEN):
+        self.enabled = enabled
+        self.token = token
+        self._lock = asyncio.Lock()
+        self.runs = 0
+
+    def authorized(self, token: Optional[str]) -> bool:
+        # 토큰이 설정되지 않았으면 항상 거부
+        return bool(self.token) and hmac.compare_digest((token or "").encode(), self.token.encode())
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(
+        self,
+        seconds: float,
+        mode: str = "sample",
+        interval_ms: float = 10.0,
+        memory: bool = False,
+        top_n: int = PROFILING_TOP_N,
+    ) -> str:
+        """프로파일 결과 텍스트 반환. mode: sample | pstats"""
+        if mode not in ("sample", "pstats"):
+            raise ValueError(f"지원하지 않는 mode: {mode}")
+        seconds = min(max(0.1, seconds), PROFILING_MAX_SECONDS)
+        async with self._lock:
+            self.runs += 1
+            started_tracemalloc = False
+            before: Optional[tracemalloc.Snapshot] = None
+            if memory:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    started_tracemalloc = True
+                before = tracemalloc.take_snapshot()
+            try:
+                if mode == "sample":
+                    sampler = StackSampler(interval_ms / 1000)
+                    await asyncio.to_thread(sampler.run, seconds)
+                    header = f"# sampled {sampler.samples} times over {seconds:.1f}s (interval {interval_ms}ms), collapsed stacks"
+                    report = f"{header}\n{sampler.collapsed()}"
+                else:
+                    # 이벤트 루프 스레드에서 실행되는 모든 코루틴/콜백이 대상
+                    profile = cProfile.Profile()
+                    profile.enable()
+                    try:
+                        await asyncio.sleep(seconds)
+                    finally:
+                        profile.disable()
+                    out = io.StringIO()
+                    pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(top_n)
+                    report = f"# cProfile (event loop thread) over {seconds:.1f}s\n{out.getvalue()}"
+                if before is not None:
+                    report += "\n\n" + _memory_diff(before, tracemalloc.take_snapshot(), top_n)
+                return report
+            finally:
+                if started_tracemalloc:
+                    tracemalloc.stop()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "busy": self.busy, "runs": self.runs}
+
+
+# 전역 프로파일러 인스턴스
+profiler = Profiler()
@@ -0,0 +1,215 @@
+"""
+대화별 증분 프롬프트 구성
+- 이미 렌더링한 ChatML 프리픽스와 토큰 합계를 대화별로 보관
+- 새 턴은 추가된 메시지 세그먼트만 렌더링해서 이어 붙임
+- 저장소에서 히스토리가 교체/삭제되거나 렌더링된 메시지가 잘리면 프리픽스 무효화, 윈도우 밖 메시지만 잘리면 인덱스만 다시 맞춤
+- 예산 초과 시 윈도우를 여유 있게 한 번에 당겨, 이후 턴에도 같은 프리픽스 유지 (vLLM prefix cache 적중)
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from .conversation_store import BaseConversationStore, conversation_store
+from .models import (
+    CHATML_ASSISTANT_START,
+    message_tokens,
+    render_chat_message,
+    window_messages,
+)
+from .utils import estimate_tokens
+from .tracing import traced
+
+
+PROMPT_PREFIX_CACHE_SIZE = int(os.getenv("PROMPT_PREFIX_CACHE_SIZE", "256"))
+# 윈도우를 다시 자를 때 예산의 이 비율까지만 채움 (남은 여유만큼 윈도우 시작점이 고정됨)
+PROMPT_WINDOW_REFILL_RATIO = float(os.getenv("PROMPT_WINDOW_REFILL_RATIO", "0.75"))
+
+
+@dataclass
+class _PromptPrefix:
+    # 렌더링된 메시지 세그먼트 ("\n" 구분, 끝의 assistant 시작 태그 제외)
+    rendered: str
+    # 렌더링에 포함된 저장소 메시지 수
+    message_count: int
+    # 메시지 토큰 합계 (ChatML 오버헤드 포함)
+    tokens: int
+    # 윈도우 밖으로 제외된 저장소 메시지 수
+    dropped: int = 0
+    # 제외 구간 앞에 고정된 저장소 메시지 수
+    # (렌더링 = 메시지[:pinned] + 메시지[pinned + dropped:message_count])
+    pinned: int = 0
+
+
+class PromptPrefixCache:
+    """conversation_id → 렌더링된 프롬프트 프리픽스 (LRU)"""
+
+    def __init__(
+        self,
+        store: BaseConversationStore,
+        max_items: int = PROMPT_PREFIX_CACHE_SIZE,
+        refill_ratio: float = PROMPT_WINDOW_REFILL_RATIO,
+    ):
+        self.store = store
+        self.max_items = max(1, max_items)
+        self.refill_ratio = min(1.0, max(0.1, refill_ratio))
+        self._lock = threading.Lock()
+        self._prefixes: "OrderedDict[str, _PromptPrefix]" = OrderedDict()
+        # 대화별 세대 (읽는 도중 바뀐 대화의 프리픽스를 저장하지 않기 위함)
+        # 밀려난 대화는 _epoch_floor 세대로 취급
+        self._epochs: "OrderedDict[str, int]" = OrderedDict()
+        self._next_epoch = 0
+        self._epoch_floor = 0
+        self.stats: Dict[str, int] = {
+            "hits": 0,
+            "rebuilds": 0,
+            "invalidations": 0,
+            "rekeyed": 0,
+            "windowed": 0,
+            "messages_rendered": 0,
+        }
+        store.add_invalidation_listener(self.invalidate)
+        store.add_trim_listener(self.trimmed)
+
+    def invalidate(self, conversation_id: Optional[str]) -> None:
+        with self._lock:
+            self._bump_epoch_locked(conversation_id)
+            if conversation_id is None:
+                self._prefixes.clear()
+            elif self._prefixes.pop(conversation_id, None) is None:
+                return
+            self.stats["invalidations"] += 1
+
+    def trimmed(self, conversation_id: str, count: int) -> None:
+        """저장소가 가장 오래된 메시지 count개를 잘라냄
+
+        잘린 메시지가 모두 윈도우 밖(제외 구간)이었으면 렌더링은 그대로 두고 저장소 인덱스만
+        당기고, 렌더링된 메시지(고정된 첫 턴 등)가 잘렸으면 프리픽스를 무효화합니다.
+        그 사이 읽던 같은 대화의 빌드는 저장하지 않습니다.
+        """
+        with self._lock:
+            self._bump_epoch_locked(conversation_id)
+            prefix = self._prefixes.get(conversation_id)
+            if prefix is None:
+                return
+            if prefix.pinned > 0 or count > prefix.dropped:
+                del self._prefixes[conversation_id]
+                self.stats["invalidations"] += 1
+                return
+            prefix.message_count -= count
+            prefix.dropped -= count
+            self.stats["rekeyed"] += 1
+
+    @traced("prompt.build")
+    def build(self, conversation_id: str, message: str, token_budget: int) -> Tuple[str, int, int]:
+        """저장된 히스토리 + 새 user 메시지로 프롬프트 구성
+
+        (프롬프트, 사용한 메시지 수, 제외된 메시지 수)를 반환합니다.
+        예산을 넘으면 예산의 refill_ratio까지만 채운 윈도우로 다시 렌더링해 캐시하므로,
+        매 턴 윈도우 시작점이 움직이지 않고 프리픽스가 여러 턴 동안 유지됩니다.
+        """
+        new_message = {"role": "user", "content": message, "tokens": estimate_tokens(message)}
+        new_tokens = message_tokens(new_message)
+        with self._lock:
+            epoch = self._epoch_locked(conversation_id)
+        prefix = self._current_prefix(conversation_id)
+        if prefix.tokens + new_tokens > token_budget:
+            self.stats["windowed"] += 1
+            prefix = self._rewindow(conversation_id, new_message, int(token_budget * self.refill_ratio), epoch)
+        segment = render_chat_message(new_message)
+        head = f"{prefix.rendered}\n" if prefix.rendered else ""
+        used = prefix.message_count - prefix.dropped + 1
+        return f"{head}{segment}\n{CHATML_ASSISTANT_START}", used, prefix.dropped
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"cached_prefixes": len(self._prefixes), **self.stats}
+
+    # ===== 내부 구현 =====
+    def _current_prefix(self, conversation_id: str) -> _PromptPrefix:
+        with self._lock:
+            epoch = self._epoch_locked(conversation_id)
+            prefix = self._prefixes.get(conversation_id)
+            if prefix is not None:
+                self._prefixes.move_to_end(conversation_id)
+
+        if prefix is not None:
+            added = self.store.get_messages_since(conversation_id, prefix.message_count)
+            if added is None:
+                # 대화가 만료/삭제됨
+                self.invalidate(conversation_id)
+                return _PromptPrefix("", 0, 0)
+            if not added:
+                self.stats["hits"] += 1
+                return prefix
+            self.stats["hits"] += 1
+            prefix = self._extend(prefix, added)
+        else:
+            messages = self.store.get_messages(conversation_id)
+            if not messages:
+                return _PromptPrefix("", 0, 0)
+            self.stats["rebuilds"] += 1
+            prefix = self._extend(_PromptPrefix("", 0, 0), messages)
+
+        if not self._store_prefix(conversation_id, prefix, epoch):
+            # 읽는 도중 이 대화의 히스토리가 잘림/교체됨 → 현재 히스토리로 다시 렌더링 (캐시하지 않음)
+            self.stats["rebuilds"] += 1
+            return self._extend(_PromptPrefix("", 0, 0), self.store.get_messages(conversation_id) or [])
+        return prefix
+
+    def _rewindow(self, conversation_id: str, new_message: Dict[str, Any], target: int, epoch: int) -> _PromptPrefix:
+        messages = self.store.get_messages(conversation_id) or []
+        window, dropped = window_messages(messages + [new_message], target)
+        # 윈도우에서 새 메시지를 뺀 부분이 다음 턴들이 이어 붙일 프리픽스
+        prefix = self._extend(_PromptPrefix("", 0, 0), window[:-1])
+        prefix.message_count = len(messages)
+        prefix.dropped = dropped
+        if dropped:
+            # 제외 구간 앞에서 저장소 순서 그대로 유지된 메시지 수
+            prefix.pinned = next(i for i, m in enumerate(window) if m is not messages[i])
+        self._store_prefix(conversation_id, prefix, epoch)
+        return prefix
+
+    def _store_prefix(self, conversation_id: str, prefix: _PromptPrefix, epoch: int) -> bool:
+        with self._lock:
+            if self._epoch_locked(conversation_id) != epoch:
+                return False
+            self._prefixes[conversation_id] = prefix
+            self._prefixes.move_to_end(conversation_id)
+            while len(self._prefixes) > self.max_items:
+                self._prefixes.popitem(last=False)
+            return True
+
+    def _epoch_locked(self, conversation_id: str) -> int:
+        return self._epochs.get(conversation_id, self._epoch_floor)
+
+    def _bump_epoch_locked(self, conversation_id: Optional[str]) -> None:
+        self._next_epoch += 1
+        if conversation_id is None:
+            self._epochs.clear()
+            self._epoch_floor = self._next_epoch
+            return
+        self._epochs[conversation_id] = self._next_epoch
+        self._epochs.move_to_end(conversation_id)
+        while len(self._epochs) > self.max_items * 4:
+            _, evicted = self._epochs.popitem(last=False)
+            self._epoch_floor = max(self._epoch_floor, evicted)
+
+    def _extend(self, prefix: _PromptPrefix, messages: list) -> _PromptPrefix:
+        segments = [segment for segment in map(render_chat_message, messages) if segment is not None]
+        if prefix.rendered:
+            segments.insert(0, prefix.rendered)
+        self.stats["messages_rendered"] += len(messages)
+        return _PromptPrefix(
+            rendered="\n".join(segments),
+            message_count=prefix.message_count + len(messages),
+            tokens=prefix.tokens + sum(message_tokens(m) for m in messages),
+            dropped=prefix.dropped,
+            pinned=prefix.pinned,
+        )
+
+
+# 전역 프롬프트 프리픽스 캐시 인스턴스
+prompt_prefix_cache = PromptPrefixCache(conversation_store)
@@ -0,0 +1,211 @@
+"""
+오래된 대화 턴 백그라운드 요약
+- 대화 토큰 수가 임계값을 넘으면 요약 작업을 대기열에 등록
+- 엔진에 여유가 있을 때만 (진행 중 요청 수 기준) 낮은 우선순위로 실행
+- 가장 오래된 턴들을 하나의 요약 system 메시지로 교체 → 이후 프롬프트는 요약을 사용
+"""
+
+import os
+import time
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+
+from . import engine
+from .conversation_store import Message, conversation_store
+from .file_io import trim_to_tokens
+from .models import format_chat_prompt, message_tokens
+from .utils import estimate_tokens
+from .usage_ledger import INTERNAL, usage_ledger
+from .logger_config import app_logger as logger
+
+
+CONVERSATION_SUMMARY_ENABLED = os.getenv("CONVERSATION_SUMMARY", "0").lower() in ("1", "true", "yes")
+# 대화 전체 토큰이 이 값을 넘으면 요약 예약
+CONVERSATION_SUMMARY_TRIGGER_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TRIGGER_TOKENS", "3000"))
+# 요약하지 않고 원문으로 남길 최근 메시지 수
+CONVERSATION_SUMMARY_KEEP_RECENT = int(os.getenv("CONVERSATION_SUMMARY_KEEP_RECENT", "6"))
+CONVERSATION_SUMMARY_MAX_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_MAX_TOKENS", "256"))
+# 진행 중인 엔진 요청이 이 수 이하일 때만 요약 실행
+CONVERSATION_SUMMARY_MAX_ACTIVE = int(os.getenv("CONVERSATION_SUMMARY_MAX_ACTIVE", "0"))
+CONVERSATION_SUMMARY_POLL_SECONDS = float(os.getenv("CONVERSATION_SUMMARY_POLL_SECONDS", "0.5"))
+CONVERSATION_SUMMARY_QUEUE_SIZE = int(os.getenv("CONVERSATION_SUMMARY_QUEUE_SIZE", "256"))
+
+SUMMARY_PREFIX = "[이전 대화 요약]\n"
+
+
+def _summary_prompt(messages: List[Dict[str, Any]], max_tokens: int) -> str:
+    lines = []
+    for m in messages:
+        if m.get("summary"):
+            lines.append(f"(앞선 요약)\n{m.get('content', '')[len(SUMMARY_PREFIX):]}")
+        else:
+            speaker = "사용자" if m.get("role") == "user" else "어시스턴트"
+            lines.append(f"{speaker}: {m.get('content', '')}")
+    # 요약 입력이 컨텍스트를 넘지 않도록 자름
+    max_model_len = int(engine.engine_config.get("max_model_len") or os.getenv("VLLM_MAX_MODEL_LEN", "8192"))
+    transcript = trim_to_tokens("\n\n".join(lines), max(256, max_model_len - max_tokens - 256))
+    content = (
+        f"다음은 사용자와 어시스턴트의 이전 대화입니다.\n\n{transcript}\n\n"
+        "이후 대화를 이어가는 데 필요한 사실, 사용자의 요청과 선호, 결정된 사항을 빠짐없이 간결하게 요약해주세요."
+    )
+    return format_chat_prompt([{"role": "user", "content": content}])
+
+
+class ConversationSummarizer:
+    """대화 요약 작업 대기열 + 단일 백그라운드 워커"""
+
+    def __init__(
+        self,
+        enabled: bool = CONVERSATION_SUMMARY_ENABLED,
+        trigger_tokens: int = CONVERSATION_SUMMARY_TRIGGER_TOKENS,
+        keep_recent: int = CONVERSATION_SUMMARY_KEEP_RECENT,
+        max_tokens: int = CONVERSATION_SUMMARY_MAX_TOKENS,
+        max_active: int = CONVERSATION_SUMMARY_MAX_ACTIVE,
+        poll_seconds: float = CONVERSATION_SUMMARY_POLL_SECONDS,
+        queue_size: int = CONVERSATION_SUMMARY_QUEUE_SIZE,
+    ):
+        self.enabled = enabled
+        self.trigger_tokens = trigger_tokens
+        self.keep_recent = max(2, keep_recent)
+        self.max_tokens = max_tokens
+        self.max_active = max_active
+        self.poll_seconds = poll_seconds
+        self.queue_size = queue_size
+        self._queue: Optional["asyncio.Queue[str]"] = None
+        self._queued: Set[str] = set()
+        self._worker: Optional[asyncio.Task] = None
+        self.stats: Dict[str, Any] = {
+            "scheduled": 0,
+            "completed": 0,
+            "skipped": 0,
+            "failed": 0,
+            "dropped": 0,
+            "messages_summarized": 0,
+            "tokens_saved": 0,
+            "deferred_ms": 0.0,
+        }
+
+    async def start(self) -> None:
+        if self.enabled and self._worker is None:
+            self._queue = asyncio.Queue(maxsize=max(1, self.queue_size))
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def aclose(self) -> None:
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        self._queue = None
+        self._queued.clear()
+
+    async def maybe_schedule(self, conversation_id: str, messages: Optional[List[Dict[str, Any]]] = None) -> bool:
+        """대화가 임계값을 넘었으면 요약 작업 등록. 등록했으면 True"""
+        if self._queue is None or conversation_id in self._queued:
+            return False
+        if messages is None:
+            messages = await conversation_store.offload(conversation_store.get_messages, conversation_id) or []
+        if self._split_point(messages) == 0:
+            return False
+        if sum(message_tokens(m) for m in messages) <= self.trigger_tokens:
+            return False
+        try:
+            self._queue.put_nowait(conversation_id)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            return False
+        self._queued.add(conversation_id)
+        self.stats["scheduled"] += 1
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queued": len(self._queued),
+            "trigger_tokens": self.trigger_tokens,
+            **{k: (round(v, 1) if isinstance(v, float) else v) for k, v in self.stats.items()},
+        }
+
+    # ===== 내부 구현 =====
+    def _split_point(self, messages: List[Dict[str, Any]]) -> int:
+        """요약할 앞쪽 메시지 수 (최근 keep_recent개는 원문 유지, user 메시지에서 시작하도록 정렬)"""
+        cut = len(messages) - self.keep_recent
+        while 0 < cut < len(messages) and messages[cut].get("role") != "user":
+            cut += 1
+        if cut <= 0 or cut >= len(messages):
+            return 0
+        # 기존 요약 하나만 남는 경우는 다시 요약할 필요 없음
+        if cut == 1 and messages[0].get("summary"):
+            return 0
+        return cut
+
+    async def _wait_for_capacity(self) -> None:
+        t0 = time.time()
+        while engine.vllm_engine is None or engine.active_requests > self.max_active:
+            await asyncio.sleep(self.poll_seconds)
+        self.stats["deferred_ms"] += (time.time() - t0) * 1000
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        usage_ledger.run_as(INTERNAL)
+        while True:
+            conversation_id = await self._queue.get()
+            try:
+                await self._wait_for_capacity()
+                await self._summarize(conversation_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.warning(f"⚠️ 대화 요약 실패 ({conversation_id}): {e}")
+            finally:
+                self._queued.discard(conversation_id)
+                self._queue.task_done()
+
+    async def _summarize(self, conversation_id: str) -> None:
+        messages = await asyncio.to_thread(conversation_store.get_messages, conversation_id)
+        cut = self._split_point(messages or [])
+        if not messages or cut == 0:
+            self.stats["skipped"] += 1
+            return
+        head = messages[:cut]
+        summary_text, _ = await engine.generate_with_vllm(
+            prompt=_summary_prompt(head, self.max_tokens),
+            max_tokens=self.max_tokens,
+            temperature=0.3,
+            request_id=f"summary-{conversation_id[:8]}",
+        )
+        summary_text = summary_text.strip()
+        if not summary_text:
+            self.stats["skipped"] += 1
+            return
+        content = SUMMARY_PREFIX + summary_text
+        summary_message = Message(
+            "system",
+            content,
+            created_at=head[-1].created_at,
+            tokens=estimate_tokens(content),
+            extra={
+                "summary": True,
+                "summarized_messages": cut + sum(int(m.get("summarized_messages", 0)) - 1 for m in head if m.get("summary")),
+            },
+        )
+        replaced = await asyncio.to_thread(
+            conversation_store.replace_head, conversation_id, cut, head[0], [summary_message]
+        )
+        if not replaced:
+            # 요약 중 대화가 잘리거나 삭제됨
+            self.stats["skipped"] += 1
+            return
+        saved = sum(message_tokens(m) for m in head) - message_tokens(summary_message)
+        self.stats["completed"] += 1
+        self.stats["messages_summarized"] += cut
+        self.stats["tokens_saved"] += max(0, saved)
+        logger.info(f"📝 대화 {conversation_id} 앞쪽 메시지 {cut}개를 요약으로 교체 (약 {saved} 토큰 절약)")
+
+
+# 전역 요약기 인스턴스
+conversation_summarizer = ConversationSummarizer()
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from .admission import AdmissionController, QueueTimeout
+
+
+def _controller(**kwargs):
+    kwargs.setdefault("weights", {})
+    kwargs.setdefault("requests_per_second", 0)
+    kwargs.setdefault("tokens_per_second", 0)
+    return AdmissionController(**kwargs)
+
+
+def test_finish_tag_is_restored_after_queue_timeout():
+    controller = _controller(capacity=1, queue_timeout=0.05)
+
+    async def run():
+        async with controller.admit(100):
+            tenant = controller._tenants["anonymous"]
+            before = tenant.last_finish
+            with pytest.raises(QueueTimeout):
+                async with controller.admit(100):
+                    pass
+            assert tenant.last_finish == before
+            assert tenant.queued == 0
+        return tenant
+
+    tenant = asyncio.run(run())
+    assert tenant.running == 0
+    assert controller.stats["timeouts"] == 1
+
+
+def test_cancelled_waiter_does_not_push_back_its_tenant():
+    controller = _controller(capacity=1)
+
+    async def run():
+        async with controller.admit(100):
+            tenant = controller._tenants["anonymous"]
+            before = tenant.last_finish
+
+            async def wait():
+                async with controller.admit(100):
+                    pass
+
+            task = asyncio.ensure_future(wait())
+            await asyncio.sleep(0)
+            assert tenant.queued == 1
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert tenant.last_finish == before
+        assert controller._running == 0
+
+    asyncio.run(run())
+
+
+def test_settle_refunds_tokens_when_generation_fails(monkeypatch):
+    pytest.importorskip("torch")
+    pytest.importorskip("vllm")
+    from . import engine
+
+    controller = _controller(capacity=1, tokens_per_second=1)
+    monkeypatch.setattr(engine, "admission_controller", controller)
+
+    async def failing_generate(*args):
+        raise RuntimeError("engine error")
+
+    monkeypatch.setattr(engine, "_generate_with_vllm", failing_generate)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(engine.generate_with_vllm("hello", max_tokens=64))
+    bucket = controller._tenants["anonymous"].tokens
+    assert bucket.full
+    assert controller._running == 0
+
+
+def test_kv_blocks_limit_concurrent_generations():
+    controller = _controller(capacity=8, kv_blocks=10)
+    controller.configure({"block_size": 16, "max_model_len": 4096})
+    order = []
+
+    async def generation(name, tokens, hold):
+        async with controller.admit(tokens) as ticket:
+            order.append((name, ticket.cost, controller._blocks_in_use))
+            await hold.wait()
+
+    async def run():
+        first, second, third = asyncio.Event(), asyncio.Event(), asyncio.Event()
+        tasks = [
+            asyncio.ensure_future(generation("a", 100, first)),
+            asyncio.ensure_future(generation("b", 100, second)),
+            asyncio.ensure_future(generation("c", 20, third)),
+        ]
+        await asyncio.sleep(0.01)
+        # a가 7블록을 잡고 있어 b(7블록)는 대기, 뒤에 온 c도 앞지르지 않음
+        assert [name for name, _, _ in order] == ["a"]
+        assert controller.get_stats()["queued"] == 2
+        first.set()
+        await asyncio.sleep(0.01)
+        assert [name for name, _, _ in order] == ["a", "b", "c"]
+        second.set()
+        third.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    # a 반납 후 b(7)와 c(2)가 함께 10블록 안에 들어감
+    assert order == [("a", 7, 7), ("b", 7, 9), ("c", 2, 9)]
+    assert controller._blocks_in_use == 0
+
+
+def test_oversized_generation_runs_alone():
+    controller = _controller(capacity=8, kv_blocks=4)
+    controller.configure({"block_size": 16, "max_model_len": 4096})
+
+    async def run():
+        async with controller.admit(1000) as ticket:
+            assert ticket.cost == 63
+            assert controller._running == 1
+
+    asyncio.run(run())
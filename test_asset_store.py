@@ -0,0 +1,69 @@
+import asyncio
+import os
+import threading
+import time
+
+from PIL import Image
+
+from .asset_store import ImageAssetStore
+
+
+def _image(shade):
+    return Image.new("RGB", (64, 48), (shade, shade, shade))
+
+
+def _age(store, image_id, seconds):
+    path = store._path(image_id)
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_promoted_asset_is_not_purged_after_respill(tmp_path):
+    store = ImageAssetStore(directory=str(tmp_path), ttl_seconds=60, max_items=1)
+    first = store.put(_image(10))
+    store.put(_image(20))  # first → 디스크로 스필
+    assert store._path(first).exists()
+
+    _age(store, first, 50)
+    assert store.get(first) is not None  # 디스크 → 메모리 승격
+    _age(store, first, 50)
+    store.put(_image(30))  # 메모리에서 다시 밀려남 (파일은 이미 있음)
+
+    store.purge_expired()
+    # 최근에 쓴 에셋이므로 파일이 만료 시각을 넘기지 않음
+    assert time.time() - store._path(first).stat().st_mtime < 5
+    assert store.get(first) is not None
+    assert store.stats["expired"] == 0
+
+
+def test_expired_spill_is_purged(tmp_path):
+    store = ImageAssetStore(directory=str(tmp_path), ttl_seconds=60, max_items=1)
+    first = store.put(_image(10))
+    store.put(_image(20))
+    _age(store, first, 120)
+
+    assert store.purge_expired() == 1
+    assert store.get(first) is None
+
+
+def test_async_api_runs_off_the_event_loop(tmp_path, monkeypatch):
+    store = ImageAssetStore(directory=str(tmp_path), max_items=1)
+    threads = []
+    compute_image_id = ImageAssetStore.compute_image_id
+
+    def record(image):
+        threads.append(threading.get_ident())
+        return compute_image_id(image)
+
+    monkeypatch.setattr(store, "compute_image_id", record)
+
+    async def run():
+        image_id = await store.put_async(_image(10))
+        await store.put_async(_image(20))
+        return image_id, await store.load_images_async([image_id])
+
+    image_id, images = asyncio.run(run())
+    assert images[0].size == (64, 48)
+    assert store.stats["disk_hits"] == 1
+    assert threads and threading.get_ident() not in threads
+    assert asyncio.run(store.delete_async(image_id))
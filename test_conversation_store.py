@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+import pytest
+
+from .conversation_store import Message, SQLiteConversationStore
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """같은 DB 파일을 여는 두 워커"""
+    path = str(tmp_path / "conversations.sqlite3")
+    stores = [SQLiteConversationStore(path=path, ttl_seconds=0, max_messages=6) for _ in range(2)]
+    yield stores
+    for store in stores:
+        asyncio.run(store.aclose())
+
+
+def _contents(messages):
+    return [m.content for m in messages or []]
+
+
+def test_cached_history_sees_turns_written_by_other_worker(workers):
+    a, b = workers
+    a.append("c1", Message("user", "q1"))
+    a.append("c1", Message("assistant", "a1"))
+    assert _contents(a.get_messages("c1")) == ["q1", "a1"]
+
+    b.append("c1", Message("user", "q2"))
+    b.append("c1", Message("assistant", "a2"))
+
+    assert _contents(a.get_messages("c1")) == ["q1", "a1", "q2", "a2"]
+    assert a.message_count("c1") == 4
+    assert a.stats["cache_stale"] == 1
+
+
+def test_own_writes_keep_cache_fresh(workers):
+    a, _ = workers
+    a.append("c1", Message("user", "q1"))
+    a.get_messages("c1")
+    a.append("c1", Message("assistant", "a1"))
+
+    assert _contents(a.get_messages("c1")) == ["q1", "a1"]
+    assert a.stats["cache_stale"] == 0
+    assert a.stats["cache_hits"] == 1
+
+
+def test_trim_and_delete_by_other_worker(workers):
+    a, b = workers
+    for i in range(3):
+        a.append("c1", Message("user", f"q{i}"))
+        a.append("c1", Message("assistant", f"a{i}"))
+    invalidated = []
+    a.add_invalidation_listener(invalidated.append)
+    assert len(a.get_messages("c1")) == 6
+
+    # b의 쓰기로 DB에서 앞쪽 q0/a0이 잘림
+    b.append("c1", Message("user", "q3"))
+    assert _contents(a.get_messages("c1")) == ["q1", "a1", "q2", "a2", "q3"]
+    assert invalidated == ["c1"]
+
+    assert b.delete("c1")
+    assert a.get_messages("c1") is None
+    assert not a.exists("c1")
+
+
+def test_len_is_served_from_counter(workers):
+    a, b = workers
+    a.append("c1", Message("user", "q1"))
+    a.append("c2", Message("user", "q1"))
+    assert len(a) == 2
+
+    b.append("c3", Message("user", "q1"))
+    # 다른 워커의 변경은 스위퍼가 DB 기준으로 다시 맞춤
+    assert len(a) == 2
+    a.purge_expired()
+    assert len(a) == 3
+    a.delete("c1")
+    assert len(a) == 2
+
+
+def test_offload_runs_sqlite_reads_off_the_event_loop(workers):
+    a, _ = workers
+    a.append("c1", Message("user", "q1"))
+    threads = []
+
+    def read(conversation_id):
+        threads.append(threading.get_ident())
+        return a.get_messages(conversation_id)
+
+    messages = asyncio.run(a.offload(read, "c1"))
+    assert _contents(messages) == ["q1"]
+    assert threads and threads[0] != threading.get_ident()
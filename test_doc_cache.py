@@ -0,0 +1,102 @@
+import asyncio
+
+from .doc_cache import DocumentCache
+from .utils import estimate_tokens
+
+
+DOCUMENT = ("문단 내용입니다. " * 40 + "\n\n") * 20
+
+
+def _cache(tmp_path, **kwargs):
+    return DocumentCache(directory=str(tmp_path / "docs"), **kwargs)
+
+
+def test_partial_extraction_is_flagged_and_reextracted_from_source(tmp_path):
+    cache = _cache(tmp_path)
+    budget = estimate_tokens(DOCUMENT) // 4
+
+    async def run():
+        text, document_id, stats = await cache.get_or_extract(DOCUMENT.encode(), "txt", token_budget=budget)
+        assert stats["document_truncated"] is True
+        assert len(text) < len(DOCUMENT)
+
+        # long_document 요청: 전체 텍스트가 필요 → 보관한 원본에서 다시 추출
+        entry, full_text, full_stats = await cache.get_text(document_id, None)
+        assert full_text == DOCUMENT
+        assert entry.complete
+        assert full_stats["document_truncated"] is False
+        assert cache.stats["partial_refreshes"] == 1
+        return document_id
+
+    document_id = asyncio.run(run())
+    # 전체 추출 후에는 원본을 보관하지 않음
+    assert not cache._source_path(document_id).exists()
+
+
+def test_cached_hit_reports_budget_trim(tmp_path):
+    cache = _cache(tmp_path)
+
+    async def run():
+        _, document_id, stats = await cache.get_or_extract(DOCUMENT.encode(), "txt")
+        assert stats["document_truncated"] is False
+        _, text, hit = await cache.get_text(document_id, 50)
+        assert hit["document_cache_hit"] is True
+        assert hit["document_truncated"] is True
+        assert estimate_tokens(text) <= 50
+
+    asyncio.run(run())
+
+
+def test_truncated_entry_without_source_is_flagged(tmp_path):
+    cache = _cache(tmp_path)
+    budget = estimate_tokens(DOCUMENT) // 4
+
+    async def run():
+        _, document_id, _ = await cache.get_or_extract(DOCUMENT.encode(), "txt", token_budget=budget)
+        cache._source_path(document_id).unlink()
+        entry, text, stats = await cache.get_text(document_id, None)
+        assert not entry.complete
+        assert stats["document_truncated"] is True
+        assert len(text) < len(DOCUMENT)
+
+    asyncio.run(run())
+
+
+def test_source_is_removed_with_entry(tmp_path):
+    cache = _cache(tmp_path, max_items=1)
+    budget = estimate_tokens(DOCUMENT) // 4
+
+    async def run():
+        _, document_id, _ = await cache.get_or_extract(DOCUMENT.encode(), "txt", token_budget=budget)
+        # 다른 문서가 들어오면 디스크로 스필되고 원본은 유지
+        await cache.get_or_extract(b"other document", "txt")
+        assert cache._path(document_id).exists()
+        assert cache._source_path(document_id).exists()
+        assert await cache.delete_async(document_id)
+        return document_id
+
+    document_id = asyncio.run(run())
+    assert not cache._source_path(document_id).exists()
+
+
+def test_sources_count_against_disk_budget(tmp_path):
+    source = DOCUMENT.encode()
+    cache = _cache(tmp_path, max_items=1, disk_max_bytes=len(source) * 2 + 4096)
+    budget = estimate_tokens(DOCUMENT) // 4
+
+    async def run():
+        ids = []
+        for i in range(3):
+            content = source + f"#{i}".encode()
+            _, document_id, _ = await cache.get_or_extract(content, "txt", token_budget=budget)
+            ids.append(document_id)
+        return ids
+
+    ids = asyncio.run(run())
+    stats = cache.get_stats()
+    assert stats["disk_bytes"] + stats["source_bytes"] <= cache.disk_max_bytes
+    on_disk = sum(p.stat().st_size for p in (tmp_path / "docs").iterdir())
+    assert on_disk == stats["disk_bytes"] + stats["source_bytes"]
+    # 가장 오래된 항목은 원본과 함께 제거
+    assert not cache._source_path(ids[0]).exists()
+    assert cache._source_path(ids[2]).exists()
@@ -0,0 +1,182 @@
+import asyncio
+import io
+import os
+import tempfile
+
+import pytest
+
+from PIL import Image
+
+from . import file_io
+from .file_io import PAGE_BREAK, compact_document_text
+from .utils import estimate_tokens
+
+
+DOCX_TEXT = """분기 실적 보고
+
+매출 요약
+지역
+2023
+2024
+서울
+120
+135
+
+비고: 전년 대비 증가"""
+
+CSV_TEXT = "name,qty\napple,12\npear,7\n2024\n"
+
+
+def test_docx_text_keeps_lines_and_numbers():
+    compacted, stats = compact_document_text(DOCX_TEXT)
+    assert compacted == DOCX_TEXT
+    assert stats["compaction_lines_removed"] == 0
+
+
+def test_txt_rows_are_not_merged():
+    compacted, _ = compact_document_text(CSV_TEXT)
+    assert compacted == CSV_TEXT.strip()
+
+
+def test_pdf_page_numbers_only_at_page_edges():
+    pages = [
+        "Annual Report\nrevenue grew in\n2024\nacross regions.\n1",
+        "Annual Report\nTable\n42\n7\n2",
+        "Annual Report\nclosing notes.\n- 3 -",
+    ]
+    compacted, stats = compact_document_text(PAGE_BREAK.join(pages), pdf_text=True)
+    out_pages = compacted.split(PAGE_BREAK)
+    assert out_pages[0] == "revenue grew in 2024 across regions."
+    # 페이지 가운데의 숫자 셀은 유지, 마지막 줄의 페이지 번호만 제거
+    assert out_pages[1] == "Table 42 7"
+    assert out_pages[2] == "closing notes."
+    # 머리말 3줄 + 페이지 번호 3줄
+    assert stats["compaction_lines_removed"] == 6
+
+
+def test_pdf_hyphenated_lines_are_joined():
+    compacted, _ = compact_document_text("an exam-\nple sentence.\nNext line.", pdf_text=True)
+    assert compacted == "an example sentence.\nNext line."
+
+
+def test_render_reports_pages_that_actually_rendered(monkeypatch):
+    def fake_render(file_content, page_number, max_side):
+        if page_number == 3:
+            raise RuntimeError("broken page")
+        buf = io.BytesIO()
+        Image.new("RGB", (100 * page_number, 40), "white").save(buf, format="PNG")
+        return buf.getvalue()
+
+    monkeypatch.setattr(file_io, "PDF_RENDER_AVAILABLE", True)
+    monkeypatch.setattr(file_io, "_get_extract_pool", lambda: None)
+    monkeypatch.setattr(file_io, "_render_pdf_page", fake_render)
+
+    images, pages, stats = asyncio.run(file_io.render_pdf_pages_async(b"%PDF", [2, 3, 5]))
+    assert pages == [2, 5]
+    assert [img.width for img in images] == [200, 500]
+    assert stats["pdf_render_failed_pages"] == 1
+
+
+def _upload(data, max_size):
+    from starlette.datastructures import UploadFile
+
+    spool = tempfile.SpooledTemporaryFile(max_size=max_size)
+    spool.write(data)
+    spool.seek(0)
+    return UploadFile(spool, filename="doc.txt")
+
+
+def test_small_upload_is_read_from_starlette_spool():
+    spooled = asyncio.run(file_io.spool_upload(_upload(b"hello", 1024), 100))
+    assert spooled.source == b"hello"
+    assert spooled.path is None
+
+
+def test_large_upload_moves_to_named_file(monkeypatch):
+    monkeypatch.setattr(file_io, "UPLOAD_READ_CHUNK_BYTES", 64 * 1024)
+    data = os.urandom(file_io.UPLOAD_SPOOL_MAX_MEMORY + 100)
+    spooled = asyncio.run(file_io.spool_upload(_upload(data, 1024), len(data)))
+    try:
+        assert isinstance(spooled.source, str)
+        with file_io.open_file_source(spooled.source) as view:
+            assert view[:] == data
+    finally:
+        path = spooled.path
+        spooled.close()
+    assert not os.path.exists(path)
+
+
+def test_oversized_upload_is_rejected_before_reading():
+    upload = _upload(b"x" * 200, 16)
+    with pytest.raises(file_io.UploadTooLargeError):
+        asyncio.run(file_io.spool_upload(upload, 100))
+    # 크기만 확인하고 내용은 읽지 않음
+    assert upload.file.tell() == 0
+
+
+def _fake_pdf(monkeypatch, pages):
+    monkeypatch.setattr(file_io, "_get_extract_pool", lambda: None)
+    monkeypatch.setattr(file_io, "_count_pdf_pages", lambda content: len(pages))
+    monkeypatch.setattr(file_io, "_extract_pdf_page_range", lambda content, start, end: pages[start:end])
+
+
+PDF_PAGES = ["first page text " * 10, "second page text " * 10, "third page text " * 10]
+
+
+def test_budget_exactly_filled_by_last_page_is_complete(monkeypatch):
+    _fake_pdf(monkeypatch, PDF_PAGES)
+    budget = sum(estimate_tokens(p) for p in PDF_PAGES)
+
+    text, stats = asyncio.run(file_io.extract_text_from_pdf_async(b"%PDF", budget))
+    assert stats["extract_budget_reached"] is False
+    assert stats["pdf_pages_skipped"] == 0
+    assert text == PAGE_BREAK.join(PDF_PAGES).strip()
+
+
+def test_budget_filled_with_pages_left_is_flagged(monkeypatch):
+    _fake_pdf(monkeypatch, PDF_PAGES)
+    budget = estimate_tokens(PDF_PAGES[0])
+
+    text, stats = asyncio.run(file_io.extract_text_from_pdf_async(b"%PDF", budget))
+    assert stats["extract_budget_reached"] is True
+    assert stats["pdf_pages_skipped"] == 2
+    assert text == PDF_PAGES[0].strip()
+
+
+def test_pool_workers_get_one_temp_file_path(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    sources = []
+
+    def fake_extract(content, start, end):
+        assert isinstance(content, str)
+        with open(content, "rb") as f:
+            assert f.read() == b"%PDF bytes"
+        sources.append(content)
+        return PDF_PAGES[start:end]
+
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(file_io, "PDF_PAGES_PER_TASK", 1)
+    monkeypatch.setattr(file_io, "_get_extract_pool", lambda: pool)
+    monkeypatch.setattr(file_io, "_count_pdf_pages", lambda content: len(PDF_PAGES))
+    monkeypatch.setattr(file_io, "_extract_pdf_page_range", fake_extract)
+    try:
+        text, _ = asyncio.run(file_io.extract_text_from_pdf_async(b"%PDF bytes"))
+    finally:
+        pool.shutdown()
+    assert text == PAGE_BREAK.join(PDF_PAGES).strip()
+    # 범위마다 같은 임시 파일 하나를 공유하고, 추출이 끝나면 삭제
+    assert len(sources) == len(PDF_PAGES) and len(set(sources)) == 1
+    assert not os.path.exists(sources[0])
+
+
+def test_body_line_equal_to_header_is_kept():
+    # 한 글자 문자열은 같은 객체로 재사용되므로 가장자리 판정은 인덱스로 해야 함
+    bodies = [
+        [f"{n} intro", f"{n} second", f"{n} third", "A", f"{n} fifth", f"{n} sixth", f"{n} last"]
+        for n in ("alpha", "beta", "gamma")
+    ]
+    pages = ["\n".join(["A"] + body) for body in bodies]
+    compacted, stats = compact_document_text(PAGE_BREAK.join(pages))
+    assert compacted.split(PAGE_BREAK) == ["\n".join(body) for body in bodies]
+    assert stats["compaction_lines_removed"] == 3
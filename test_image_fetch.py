@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from .image_fetch import ImageFetchError, ImageFetchRefused, RemoteImageFetcher
+
+
+PUBLIC_HOSTS = {
+    "images.example.com": ["93.184.216.34"],
+    "cdn.example.com": ["93.184.216.35"],
+    "evil.example.net": ["93.184.216.36"],
+    "metadata.example.net": ["169.254.169.254"],
+    "mixed.example.net": ["93.184.216.37", "10.0.0.5"],
+}
+
+
+async def _resolver(host):
+    return PUBLIC_HOSTS[host]
+
+
+def _handler(request):
+    if request.url.path == "/redirect":
+        return httpx.Response(302, headers={"Location": request.url.params["to"]})
+    return httpx.Response(200, headers={"Content-Type": "image/png"}, content=b"png-bytes")
+
+
+def _fetch(url, allowed_hosts=None, **kwargs):
+    seen = []
+
+    def handler(request):
+        seen.append(request.url.host)
+        return _handler(request)
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        fetcher = RemoteImageFetcher(client=client, allowed_hosts=allowed_hosts or [], resolver=_resolver, **kwargs)
+        try:
+            return await fetcher.fetch(url), fetcher
+        finally:
+            await client.aclose()
+
+    content, fetcher = asyncio.run(run())
+    return content, fetcher, seen
+
+
+def test_redirect_within_allowlist_is_followed():
+    content, _, seen = _fetch(
+        "https://images.example.com/redirect?to=https://cdn.example.com/a.png",
+        allowed_hosts=["images.example.com", "cdn.example.com"],
+    )
+    assert content == b"png-bytes"
+    assert seen == ["images.example.com", "cdn.example.com"]
+
+
+def test_redirect_to_host_outside_allowlist_is_refused():
+    with pytest.raises(ImageFetchRefused):
+        _fetch(
+            "https://images.example.com/redirect?to=https://evil.example.net/a.png",
+            allowed_hosts=["images.example.com"],
+        )
+
+
+@pytest.mark.parametrize(
+    "target",
+    [
+        "http://metadata.example.net/latest/meta-data/",
+        "http://mixed.example.net/a.png",
+        "http://127.0.0.1:8000/a.png",
+        "http://[::ffff:10.1.2.3]/a.png",
+    ],
+)
+def test_redirect_to_internal_address_is_refused_without_allowlist(target):
+    with pytest.raises(ImageFetchRefused):
+        _fetch(f"https://images.example.com/redirect?to={target}")
+
+
+def test_internal_address_is_refused_before_any_request():
+    seen = []
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(lambda r: seen.append(r) or _handler(r)))
+        fetcher = RemoteImageFetcher(client=client, allowed_hosts=[], resolver=_resolver)
+        try:
+            await fetcher.fetch("http://169.254.169.254/latest/meta-data/")
+        finally:
+            await client.aclose()
+
+    with pytest.raises(ImageFetchRefused):
+        asyncio.run(run())
+    assert seen == []
+
+
+def test_redirect_limit():
+    with pytest.raises(ImageFetchError, match="리다이렉트"):
+        _fetch(
+            "https://images.example.com/redirect?to=https://images.example.com/redirect%3Fto%3Dhttps://images.example.com/a.png",
+            max_redirects=1,
+        )
+
+
+def test_rebinding_answer_at_connect_time_is_refused():
+    answers = [["93.184.216.34"], ["127.0.0.1"]]
+
+    async def rebinding(host):
+        # 사전 검사에는 공인 IP, 연결 시점에는 루프백을 돌려주는 DNS
+        return answers.pop(0) if len(answers) > 1 else answers[0]
+
+    async def run():
+        fetcher = RemoteImageFetcher(allowed_hosts=[], resolver=rebinding)
+        try:
+            with pytest.raises(ImageFetchRefused):
+                await fetcher.fetch("http://rebind.example.com/cat.png")
+        finally:
+            await fetcher.aclose()
+        return fetcher
+
+    fetcher = asyncio.run(run())
+    assert fetcher.stats["refused"] == 1
+
+
+def test_connection_uses_validated_address_and_keeps_host_header(monkeypatch):
+    from . import image_fetch
+
+    # 실제 DNS에 없는 이름 → 연결이 검사한 주소로 고정되지 않으면 실패
+    monkeypatch.setattr(image_fetch, "_is_public_ip", lambda address: True)
+    host_headers = []
+
+    async def handle(reader, writer):
+        request = await reader.readuntil(b"\r\n\r\n")
+        for line in request.decode().split("\r\n"):
+            if line.lower().startswith("host:"):
+                host_headers.append(line.split(":", 1)[1].strip())
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: image/png\r\nContent-Length: 3\r\nConnection: close\r\n\r\npng")
+        await writer.drain()
+        writer.close()
+
+    async def resolver(host):
+        return ["127.0.0.1"]
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        fetcher = RemoteImageFetcher(allowed_hosts=[], resolver=resolver)
+        try:
+            return port, await fetcher.fetch(f"http://pinned.invalid:{port}/cat.png")
+        finally:
+            await fetcher.aclose()
+            server.close()
+            await server.wait_closed()
+
+    port, content = asyncio.run(run())
+    assert content == b"png"
+    assert host_headers == [f"pinned.invalid:{port}"]
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("vllm")
+
+from PIL import Image
+
+from . import engine, long_document
+
+
+def _fake_generate(prompts):
+    async def generate(prompt, max_tokens, temperature=0.7, images=None, lora_adapter=None, request_id=""):
+        prompts.append((request_id, prompt, images))
+        return f"answer {request_id}", {"tokens_generated": 1}
+
+    return generate
+
+
+def test_dropped_chunks_are_reported(monkeypatch):
+    prompts = []
+    monkeypatch.setattr(engine, "generate_with_vllm", _fake_generate(prompts))
+    monkeypatch.setattr(long_document, "LONG_DOC_MAX_CHUNKS", 2)
+    document = "\n\n".join(f"paragraph {i} " + "word " * 40 for i in range(4))
+
+    _, timings = asyncio.run(long_document.map_reduce_document("q", document, 60, 10_000, 64))
+    assert timings["long_doc_truncated"] is True
+    assert timings["long_doc_chunks_dropped"] == 2
+    assert timings["long_doc_coverage"] == 0.5
+    assert sum(1 for request_id, _, _ in prompts if "-m" in request_id) == 2
+
+
+def test_final_reduce_has_one_vision_tag_per_image(monkeypatch):
+    prompts = []
+    monkeypatch.setattr(engine, "generate_with_vllm", _fake_generate(prompts))
+    images = [Image.new("RGB", (32, 32)) for _ in range(3)]
+
+    _, timings = asyncio.run(long_document.map_reduce_document("q", "short document", 60, 10_000, 64, images=images))
+    request_id, prompt, final_images = prompts[-1]
+    assert request_id.endswith("-final")
+    assert final_images == images
+    assert prompt.count(engine.VISION_TAG) == 3
+    assert timings["long_doc_truncated"] is False
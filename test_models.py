@@ -0,0 +1,38 @@
+from .models import CHATML_MESSAGE_OVERHEAD_TOKENS, window_messages
+
+
+def _message(role, tokens):
+    return {"role": role, "content": role, "tokens": tokens}
+
+
+def _cost(tokens):
+    return tokens + CHATML_MESSAGE_OVERHEAD_TOKENS
+
+
+def test_first_turn_stays_pinned_when_it_fits():
+    messages = [_message("user", 10), _message("assistant", 10)]
+    messages += [_message("user", 50), _message("assistant", 50), _message("user", 10)]
+    budget = _cost(10) * 3 + 5
+
+    window, dropped = window_messages(messages, budget)
+    assert window == [messages[0], messages[1], messages[-1]]
+    assert dropped == 2
+
+
+def test_oversized_first_turn_is_dropped_to_fit_current_message():
+    messages = [_message("user", 400), _message("assistant", 400)]
+    messages += [_message("user", 20), _message("assistant", 20), _message("user", 30)]
+    budget = _cost(20) * 2 + _cost(30)
+
+    window, dropped = window_messages(messages, budget)
+    assert window == messages[2:]
+    assert dropped == 2
+    assert sum(_cost(m["tokens"]) for m in window) <= budget
+
+
+def test_oversized_system_prompt_is_dropped():
+    messages = [_message("system", 500), _message("user", 30)]
+
+    window, dropped = window_messages(messages, 100)
+    assert window == [messages[-1]]
+    assert dropped == 1
@@ -0,0 +1,101 @@
+from .conversation_store import MemoryConversationStore, Message
+from .prompt_cache import PromptPrefixCache
+
+
+BUDGET = 100_000
+
+
+def _turn(store, conversation_id, i):
+    store.append(conversation_id, Message("user", f"question {i}"))
+    store.append(conversation_id, Message("assistant", f"answer {i}"))
+
+
+def test_invalidating_one_conversation_keeps_other_builds_cacheable():
+    class Store(MemoryConversationStore):
+        def get_messages(self, conversation_id):
+            # c2가 읽히는 사이 다른 대화가 삭제됨
+            if conversation_id == "c2":
+                self.delete("c1")
+            return super().get_messages(conversation_id)
+
+    store = Store(ttl_seconds=0)
+    cache = PromptPrefixCache(store)
+    _turn(store, "c1", 0)
+    _turn(store, "c2", 0)
+    cache.build("c1", "next", BUDGET)
+
+    cache.build("c2", "next", BUDGET)
+    assert cache.get_stats()["cached_prefixes"] == 1
+    assert cache.stats["invalidations"] == 1
+
+
+def test_trimming_rendered_messages_invalidates_prefix():
+    store = MemoryConversationStore(max_messages=4, ttl_seconds=0)
+    cache = PromptPrefixCache(store)
+    _turn(store, "c1", 0)
+    _turn(store, "c1", 1)
+    cache.build("c1", "q", BUDGET)
+
+    for i in range(2, 5):
+        # 매 턴 앞쪽 2개가 잘림 → 렌더링에 있던 메시지이므로 다시 렌더링
+        _turn(store, "c1", i)
+        prompt, used, dropped = cache.build("c1", "q", BUDGET)
+        assert prompt.count(f"answer {i}") == 1
+        assert f"question {i - 2}" not in prompt
+        assert (used, dropped) == (5, 0)
+
+    assert cache.stats["rekeyed"] == 0
+    assert cache.stats["invalidations"] == 3
+
+
+def test_trimming_pinned_first_turn_invalidates_windowed_prefix():
+    store = MemoryConversationStore(max_messages=6, ttl_seconds=0)
+    cache = PromptPrefixCache(store)
+    for i in range(3):
+        _turn(store, "c1", i)
+    prompt, used, dropped = cache.build("c1", "q", 40)
+    # 첫 턴은 고정, 나머지는 윈도우 밖
+    assert "question 0" in prompt and "question 1" not in prompt
+    assert (used, dropped) == (3, 4)
+
+    _turn(store, "c1", 3)  # 고정된 첫 턴이 잘림
+    assert cache.stats["invalidations"] == 1
+    prompt, used, dropped = cache.build("c1", "q", 40)
+    assert "question 0" not in prompt
+    assert used + dropped == len(store.get_messages("c1")) + 1
+    assert prompt.count("<|im_start|>") == used + 1
+
+
+def test_trimming_only_messages_outside_window_rekeys_prefix():
+    store = MemoryConversationStore(max_messages=6, ttl_seconds=0)
+    cache = PromptPrefixCache(store)
+    store.append("c1", Message("user", "x " * 200))
+    store.append("c1", Message("assistant", "answer 0"))
+    _turn(store, "c1", 1)
+    _turn(store, "c1", 2)
+    prompt, used, dropped = cache.build("c1", "q", 60)
+    # 첫 턴이 너무 커서 고정하지 않고 제외
+    assert "x x" not in prompt
+    assert (used, dropped) == (5, 2)
+
+    _turn(store, "c1", 3)  # 제외된 첫 턴만 잘림
+    prompt, used, dropped = cache.build("c1", "q", 60)
+    assert cache.stats["rekeyed"] == 1
+    assert cache.stats["invalidations"] == 0
+    assert (used, dropped) == (7, 0)
+    assert prompt.count("answer 3") == 1
+
+
+def test_replaced_history_is_rebuilt():
+    store = MemoryConversationStore(ttl_seconds=0)
+    cache = PromptPrefixCache(store)
+    _turn(store, "c1", 0)
+    _turn(store, "c1", 1)
+    cache.build("c1", "q", BUDGET)
+
+    head = store.get_messages("c1")
+    store.replace_head("c1", 2, head[0], [Message("system", "summary of turn 0")])
+    prompt, used, _ = cache.build("c1", "q", BUDGET)
+    assert "summary of turn 0" in prompt
+    assert "question 0" not in prompt
+    assert used == 4
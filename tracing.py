@@ -0,0 +1,251 @@
+"""
+요청 단계별 트레이싱
+- HTTP 미들웨어가 요청마다 트레이스를 시작하고, @traced 함수 호출이 하위 스팬으로 기록됨
+- 응답에 Server-Timing 헤더로 단계별 소요 시간 노출
+- OTLP/JSON 형식으로 로컬 파일(JSON Lines) 또는 OTLP HTTP 수집기로 내보냄 (백그라운드 스레드)
+- 진행 중인 트레이스가 없으면 @traced는 contextvar 조회 한 번만 수행
+"""
+
+import os
+import json
+import time
+import queue
+import random
+import asyncio
+import functools
+import threading
+import urllib.request
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from .logger_config import app_logger as logger
+
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1").lower() in ("1", "true", "yes")
+# 내보내기 대상: "" (끔) / file / otlp
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "/tmp/vllm_traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", "1000"))
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "vllm-server")
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    """요청 하나의 스팬 모음"""
+
+    __slots__ = ("trace_id", "root", "spans", "attributes")
+
+    def __init__(self, name: str):
+        self.trace_id = os.urandom(16).hex()
+        self.root = Span(name, None)
+        self.spans: List[Span] = []
+        self.attributes: Dict[str, Any] = {}
+
+    def server_timing(self) -> str:
+        """같은 이름의 스팬은 합산한 Server-Timing 헤더 값"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration_ms
+        parts = [f"{name};dur={dur:.1f}" for name, dur in totals.items()]
+        parts.append(f"total;dur={self.root.duration_ms:.1f}")
+        return ", ".join(parts)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        root_attrs = {**self.attributes, **(self.root.attributes or {})}
+        spans = [_otlp_span(self.trace_id, self.root, root_attrs)]
+        spans.extend(_otlp_span(self.trace_id, span, span.attributes) for span in self.spans)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attr("service.name", TRACE_SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": "vllm_server"}, "spans": spans}],
+            }]
+        }
+
+
+def _otlp_attr(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _otlp_span(trace_id: str, span: Span, attributes: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    data: Dict[str, Any] = {
+        "traceId": trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 2 if span.parent_id is None else 1,  # SERVER / INTERNAL
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [_otlp_attr(k, v) for k, v in (attributes or {}).items()],
+    }
+    if span.parent_id:
+        data["parentSpanId"] = span.parent_id
+    return data
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    def __init__(
+        self,
+        enabled: bool = TRACING_ENABLED,
+        export: str = TRACE_EXPORT,
+        sample_rate: float = TRACE_SAMPLE_RATE,
+        queue_size: int = TRACE_EXPORT_QUEUE_SIZE,
+    ):
+        self.enabled = enabled
+        self.export = export if enabled else ""
+        self.sample_rate = sample_rate
+        self._queue: "queue.Queue[Optional[Trace]]" = queue.Queue(maxsize=max(1, queue_size))
+        self._thread: Optional[threading.Thread] = None
+        self.stats: Dict[str, int] = {"traces": 0, "exported": 0, "export_dropped": 0, "export_failed": 0}
+        if self.export and self.export not in ("file", "otlp"):
+            logger.warning(f"⚠️ 알 수 없는 TRACE_EXPORT={self.export}, 내보내기 끔")
+            self.export = ""
+
+    # ===== 트레이스 수명 (HTTP 미들웨어) =====
+    def start_trace(self, name: str) -> Optional[Trace]:
+        if not self.enabled:
+            return None
+        trace = Trace(name)
+        _current_trace.set(trace)
+        _current_span.set(trace.root)
+        return trace
+
+    def finish_trace(self, trace: Trace, **attributes: Any) -> None:
+        trace.root.end_ns = time.time_ns()
+        trace.attributes.update(attributes)
+        self.stats["traces"] += 1
+        if self.export and random.random() < self.sample_rate:
+            self._ensure_thread()
+            try:
+                self._queue.put_nowait(trace)
+            except queue.Full:
+                self.stats["export_dropped"] += 1
+
+    def annotate(self, **attributes: Any) -> None:
+        """현재 트레이스에 속성 추가 (request_id 등)"""
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.attributes.update(attributes)
+
+    # ===== 스팬 =====
+    def traced(self, name: Optional[str] = None) -> Callable:
+        """함수 호출을 현재 트레이스의 스팬으로 기록하는 데코레이터 (sync/async 모두 지원)"""
+
+        def decorator(func: Callable) -> Callable:
+            span_name = name or func.__qualname__
+            if not self.enabled:
+                return func
+
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    parent = _current_span.get()
+                    if parent is None:
+                        return await func(*args, **kwargs)
+                    span, token = self._enter(span_name, parent)
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self._exit(span, token)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                parent = _current_span.get()
+                if parent is None:
+                    return func(*args, **kwargs)
+                span, token = self._enter(span_name, parent)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self._exit(span, token)
+            return wrapper
+
+        return decorator
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "export": self.export or None,
+            "sample_rate": self.sample_rate,
+            "export_queue": self._queue.qsize(),
+            **self.stats,
+        }
+
+    def shutdown(self) -> None:
+        """내보내기 대기 중인 트레이스 기록 후 스레드 종료"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    # ===== 내부 구현 =====
+    def _enter(self, name: str, parent: Span):
+        trace = _current_trace.get()
+        span = Span(name, parent.span_id)
+        if trace is not None:
+            trace.spans.append(span)
+        return span, _current_span.set(span)
+
+    def _exit(self, span: Span, token: Any) -> None:
+        span.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._export_loop, name="trace-exporter", daemon=True)
+            self._thread.start()
+
+    def _export_loop(self) -> None:
+        while True:
+            trace = self._queue.get()
+            if trace is None:
+                return
+            try:
+                payload = json.dumps(trace.to_otlp(), ensure_ascii=False)
+                if self.export == "file":
+                    with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                        f.write(payload + "\n")
+                else:
+                    req = urllib.request.Request(
+                        TRACE_OTLP_ENDPOINT,
+                        data=payload.encode("utf-8"),
+                        headers={"Content-Type": "application/json"},
+                        method="POST",
+                    )
+                    urllib.request.urlopen(req, timeout=5).close()
+                self.stats["exported"] += 1
+            except Exception as e:
+                self.stats["export_failed"] += 1
+                if self.stats["export_failed"] == 1:
+                    logger.warning(f"⚠️ 트레이스 내보내기 실패: {e}")
+
+
+# 전역 트레이서 인스턴스
+tracer = Tracer()
+traced = tracer.traced
@@ -0,0 +1,289 @@
+"""
+호출자(API 키) / LoRA 어댑터별 토큰 사용량 원장
+- 생성 1회마다 프롬프트 토큰, 이미지 수/추정 이미지 토큰, 생성 토큰, 엔진 시간을 메모리에 누적
+- USAGE_BUCKET_SECONDS 단위 버킷으로 모아 USAGE_FLUSH_INTERVAL_SECONDS마다 배치로 기록
+- 백엔드: sqlite (버킷 upsert, 기본) / file (append-only JSON Lines) / none (기록 안 함)
+- API 키 원문은 저장하지 않고 sha256 앞부분으로 식별 (헤더 없으면 anonymous, 백그라운드 작업은 internal)
+"""
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from .logger_config import app_logger as logger
+
+
+# sqlite | file | none
+USAGE_LEDGER_BACKEND = os.getenv("USAGE_LEDGER", "sqlite").lower()
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", "/tmp/vllm_usage.sqlite3")
+USAGE_FILE_PATH = os.getenv("USAGE_FILE_PATH", "/tmp/vllm_usage.jsonl")
+USAGE_BUCKET_SECONDS = int(os.getenv("USAGE_BUCKET_SECONDS", "60"))
+USAGE_FLUSH_INTERVAL_SECONDS = float(os.getenv("USAGE_FLUSH_INTERVAL_SECONDS", "30"))
+USAGE_API_KEY_HEADER = os.getenv("USAGE_API_KEY_HEADER", "X-API-Key")
+
+ANONYMOUS = "anonymous"
+# HTTP 요청 밖의 백그라운드 작업 (대화 요약 등)
+INTERNAL = "internal"
+# 누적 항목 (순서 = DB 컬럼 순서)
+FIELDS = (
+    "generations",
+    "prompt_tokens",
+    "cached_prompt_tokens",
+    "image_count",
+    "image_tokens_estimated",
+    "generated_tokens",
+    "engine_ms",
+)
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS usage (
+    bucket INTEGER NOT NULL,
+    caller TEXT NOT NULL,
+    lora_adapter TEXT NOT NULL,
+    {", ".join(f"{field} REAL NOT NULL DEFAULT 0" for field in FIELDS)},
+    PRIMARY KEY (bucket, caller, lora_adapter)
+);
+"""
+
+_current_caller: ContextVar[str] = ContextVar("usage_caller", default=ANONYMOUS)
+
+UsageKey = Tuple[int, str, str]
+
+
+def caller_id(api_key: Optional[str]) -> str:
+    """API 키 → 저장용 식별자 (원문 대신 해시 앞 12자리)"""
+    if not api_key:
+        return ANONYMOUS
+    return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+def current_caller() -> str:
+    return _current_caller.get()
+
+
+def _usage_values(timings: Dict[str, Any]) -> Tuple[float, ...]:
+    return (
+        1,
+        timings.get("prompt_tokens") or 0,
+        timings.get("cached_prompt_tokens") or 0,
+        timings.get("image_count") or 0,
+        timings.get("image_tokens_estimated") or 0,
+        timings.get("tokens_generated") or 0,
+        timings.get("generation_ms") or 0.0,
+    )
+
+
+def _add(target: Dict[Any, List[float]], key: Any, values: Tuple[float, ...]) -> None:
+    row = target.get(key)
+    if row is None:
+        target[key] = list(values)
+    else:
+        for i, value in enumerate(values):
+            row[i] += value
+
+
+def _row_dict(caller: str, lora_adapter: str, values: List[float]) -> Dict[str, Any]:
+    row: Dict[str, Any] = {"caller": caller, "lora_adapter": lora_adapter}
+    for field, value in zip(FIELDS, values):
+        row[field] = round(value, 1) if field == "engine_ms" else int(value)
+    return row
+
+
+class UsageLedger:
+    def __init__(
+        self,
+        backend: str = USAGE_LEDGER_BACKEND,
+        bucket_seconds: int = USAGE_BUCKET_SECONDS,
+        flush_interval: float = USAGE_FLUSH_INTERVAL_SECONDS,
+        db_path: str = USAGE_DB_PATH,
+        file_path: str = USAGE_FILE_PATH,
+    ):
+        if backend not in ("sqlite", "file", "none"):
+            logger.warning(f"⚠️ 알 수 없는 USAGE_LEDGER={backend}, sqlite 사용")
+            backend = "sqlite"
+        self.backend = backend
+        self.enabled = backend != "none"
+        self.bucket_seconds = max(1, bucket_seconds)
+        self.flush_interval = max(0.1, flush_interval)
+        self.file_path = file_path
+        # 기록 전 버킷 / 프로세스 시작 이후 누계
+        self._pending: Dict[UsageKey, List[float]] = {}
+        self._totals: Dict[Tuple[str, str], List[float]] = {}
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self.stats: Dict[str, int] = {"recorded": 0, "flushes": 0, "rows_written": 0, "flush_errors": 0}
+        if backend == "sqlite":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5.0)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        elif backend == "file":
+            Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+
+    # ===== 호출자 식별 (HTTP 미들웨어) =====
+    def identify(self, api_key: Optional[str]) -> None:
+        _current_caller.set(caller_id(api_key))
+
+    def run_as(self, caller: str) -> None:
+        """현재 컨텍스트(백그라운드 작업 등)의 호출자 지정"""
+        _current_caller.set(caller)
+
+    # ===== 기록 (엔진) =====
+    def record(self, lora_adapter: Optional[str], timings: Dict[str, Any]) -> None:
+        """generate_with_vllm 한 번의 사용량 누적"""
+        if not self.enabled:
+            return
+        caller = _current_caller.get()
+        adapter = lora_adapter or "base"
+        bucket = int(time.time()) // self.bucket_seconds * self.bucket_seconds
+        values = _usage_values(timings)
+        with self._lock:
+            _add(self._pending, (bucket, caller, adapter), values)
+            _add(self._totals, (caller, adapter), values)
+            self.stats["recorded"] += 1
+
+    def flush(self) -> int:
+        """대기 중인 버킷을 한 번에 기록. 기록한 행 수 반환"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            with self._io_lock:
+                if self._conn is not None:
+                    self._write_sqlite(batch)
+                else:
+                    self._write_file(batch)
+        except Exception:
+            # 실패한 배치는 다음 flush에서 다시 시도
+            with self._lock:
+                for key, values in batch.items():
+                    _add(self._pending, key, tuple(values))
+            self.stats["flush_errors"] += 1
+            raise
+        self.stats["flushes"] += 1
+        self.stats["rows_written"] += len(batch)
+        return len(batch)
+
+    def query(
+        self,
+        since: float,
+        until: float,
+        caller: Optional[str] = None,
+        lora_adapter: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """[since, until) 구간 버킷을 호출자/어댑터별로 합산 (버킷 단위로 정렬된 구간)"""
+        self.flush()
+        totals: Dict[Tuple[str, str], List[float]] = {}
+        with self._io_lock:
+            rows = self._read_sqlite(since, until) if self._conn is not None else self._read_file(since, until)
+        for bucket_caller, bucket_adapter, values in rows:
+            if caller is not None and bucket_caller != caller:
+                continue
+            if lora_adapter is not None and bucket_adapter != lora_adapter:
+                continue
+            _add(totals, (bucket_caller, bucket_adapter), tuple(values))
+        items = [_row_dict(c, a, values) for (c, a), values in totals.items()]
+        items.sort(key=lambda item: item["prompt_tokens"] + item["generated_tokens"], reverse=True)
+        return items
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.enabled:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"⚠️ 사용량 원장 기록 실패: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+            totals = [_row_dict(c, a, values) for (c, a), values in self._totals.items()]
+        return {
+            "backend": self.backend,
+            "bucket_seconds": self.bucket_seconds,
+            "flush_interval_seconds": self.flush_interval,
+            "pending_buckets": pending,
+            "since_start": totals,
+            **self.stats,
+        }
+
+    # ===== 내부 구현 =====
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.warning(f"⚠️ 사용량 원장 기록 실패: {e}")
+
+    def _write_sqlite(self, batch: Dict[UsageKey, List[float]]) -> None:
+        assert self._conn is not None
+        columns = ", ".join(FIELDS)
+        placeholders = ", ".join("?" for _ in FIELDS)
+        updates = ", ".join(f"{field} = {field} + excluded.{field}" for field in FIELDS)
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT INTO usage (bucket, caller, lora_adapter, {columns}) VALUES (?, ?, ?, {placeholders}) "
+                f"ON CONFLICT(bucket, caller, lora_adapter) DO UPDATE SET {updates}",
+                [(*key, *values) for key, values in batch.items()],
+            )
+
+    def _write_file(self, batch: Dict[UsageKey, List[float]]) -> None:
+        lines = []
+        for (bucket, caller, adapter), values in batch.items():
+            record = {"bucket": bucket, **_row_dict(caller, adapter, values)}
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+        with open(self.file_path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    def _read_sqlite(self, since: float, until: float) -> List[Tuple[str, str, List[float]]]:
+        assert self._conn is not None
+        rows = self._conn.execute(
+            f"SELECT caller, lora_adapter, {', '.join(f'SUM({field})' for field in FIELDS)} FROM usage "
+            "WHERE bucket >= ? AND bucket < ? GROUP BY caller, lora_adapter",
+            (self._bucket_floor(since), until),
+        ).fetchall()
+        return [(row[0], row[1], list(row[2:])) for row in rows]
+
+    def _read_file(self, since: float, until: float) -> List[Tuple[str, str, List[float]]]:
+        if not os.path.exists(self.file_path):
+            return []
+        lower = self._bucket_floor(since)
+        rows = []
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if lower <= record["bucket"] < until:
+                    rows.append((record["caller"], record["lora_adapter"], [record.get(field, 0) for field in FIELDS]))
+        return rows
+
+    def _bucket_floor(self, timestamp: float) -> int:
+        return int(timestamp) // self.bucket_seconds * self.bucket_seconds
+
+
+# 전역 사용량 원장 인스턴스
+usage_ledger = UsageLedger()
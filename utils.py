@@ -6,6 +6,8 @@ import base64
 from typing import Any, Dict, Optional, List
 from PIL import Image
 
+from .tracing import traced
+
 MAX_IMAGE_SIDE = int(os.getenv("MAX_IMAGE_SIDE", "1280"))
 
 
@@ -65,6 +67,7 @@ def extract_first_json_object(text: str) -> Optional[str]:
     return s[start:last + 1]
 
 
+@traced("json.parse")
 def try_parse_json(text: str) -> Optional[Dict[str, Any]]:
     try:
         return json.loads(text)
@@ -86,6 +89,25 @@ def try_parse_json(text: str) -> Optional[Dict[str, Any]]:
     return None
 
 
+# ===== 토큰 추정 =====
+def estimate_tokens(text: str) -> int:
+    """토크나이저 없이 쓰는 대략적인 토큰 수 추정
+    (ASCII는 약 4자당 1토큰, 한글 등 비 ASCII 문자는 1자당 1토큰)"""
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+# Qwen2-VL 계열: 28x28 패치(14px 패치 2x2 병합)당 1토큰
+IMAGE_TOKEN_PATCH = int(os.getenv("IMAGE_TOKEN_PATCH", "28"))
+
+
+def estimate_image_tokens(image: Image.Image) -> int:
+    w, h = image.size
+    return -(-w // IMAGE_TOKEN_PATCH) * -(-h // IMAGE_TOKEN_PATCH) + 2
+
+
 # ===== 이미지 처리 =====
 def _resize_image(img: Image.Image) -> Image.Image:
     try:
@@ -101,13 +123,27 @@ def _resize_image(img: Image.Image) -> Image.Image:
         return img
 
 
+def is_image_url(image_data: str) -> bool:
+    return image_data.startswith(("http://", "https://"))
+
+
+@traced("image.decode")
 def process_image_data(image_data: str) -> Image.Image:
     if image_data.startswith("data:"):
         base64_data = image_data.split(",")[1]
     else:
         base64_data = image_data
-    image_bytes = base64.b64decode(base64_data)
-    image = Image.open(io.BytesIO(image_bytes))
+    return process_image_bytes(base64.b64decode(base64_data))
+
+
+def process_image_bytes(image_bytes: bytes) -> Image.Image:
+    return process_image_file(io.BytesIO(image_bytes))
+
+
+def process_image_file(fp: Any) -> Image.Image:
+    """파일 객체(또는 경로)에서 이미지를 읽어 RGB 변환/리사이즈/최소 크기 보정"""
+    image = Image.open(fp)
+    image.load()
     if image.mode != "RGB":
         image = image.convert("RGB")
     image = _resize_image(image)
@@ -121,6 +157,7 @@ def process_image_data(image_data: str) -> Image.Image:
     return image
 
 
+@traced("image.decode_list")
 def process_image_list(image_list: List[str]) -> List[Image.Image]:
     processed_images: List[Image.Image] = []
     for idx, image_data in enumerate(image_list):